@@ -5,18 +5,33 @@ watchdog.timeout = 8
 watchdog.mode = None
 
 import alarm
+import bg95m3
 import boards
-from json import dumps, loads
+from channels import RecordWriter, read_records
+from series import encode_blocks, read_blocks
+from json import dumps
 import os
 from reading import Reading
 from services.global_logger import logger
+from services.batch_publisher import BatchPublisher, GROUP_CYCLE
+from services.bulk_uploader import BulkUploader
 from services.data_logger import DataLogger
 from services.device_manager import manager
+from services.sample_queue import SampleQueue
+from services.sample_scheduler import SampleScheduler
+from services.time_service import TimeService
+from services.transmit_scheduler import TransmitScheduler
 
 from sys import stdout
 import time
 import gc
 
+try:
+    import asyncio
+    from bg95m3_async import AsyncModem
+except ImportError:
+    asyncio = None
+
 gc.enable()
 
 # ---------------------------------------------------------------------
@@ -41,13 +56,53 @@ SM_TIMED                 = 0
 SM_COUNT                 = 1
 
 SAMPLE_MODE              = SM_COUNT
-SAMPLES                  = 1
-SAMPLE_WINDOW_DURATION   = 5   # seconds to collect high-res data
+
+SF_JSON                  = 0   # the sample queue holds one JSON reading per line
+SF_RECORDS               = 1   # the sample queue holds channel records (lib/channels.py), ~15x smaller, sent on <topic>/records
+SF_SERIES                = 2   # the sample queue holds per-channel delta/XOR series (lib/series.py), sent on <topic>/series
+
+SAMPLE_FORMAT            = SF_JSON
+SAMPLES                  = 1   # samples per cycle in SM_COUNT
+SAMPLE_WINDOW_DURATION   = 5   # seconds to collect high-res data in SM_TIMED
 SAMPLE_FREQ              = 5   # hz - how frequently samples are taken
 SAMPLE_INTERVAL          = 1 / SAMPLE_FREQ
 WARMUP_DURATION          = 5
 MODEM_RESPONSE_TIMEOUT   = 5   # seconds to wait for modem “OK” response
+MODEM_BRINGUP_TIMEOUT    = 60  # seconds transmit waits for a modem that's still booting
+ASYNC_MAIN               = False # run sampling, GPS, watchdog and modem I/O as asyncio tasks (needs the asyncio library in lib/)
+GPS_DRAIN_INTERVAL       = 0.5   # seconds between GPS buffer drains in the async main loop
+PUBLISH_WINDOW           = 4   # QoS1 publishes allowed in flight before waiting on acks
+PUBLISH_GROUPING         = GROUP_CYCLE   # GROUP_CYCLE: one topic per cycle, GROUP_DESCRIPTION: one per reading type
+PUBLISH_STATUS_MESSAGES  = False         # send "Connected!"/"Disconnecting!" to XBX/<id>/device each cycle
+PUBLISH_COMPRESSED       = False         # zlib-compress each batch into one binary message on <topic>/zlib
+PUBLISH_METRICS          = True          # send readings/messages/bytes/compression counts to XBX/<id>/metrics each cycle
 DEEPSLEEP_DURATION       = 5   # seconds to sleep between cycles
+MQTT_SESSION_REUSE       = True  # keep the MQTT socket connected between cycles...
+MQTT_SESSION_MAX_SLEEP   = 300   # ...as long as the sleep between them is at most this many seconds
+BULK_UPLOAD_ENABLED      = True
+BULK_UPLOAD_THRESHOLD    = 16384 # bytes queued above which data goes up as HTTPS POSTs instead of MQTT publishes
+BULK_UPLOAD_DIRS         = ()    # other directories sent along with the sample queue, e.g. "/sd/hrd" for the high-res CSVs
+SAMPLE_QUEUE_DIR         = "/sd/sample_data"
+SAMPLE_QUEUE_SEGMENT     = 16384 # bytes per queue segment file
+SAMPLE_QUEUE_MAX_BYTES   = 64 * 1024 * 1024  # oldest unsent samples are dropped past this
+DRAIN_TIME_LIMIT         = 120   # seconds a transmit spends draining a backlog before leaving the rest for next cycle
+MODEM_PSM_ENABLED        = False # let the modem sleep in LTE PSM between cycles instead of re-attaching
+MODEM_PSM_PERIODIC_TAU   = 3600  # seconds, requested T3412 (how often the modem checks in with the network)
+MODEM_PSM_ACTIVE_TIME    = 60    # seconds, requested T3324 (how long it stays reachable after each transmit)
+MODEM_EDRX_ENABLED       = False
+MODEM_EDRX_CYCLE         = 20.48 # seconds, rounded down to a valid LTE-M eDRX cycle
+MODEM_GNSS_ENABLED       = False # also get a fix from the modem's own GNSS (XTRA assisted) during warmup
+TIME_SYNC_INTERVAL       = 6 * 3600  # seconds between setting the RTCs from network or GPS time
+NETWORK_CACHE_ENABLED    = True  # try the operator/RAT/band the modem last registered on before a full scan
+NETWORK_SCAN_SEQUENCE    = bg95m3.DEFAULT_SCAN_SEQUENCE   # RAT scan order, e.g. RAT_EMTC + RAT_NBIOT
+NETWORK_IOT_OP_MODE      = bg95m3.IOT_OP_MODE_BOTH
+NETWORK_BANDS            = bg95m3.DEFAULT_BANDS           # GSM, eMTC and NB-IoT band bitmasks
+TRANSMIT_SCHEDULING      = True  # hold data back while the link is poor...
+TRANSMIT_MAX_LATENCY     = 3600  # ...for at most this many seconds
+TRANSMIT_MIN_RSRP        = -115  # dBm
+TRANSMIT_MIN_RSRQ        = -15   # dB
+TRANSMIT_MIN_CSQ         = 8     # AT+CSQ rssi, when the modem doesn't report RSRP/RSRQ
+MODEM_TRANSMIT_POWER     = 0.6   # watts, average modem draw while transmitting (estimate, for J/KB)
 
 # ---------------------------------------------------------------------
 # STATE DEFINITIONS
@@ -57,6 +112,15 @@ MODE_MEASURE   = 1
 MODE_TRANSMIT  = 2
 MODE_DEEPSLEEP = 3
 
+modem_configured = False   # power saving is configured the first time the modem comes up
+modem_gnss = None          # bg95m3.GNSS once the modem is up, if MODEM_GNSS_ENABLED
+network_cache = None       # bg95m3.NetworkCache once the modem is up
+sample_queue = None        # SampleQueue, once the SD card is up in measure mode
+time_service = TimeService(manager.devices['logicboard.rtc'], getattr(boards.logicboard, 'OnboardRTC', None),
+                           boards.logicboard.CellularModem, manager.devices['attitudeboard.gps'], TIME_SYNC_INTERVAL)
+transmit_scheduler = TransmitScheduler(boards.logicboard.CellularModem, TRANSMIT_MIN_RSRP, TRANSMIT_MIN_RSRQ, TRANSMIT_MIN_CSQ,
+                                       TRANSMIT_MAX_LATENCY, MODEM_TRANSMIT_POWER) if TRANSMIT_SCHEDULING else None
+
 # ---------------------------------------------------------------------
 # MODE IMPLEMENTATIONS (each returns the next mode)
 # ---------------------------------------------------------------------
@@ -72,10 +136,18 @@ def warmup_mode():
     
     gps = manager.devices['attitudeboard.gps']
     modem = boards.logicboard.CellularModem
+    modem.link_state.reset_stats()
+    
+    if(network_cache is not None):
+        network_cache.begin_cycle()
+    
+    if(MODEM_PSM_ENABLED and modem.is_up):
+        modem.wake()
     
     while time.monotonic() - start_time < WARMUP_DURATION:
-        gps_ready = gps.has_fix
-        modem_ready = modem.is_comms_ready()
+        gps_ready = gps.has_fix or poll_modem_gnss()
+        modem_ready = step_modem_bring_up() and step_network_cache() and modem.is_comms_ready()
+        time_service.step()
         
         if((gps_ready == True) and (modem_ready == True)):
             logger.info(f"GPS and Modem are ready, entering Measure Mode")
@@ -83,17 +155,148 @@ def warmup_mode():
         else:
             logger.info(f"GPS   Ready: {gps_ready}")
             logger.info(f"Modem Ready: {modem_ready}")
-            time.sleep(1)
+            
+            #Keep stepping the modem's bring-up while waiting, rather than sleeping the whole second
+            next_check = time.monotonic() + 1
+            while time.monotonic() < next_check and not step_modem_bring_up():
+                time.sleep(0.05)
+            time.sleep(max(0, next_check - time.monotonic()))
     else:
         logger.info(f"GPS and modem are not ready, entering Measure Mode")    
         
     return MODE_MEASURE
 
+SENSORS = ['attitudeboard.barometer', 'attitudeboard.imu', 'attitudeboard.gps', 'atlassenseboard.conductivity', 'atlassenseboard.dissolvedoxygen', 'atlassenseboard.watertemperature']
+EZO_COLLECT_TIMEOUT      = 2   # seconds to wait on an EZO conversion before giving up on it this sample
+EZO_POLL_INTERVAL        = 0.02
+
+def take_sample(dl):
+    """
+        Read every sensor once, log each reading to its high-res CSV and return them.
+        EZO circuits are all started first and collected last, so their conversions overlap
+        with each other and with reading the other sensors
+    """
+    readings = []
+    keep = sample_keeper(dl, readings)
+    
+    converting = start_sample(keep)
+    deadline = time.monotonic() + EZO_COLLECT_TIMEOUT
+    
+    while collect_sample(keep, converting, deadline):
+        time.sleep(EZO_POLL_INTERVAL)
+    
+    return finish_sample(dl, readings)
+
+async def take_sample_async(dl):
+    """
+        take_sample, awaiting between EZO polls so the other tasks run while the circuits convert
+    """
+    readings = []
+    keep = sample_keeper(dl, readings)
+    
+    converting = start_sample(keep)
+    deadline = time.monotonic() + EZO_COLLECT_TIMEOUT
+    
+    while collect_sample(keep, converting, deadline):
+        await asyncio.sleep(EZO_POLL_INTERVAL)
+    
+    return finish_sample(dl, readings)
+
+def sample_keeper(dl, readings):
+    """
+        Returns keep(sensor, all_readings), which logs a sensor's readings and adds them to readings
+    """
+    def keep(sensor, all_readings):
+        for r in all_readings.values(): 
+            if(r is not None):
+                logger.info(f"{sensor} - {r}")
+                dl.log_reading(r)
+                readings.append(r)
+            else:
+                logger.warning(f"Reading from {sensor} was {r}")
+    
+    return keep
+
+def start_sample(keep):
+    """
+        Start every EZO conversion, then read the other sensors. Returns the sensors still converting
+    """
+    converting = [sensor for sensor in SENSORS if hasattr(manager.devices[sensor], 'start_reading') and manager.devices[sensor].start_reading()]
+    
+    for sensor in SENSORS:
+        if(sensor not in converting):
+            keep(sensor, manager.devices[sensor].read())
+    
+    return converting
+
+def collect_sample(keep, converting, deadline):
+    """
+        Collect every conversion that's finished, giving up on any still going past deadline.
+        Returns True while some are still converting
+    """
+    for sensor in converting[:]:
+        all_readings = manager.devices[sensor].collect_reading()
+        
+        if(all_readings is not None):
+            converting.remove(sensor)
+            keep(sensor, all_readings)
+        elif(time.monotonic() > deadline):
+            logger.warning(f"{sensor} didn't finish converting in {EZO_COLLECT_TIMEOUT} s")
+            manager.devices[sensor].cancel_reading()
+            converting.remove(sensor)
+    
+    return len(converting) > 0
+
+def finish_sample(dl, readings):
+    """
+        Add the modem GNSS and status readings to a sample's readings and return them
+    """
+    if(modem_gnss is not None):
+        for r in modem_gnss.read().values():
+            dl.log_reading(r)
+            readings.append(r)
+    
+    status_readings = [time_service.take_reading(), network_cache.take_reading() if network_cache is not None else None]
+    
+    if(transmit_scheduler is not None):
+        status_readings.extend(transmit_scheduler.take_readings())
+    
+    if(sample_queue is not None):
+        status_readings.extend(sample_queue.take_readings())
+    
+    for r in status_readings:
+        if(r is not None):
+            dl.log_reading(r)
+            readings.append(r)
+    
+    return readings
+
+def write_samples(sample_file, sample_readings):
+    """
+        Append readings to an open sample queue segment in SAMPLE_FORMAT
+    """
+    sample_readings = [r for r in sample_readings if r is not None]
+    
+    if(SAMPLE_FORMAT == SF_SERIES):
+        for block in encode_blocks(sample_readings):
+            sample_file.write(block)
+    
+    elif(SAMPLE_FORMAT == SF_RECORDS):
+        writer = RecordWriter(sample_file)
+        for r in sample_readings:
+            writer.write(r)
+    
+    else:
+        for r in sample_readings:
+            sample_file.write(dumps(r.__dict__))
+            sample_file.write("\n")
+
 def measure_mode():
     """
-        Collect high-resolution data for SAMPLE_WINDOW_DURATION,
-        taking one sample every SAMPLE_INTERVAL seconds.
+        Collect high-resolution data for SAMPLE_WINDOW_DURATION (SM_TIMED) or SAMPLES samples (SM_COUNT),
+        starting one sample every SAMPLE_INTERVAL seconds on a fixed schedule.
     """
+    global sample_queue
     
     logger.info(f"Memory Free: {gc.mem_free()}")
     gc.collect()
@@ -102,58 +305,41 @@ def measure_mode():
     logger.info("Entering Measure Mode")
     logger.info("Setting up DataLogger")
     
-    # 1. Create the directory if it doesn’t exist
-    if "sample_data" not in os.listdir("/sd"):
-        logger.info("Log directory doesn't exist...")
-        logger.info("Creating log directory...")
-        os.mkdir("/sd/sample_data")
-        logger.info("Log directory created...")
-
-    # 2. Create the file if it doesn’t exist
+    #Samples that weren't sent stay queued, this cycle's are appended after them
+    if(sample_queue is None):
+        sample_queue = SampleQueue(SAMPLE_QUEUE_DIR, SAMPLE_QUEUE_SEGMENT, SAMPLE_QUEUE_MAX_BYTES)
     
     sample_readings = []
     
-    sample_filename = f"tmp.sample"
-    logger.info(f"Creating sample file: {sample_filename}")
-    sample_file = open(f"/sd/sample_data/{sample_filename}", "w")
-    logger.info("Created sample file")
+    logger.info(f"Opening sample queue, {sample_queue.depth()} bytes queued")
+    sample_file = sample_queue.open_segment(binary=SAMPLE_FORMAT != SF_JSON)
         
     dl = DataLogger()
     
-    samples_taken = 0
-    
-    sensors = ['attitudeboard.barometer', 'attitudeboard.imu', 'attitudeboard.gps', 'atlassenseboard.conductivity', 'atlassenseboard.dissolvedoxygen', 'atlassenseboard.watertemperature']
-
     # logger.info(manager.all_devices())
     
-    while samples_taken < SAMPLES:
-        for sensor in sensors:
-            all_readings = manager.devices[sensor].read()
-            
-            for r in all_readings.values(): 
-                if(r is not None):
-                    logger.info(f"{sensor} - {r}")
-                    dl.log_reading(r)
-                    sample_readings.append(r)
-                else:
-                    logger.warning(f"Reading from {sensor} was {r}")
+    if(SAMPLE_MODE == SM_TIMED):
+        scheduler = SampleScheduler(SAMPLE_FREQ, duration=SAMPLE_WINDOW_DURATION)
+    else:
+        scheduler = SampleScheduler(SAMPLE_FREQ, count=SAMPLES)
     
-        gc.collect()
-        
+    while scheduler.wait():
         logger.info("Taking measurement")
-        samples_taken = samples_taken + 1
-        time.sleep(SAMPLE_INTERVAL)
-
-    logger.info(f"Writing samples to: {sample_filename}")
+        time_service.step()
+        sample_readings.extend(take_sample(dl))
+    
+        gc.collect()
+    
+    for r in scheduler.take_readings():
+        dl.log_reading(r)
+        sample_readings.append(r)
 
-    for r in sample_readings:
-        if(r is not None):
-            sample_file.write(dumps(r.__dict__))
-            sample_file.write("\n")
+    logger.info("Writing samples to the sample queue")
+    write_samples(sample_file, sample_readings)
         
-    logger.info(f"Closing sample file: {sample_filename}")
+    logger.info("Closing sample queue segment")
     sample_file.close()
-    logger.info(f"Closed sample file: {sample_filename}")
+    logger.info(f"Closed sample queue segment, {sample_queue.depth()} bytes queued")
     
     # Once the sampling window has elapsed, transition to TRANSMIT
     logger.info("Exiting Measure Mode")
@@ -164,6 +350,69 @@ def measure_mode():
     return MODE_TRANSMIT
 
     
+def bulk_upload():
+    """
+        When more than BULK_UPLOAD_THRESHOLD bytes are queued, drain the sample queue and the
+        other backlog directories over HTTPS. Returns how many bytes went up
+    """
+    modem = boards.logicboard.CellularModem
+    uploader = BulkUploader(modem, f"https://{os.getenv('AWS_IOT_ENDPOINT')}:8443/topics/XBX/{os.getenv('DEVICE_ID')}/upload/{{name}}?qos=1", BULK_UPLOAD_DIRS)
+    
+    queued = sample_queue.depth() + uploader.queued_bytes()
+    
+    if(queued <= BULK_UPLOAD_THRESHOLD):
+        return 0
+    
+    logger.info(f"{queued} bytes queued, uploading over HTTPS")
+    
+    if(not modem.configure_http()):
+        logger.warning("Failed to configure the HTTP client, sending over MQTT")
+        return 0
+    
+    #Parts are cut on line breaks, and each is acknowledged by its HTTP response
+    if(sample_queue.drain(uploader.upload_file, DRAIN_TIME_LIMIT)):
+        uploader.upload()
+    
+    logger.info(f"HTTPS: {uploader.bytes_sent} bytes in {uploader.posts} POSTs, {uploader.bytes_per_second:.0f} B/s")
+    
+    return uploader.bytes_sent
+
+def segment_batches(publisher, segment_file):
+    """
+        The publisher's batches for the rest of an open sample queue segment, in SAMPLE_FORMAT
+    """
+    if(SAMPLE_FORMAT == SF_SERIES):
+        return publisher.series_batches(read_blocks(segment_file))
+    elif(SAMPLE_FORMAT == SF_RECORDS):
+        return publisher.record_batches(read_records(segment_file))
+    
+    return publisher.batches(segment_file)
+
+def acknowledged_offset(publish_results, sent_all, offset, size):
+    """
+        Returns size if every batch of a segment was sent and acknowledged, otherwise offset, so the whole segment is sent again
+    """
+    for result in publish_results:
+        if(result['result'] != 0):
+            logger.warning(f"Batch not delivered: {result}")
+    
+    return size if sent_all and all(result['result'] == 0 for result in publish_results) else offset
+
+def publish_segment(mqtt_client, publisher, path, offset, size):
+    """
+        Publish a sample queue segment from offset. Returns the offset it's acknowledged up to
+    """
+    with open(path, "r" if SAMPLE_FORMAT == SF_JSON else "rb") as segment_file:
+        segment_file.seek(offset)
+        
+        batches = segment_batches(publisher, segment_file)
+        publish_results = mqtt_client.publish_many(batches, window=PUBLISH_WINDOW)
+        
+        #publish_many stops early if the connection drops, leaving batches unsent
+        sent_all = next(batches, None) is None
+    
+    return acknowledged_offset(publish_results, sent_all, offset, size)
+
 def transmit_mode():
     """
         Power on modem and wait up to MODEM_RESPONSE_TIMEOUT seconds
@@ -174,12 +423,13 @@ def transmit_mode():
     gc.collect()
     logger.info(f"Memory Free: {gc.mem_free()}")
 
-    #unsent_samples_file = open("/sd/sample_data/uss.sample", "r")
-    try:
-        tmp_sample_file = open("/sd/sample_data/tmp.sample", "r")
-        gc.collect()
-    except Exception as e:
-        logger.warning(f"Failed to open tmp sample file, exiting transmit mode: {e}")
+    #GNSS has had warmup and measure to get a fix, LTE needs the RF back now
+    if(modem_gnss is not None and modem_gnss.started is not None):
+        modem_gnss.poll()
+        modem_gnss.stop()
+    
+    if(sample_queue is None or sample_queue.depth() == 0):
+        logger.info("Nothing queued to transmit")
         return MODE_DEEPSLEEP
         
     gc.collect()
@@ -190,40 +440,97 @@ def transmit_mode():
      
     elif(COMMS_MODE == CELLULAR):
         start_time = time.monotonic()
+        reuse_session = MQTT_SESSION_REUSE and DEEPSLEEP_DURATION <= MQTT_SESSION_MAX_SLEEP
         logger.info("Waiting for modem to warm up")
         
+        if(not boards.logicboard.CellularModem.is_up):
+            logger.info("Waiting for modem to finish booting")
+            
+            while not step_modem_bring_up():
+                if(time.monotonic() - start_time > MODEM_BRINGUP_TIMEOUT):
+                    logger.warning("Modem didn't come up, skipping transmit")
+                    return MODE_DEEPSLEEP
+                time.sleep(0.05)
+            
+            start_time = time.monotonic()
+        
         while time.monotonic() - start_time < MODEM_RESPONSE_TIMEOUT:
-            if boards.logicboard.CellularModem.is_comms_ready():
+            if step_network_cache() and boards.logicboard.CellularModem.is_comms_ready():
                 logger.info(f"Modem Comms Ready: {boards.logicboard.CellularModem.is_comms_ready()}")
+                
+                if(modem_gnss is not None):
+                    modem_gnss.refresh_xtra()
+                
+                #Samples stay queued while the link is poor
+                if(transmit_scheduler is not None and not transmit_scheduler.should_transmit()):
+                    return MODE_DEEPSLEEP
+                
+                transmit_start = time.monotonic()
+                
+                #HTTPS parts are cut on line breaks, so only JSON samples go that way
+                bulk_bytes = bulk_upload() if BULK_UPLOAD_ENABLED and SAMPLE_FORMAT == SF_JSON else 0
+                
+                if(sample_queue.depth() == 0):
+                    logger.info(f"Transmit phase took {time.monotonic() - start_time:.1f} s over HTTPS")
+                    
+                    if(transmit_scheduler is not None):
+                        transmit_scheduler.record(bulk_bytes, time.monotonic() - transmit_start)
+                    
+                    return MODE_DEEPSLEEP
+                
                 logger.info(f"Setting up MQTT Connection")
                 
                 gc.collect()
                 
-                mqtt_client = boards.logicboard.CellularModem.create_mqtt_connection(os.getenv("DEVICE_ID"), os.getenv("AWS_IOT_ENDPOINT"))
+                handshakes_before = boards.logicboard.CellularModem.mqtt_handshakes
+                
+                if(reuse_session):
+                    mqtt_client = boards.logicboard.CellularModem.get_mqtt_session(os.getenv("DEVICE_ID"), os.getenv("AWS_IOT_ENDPOINT"))
+                else:
+                    boards.logicboard.CellularModem.end_mqtt_session()
+                    mqtt_client = boards.logicboard.CellularModem.create_mqtt_connection(os.getenv("DEVICE_ID"), os.getenv("AWS_IOT_ENDPOINT"))
                 
                 if(mqtt_client is None):
                     logger.warning(f"MQTT client didn't initialize")
                     return MODE_DEEPSLEEP
                 
-                if(not mqtt_client.is_open()):
-                    mqtt_client.open()
-                    gc.collect()
-                
-                if(not mqtt_client.is_connected()):
-                    mqtt_client.connect()
-                    gc.collect()
+                if(not reuse_session):
+                    if(not mqtt_client.is_open()):
+                        mqtt_client.open()
+                        gc.collect()
+                    
+                    if(not mqtt_client.is_connected()):
+                        mqtt_client.connect()
+                        gc.collect()
                         
                 if(mqtt_client.is_connected()):
-                    mqtt_client.publish(f"XBX/{os.getenv('DEVICE_ID')}/device", "Connected!")
+                    if(PUBLISH_STATUS_MESSAGES):
+                        mqtt_client.publish(f"XBX/{os.getenv('DEVICE_ID')}/device", "Connected!")
                     gc.collect()
 
-                    for line in tmp_sample_file:
-                        jsonline = loads(line)
-                        mqtt_client.publish(f"XBX/{os.getenv('DEVICE_ID')}/{jsonline['description']}", line)
+                    publisher = BatchPublisher(f"XBX/{os.getenv('DEVICE_ID')}", bg95m3.MQTT_MAX_PAYLOAD, group=PUBLISH_GROUPING, compress=PUBLISH_COMPRESSED)
+                    publish_start = time.monotonic()
+                    sample_queue.drain(lambda path, offset, size: publish_segment(mqtt_client, publisher, path, offset, size), DRAIN_TIME_LIMIT)
+                    publish_time = time.monotonic() - publish_start
+                    logger.info(f"Packed {publisher.readings_packed} readings into {publisher.messages_built} messages ({publisher.raw_bytes} bytes, {publisher.bytes_built} after compression, {publisher.bytes_on_air} on air)")
+                    logger.info(f"MQTT: {publisher.bytes_built} bytes in {publish_time:.1f} s, {publisher.bytes_built / publish_time if publish_time else 0:.0f} B/s")
+                    
+                    if(PUBLISH_METRICS):
+                        metrics = publisher.metrics()
+                        metrics['queue_bytes'] = sample_queue.depth()
+                        metrics['drain_rate'] = round(sample_queue.drain_rate)
+                        mqtt_client.publish_many([(f"XBX/{os.getenv('DEVICE_ID')}/metrics", dumps(metrics))])
                 
-                    mqtt_client.publish(f"XBX/{os.getenv('DEVICE_ID')}/device", "Disconnecting!")
-                    mqtt_client.disconnect()
-                    mqtt_client.close()
+                    if(not reuse_session):
+                        if(PUBLISH_STATUS_MESSAGES):
+                            mqtt_client.publish(f"XBX/{os.getenv('DEVICE_ID')}/device", "Disconnecting!")
+                        mqtt_client.disconnect()
+                        mqtt_client.close()
+                    
+                    logger.info(f"Transmit phase took {time.monotonic() - start_time:.1f} s with {boards.logicboard.CellularModem.mqtt_handshakes - handshakes_before} TLS handshakes (session reuse: {reuse_session})")
+                    
+                    if(transmit_scheduler is not None):
+                        transmit_scheduler.record(bulk_bytes + publisher.bytes_built, time.monotonic() - transmit_start)
                     
                     return MODE_DEEPSLEEP
                 
@@ -272,6 +579,7 @@ def deepsleep_mode():
     """
     # ›› power off sensors and modem (placeholder)
     logger.info("Entering Deep Sleep Mode")
+    logger.info(f"Link state cache saved {boards.logicboard.CellularModem.link_state.commands_saved} readiness AT commands this cycle")
     
     # After waking up, go back to MEASURE
     # time_alarm = alarm.time.TimeAlarm(monotonic_time = time.monotonic() + DEEPSLEEP_DURATION)
@@ -283,6 +591,75 @@ def deepsleep_mode():
 # ---------------------------------------------------------------------
 # MAIN LOOP
 # ---------------------------------------------------------------------
+def step_modem_bring_up():
+    """
+        Step the modem's bring-up, configuring power saving, the radio and GNSS the first time it comes up. Returns True once it's up
+    """
+    global modem_configured, modem_gnss, network_cache
+    
+    modem = boards.logicboard.CellularModem
+    
+    if(not modem.step_bring_up()):
+        return False
+    
+    if(not modem_configured):
+        modem_configured = True
+        
+        if(COMMS_MODE == CELLULAR):
+            configure_power_saving()
+            
+            network_cache = bg95m3.NetworkCache(modem, NETWORK_SCAN_SEQUENCE, NETWORK_IOT_OP_MODE, NETWORK_BANDS)
+            network_cache.begin_cycle()
+            network_cache.configure(use_cache=NETWORK_CACHE_ENABLED)
+        
+        if(MODEM_GNSS_ENABLED):
+            modem_gnss = bg95m3.GNSS(modem)
+    
+    return True
+
+def step_network_cache():
+    """
+        Check registration through the network cache, so it's timed and the cached band is given up on if it isn't working.
+        Returns True once registered
+    """
+    if(network_cache is None):
+        return boards.logicboard.CellularModem.is_registered_to_network()
+    
+    return network_cache.step()
+
+async def step_network_cache_async(modem):
+    """
+        step_network_cache through an AsyncModem
+    """
+    if(network_cache is None):
+        return await modem.is_registered_to_network()
+    
+    return await network_cache.step_async(modem)
+
+def poll_modem_gnss():
+    """
+        Start the modem's GNSS once the modem is up, then ask it for a fix. Returns True once it has one
+    """
+    if(modem_gnss is None):
+        return False
+    
+    if(modem_gnss.started is None and not modem_gnss.start()):
+        return False
+    
+    return modem_gnss.poll()
+
+def configure_power_saving():
+    """
+        Request PSM/eDRX once the modem is up and log what the network granted
+    """
+    modem = boards.logicboard.CellularModem
+    
+    if(modem.set_psm(MODEM_PSM_ENABLED, MODEM_PSM_PERIODIC_TAU, MODEM_PSM_ACTIVE_TIME) and MODEM_PSM_ENABLED):
+        modem.verify_psm(MODEM_PSM_PERIODIC_TAU, MODEM_PSM_ACTIVE_TIME)
+    
+    if(modem.set_edrx(MODEM_EDRX_ENABLED, MODEM_EDRX_CYCLE) and MODEM_EDRX_ENABLED):
+        modem.verify_edrx()
+
 def main():
     current_mode = MODE_WARMUP
 
@@ -302,5 +679,149 @@ def main():
         # small pause before next iteration to prevent tight-loop CPU spin
         time.sleep(0.1)
         
+# ---------------------------------------------------------------------
+# ASYNC MAIN LOOP
+# ---------------------------------------------------------------------
+async def watchdog_task():
+    while True:
+        watchdog.feed()
+        await asyncio.sleep(1)
+
+async def gps_task():
+    """
+        Keep the GPS UART drained so fixes are current whenever a sample is taken
+    """
+    gps = manager.devices['attitudeboard.gps']
+    
+    while True:
+        gps.update()
+        time_service.step(use_modem=False)
+        await asyncio.sleep(GPS_DRAIN_INTERVAL)
+
+async def publish_segment_async(modem, mqtt_client, publisher, path, offset, size):
+    """
+        publish_segment through the AsyncModem
+    """
+    with open(path, "r" if SAMPLE_FORMAT == SF_JSON else "rb") as segment_file:
+        segment_file.seek(offset)
+        
+        batches = segment_batches(publisher, segment_file)
+        publish_results = await modem.publish_many(mqtt_client, batches, window=PUBLISH_WINDOW)
+        sent_all = next(batches, None) is None
+    
+    return acknowledged_offset(publish_results, sent_all, offset, size)
+
+async def sample_task(samples_ready):
+    """
+        Take a window of samples every cycle (as measure_mode does) and append them to the sample queue, without waiting on the modem
+    """
+    dl = DataLogger()
+    
+    while True:
+        logger.info("Taking measurements")
+        sample_readings = []
+        
+        if(SAMPLE_MODE == SM_TIMED):
+            scheduler = SampleScheduler(SAMPLE_FREQ, duration=SAMPLE_WINDOW_DURATION)
+        else:
+            scheduler = SampleScheduler(SAMPLE_FREQ, count=SAMPLES)
+        
+        while True:
+            delay = scheduler.next_delay()
+            if(delay is None):
+                break
+            
+            await asyncio.sleep(delay)
+            scheduler.begin_sample()
+            
+            sample_readings.extend(await take_sample_async(dl))
+            
+            gc.collect()
+        
+        for r in scheduler.take_readings():
+            dl.log_reading(r)
+            sample_readings.append(r)
+        
+        sample_file = sample_queue.open_segment(binary=SAMPLE_FORMAT != SF_JSON)
+        write_samples(sample_file, sample_readings)
+        sample_file.close()
+        logger.info(f"Closed sample queue segment, {sample_queue.depth()} bytes queued")
+        
+        samples_ready.set()
+        await asyncio.sleep(DEEPSLEEP_DURATION)
+
+async def transmit_task(samples_ready):
+    """
+        Drain the sample queue after each sampling window, awaiting the modem instead of blocking on it.
+        Samples stay on the SD card until their publishes are acknowledged, as in transmit_mode
+    """
+    modem = AsyncModem(boards.logicboard.CellularModem)
+    reuse_session = MQTT_SESSION_REUSE and DEEPSLEEP_DURATION <= MQTT_SESSION_MAX_SLEEP
+    
+    while not step_modem_bring_up():
+        await asyncio.sleep(0.05)
+    
+    while True:
+        await samples_ready.wait()
+        samples_ready.clear()
+        
+        await time_service.step_async(modem)
+        
+        if(sample_queue.depth() == 0):
+            continue
+        
+        if(not await step_network_cache_async(modem)):
+            logger.info(f"Modem isn't registered yet, keeping {sample_queue.depth()} queued bytes for next cycle")
+            continue
+        
+        if(transmit_scheduler is not None and not await transmit_scheduler.should_transmit_async(modem)):
+            continue
+        
+        start_time = time.monotonic()
+        
+        mqtt_client = await modem.get_mqtt_session(os.getenv("DEVICE_ID"), os.getenv("AWS_IOT_ENDPOINT"))
+        
+        if(mqtt_client is None):
+            logger.warning(f"MQTT client didn't connect, keeping {sample_queue.depth()} queued bytes for next cycle")
+            continue
+        
+        publisher = BatchPublisher(f"XBX/{os.getenv('DEVICE_ID')}", bg95m3.MQTT_MAX_PAYLOAD, group=PUBLISH_GROUPING, compress=PUBLISH_COMPRESSED)
+        await sample_queue.drain_async(lambda path, offset, size: publish_segment_async(modem, mqtt_client, publisher, path, offset, size), DRAIN_TIME_LIMIT)
+        
+        if(PUBLISH_METRICS):
+            metrics = publisher.metrics()
+            metrics['queue_bytes'] = sample_queue.depth()
+            metrics['drain_rate'] = round(sample_queue.drain_rate)
+            await modem.publish_many(mqtt_client, [(f"XBX/{os.getenv('DEVICE_ID')}/metrics", dumps(metrics))])
+        
+        if(not reuse_session):
+            await modem.end_mqtt_session()
+        
+        logger.info(f"Transmitted {publisher.readings_packed} readings in {time.monotonic() - start_time:.1f} s, {sample_queue.depth()} bytes still queued")
+        
+        if(transmit_scheduler is not None):
+            transmit_scheduler.record(publisher.bytes_built, time.monotonic() - start_time)
+
+async def async_main():
+    global sample_queue
+    
+    #Samples that weren't sent before a reset are still queued on the SD card
+    if(sample_queue is None):
+        sample_queue = SampleQueue(SAMPLE_QUEUE_DIR, SAMPLE_QUEUE_SEGMENT, SAMPLE_QUEUE_MAX_BYTES)
+    
+    samples_ready = asyncio.Event()
+    
+    tasks = [watchdog_task(), gps_task(), sample_task(samples_ready)]
+    
+    if(COMMS_MODE == CELLULAR):
+        tasks.append(transmit_task(samples_ready))
+    
+    await asyncio.gather(*tasks)
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    if(ASYNC_MAIN and asyncio is not None):
+        asyncio.run(async_main())
+    else:
+        if(ASYNC_MAIN):
+            logger.warning("asyncio isn't installed, running the blocking main loop")
+        main()
\ No newline at end of file
@@ -0,0 +1,124 @@
+"""
+Host-side benchmark for the asyncio main loop: wall-clock per measure/transmit cycle, run sequentially
+with the blocking driver vs overlapped with lib/bg95m3_async.AsyncModem.
+
+Each cycle samples for SAMPLE_TIME seconds, then opens, connects, publishes and closes an MQTT session on a
+fake modem whose +QMTOPEN/+QMTCONN results arrive after OPEN_DELAY/CONNECT_DELAY, standing in for the
+30-120 s those take on a marginal LTE-M link (scaled down 60x). Sequentially the two add up every cycle;
+overlapped, the next cycle samples while the previous one is still waiting on the modem.
+
+    python3 host/bench_async_cycle.py
+"""
+import asyncio
+import logging
+import time
+
+import shims
+shims.install(log_level=logging.ERROR)
+
+from fake_modem import FakeModem, make_modem
+
+SAMPLE_TIME = 1.0
+OPEN_DELAY = 1.0
+CONNECT_DELAY = 0.8
+CYCLES = 4
+MESSAGES = [("XBX/bench/samples", '[{"value": %d, "unit": "C"}]' % index) for index in range(6)]
+
+class SessionModem(FakeModem):
+    """
+    FakeModem that also opens, connects, disconnects and closes MQTT sockets, with the results arriving as delayed URCs
+    """
+    def __init__(self):
+        super().__init__()
+        self.open_sockets = set()
+        self.connected_sockets = set()
+
+    def write(self, data):
+        if self.awaiting is not None:
+            return super().write(data)
+
+        command = bytes(data).strip(b"\r\n").decode("utf-8")
+
+        if command == "AT+QMTOPEN?":
+            listing = "".join(f'\r\n+QMTOPEN: {socket_id},"bench",8883' for socket_id in sorted(self.open_sockets))
+            self.respond((0, f"{listing}\r\n\r\nOK\r\n".encode("utf-8")))
+        elif command == "AT+QMTCONN?":
+            listing = "".join(f"\r\n+QMTCONN: {socket_id},{3 if socket_id in self.connected_sockets else 1}" for socket_id in sorted(self.open_sockets))
+            self.respond((0, f"{listing}\r\n\r\nOK\r\n".encode("utf-8")))
+        elif command.startswith("AT+QMTOPEN="):
+            socket_id = int(command[len("AT+QMTOPEN="):].split(",")[0])
+            self.open_sockets.add(socket_id)
+            self.respond((0, b"\r\nOK\r\n"), (OPEN_DELAY, f"\r\n+QMTOPEN: {socket_id},0\r\n".encode("utf-8")))
+        elif command.startswith("AT+QMTCONN="):
+            socket_id = int(command[len("AT+QMTCONN="):].split(",")[0])
+            self.connected_sockets.add(socket_id)
+            self.respond((0, b"\r\nOK\r\n"), (CONNECT_DELAY, f"\r\n+QMTCONN: {socket_id},0,0\r\n".encode("utf-8")))
+        elif command.startswith("AT+QMTDISC="):
+            socket_id = int(command[len("AT+QMTDISC="):])
+            self.connected_sockets.discard(socket_id)
+            self.open_sockets.discard(socket_id)
+            self.respond((0, b"\r\nOK\r\n"), (0.05, f"\r\n+QMTDISC: {socket_id},0\r\n\r\n+QMTSTAT: {socket_id},5\r\n".encode("utf-8")))
+        elif command.startswith("AT+QMTCLOSE="):
+            socket_id = int(command[len("AT+QMTCLOSE="):])
+            self.open_sockets.discard(socket_id)
+            self.respond((0, b"\r\nOK\r\n"), (0.05, f"\r\n+QMTCLOSE: {socket_id},0\r\n".encode("utf-8")))
+        else:
+            return super().write(data)
+
+        self.written.append(command)
+
+        return len(data)
+
+def sequential(cycles):
+    modem = make_modem(SessionModem())
+    delivered = 0
+
+    for _ in range(cycles):
+        time.sleep(SAMPLE_TIME)
+
+        session = modem.get_mqtt_session("bench", "bench")
+        delivered += len([result for result in session.publish_many(MESSAGES) if result['result'] == 0])
+        modem.end_mqtt_session()
+
+    return delivered
+
+async def overlapped(cycles):
+    from bg95m3_async import AsyncModem
+
+    modem = AsyncModem(make_modem(SessionModem()))
+    batches = asyncio.Queue()
+    delivered = 0
+
+    async def sampler():
+        for _ in range(cycles):
+            await asyncio.sleep(SAMPLE_TIME)
+            await batches.put(MESSAGES)
+
+    async def transmitter():
+        nonlocal delivered
+
+        for _ in range(cycles):
+            messages = await batches.get()
+            session = await modem.get_mqtt_session("bench", "bench")
+            delivered += len([result for result in await modem.publish_many(session, messages) if result['result'] == 0])
+            await modem.end_mqtt_session()
+
+    await asyncio.gather(sampler(), transmitter())
+
+    return delivered
+
+def measure(label, run):
+    start = time.monotonic()
+    delivered = run()
+    elapsed = time.monotonic() - start
+
+    assert delivered == CYCLES * len(MESSAGES), f"{label}: delivered {delivered}"
+    print(f"{label:<11} {CYCLES} cycles in {elapsed:5.2f} s, {elapsed / CYCLES:5.2f} s per cycle, {delivered} messages acked")
+
+    return elapsed
+
+if __name__ == "__main__":
+    blocking = measure("sequential", lambda: sequential(CYCLES))
+    cooperative = measure("overlapped", lambda: asyncio.run(overlapped(CYCLES)))
+
+    print(f"Saved {(blocking - cooperative) / CYCLES:.2f} s per cycle ({blocking / cooperative:.1f}x)")
@@ -0,0 +1,85 @@
+"""
+Host-side benchmark for response parsing.
+
+Compares the old per-call path (re.compile a +PREFIX: pattern, then parse_response_data's
+split/strip and per-getter int() conversions) against the shared at_responses table, on the
+responses a typical cycle sees. Reports time and peak transient allocation per response.
+
+    python3 host/bench_at_parse.py
+"""
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+
+from at_responses import parse_first, parse_lines
+
+RESPONSES = [
+    ("+CREG:", ["+CREG: 0,5"]),
+    ("+CGATT:", ["+CGATT: 1"]),
+    ("+CGACT:", ["+CGACT: 1,1", "+CGACT: 2,0"]),
+    ("+CSQ:", ["+CSQ: 18,99"]),
+    ("+QNWINFO:", ['+QNWINFO: "eMTC","310410","LTE BAND 2",700']),
+    ("+QMTCONN?", ["+QMTCONN: 0,3"]),
+    ("+QMTOPEN?", ['+QMTOPEN: 0,"a2jgs36qfd35dk-ats.iot.us-east-2.amazonaws.com",8883']),
+    ("+QMTPUB:", ["+QMTPUB: 0,17,0"]),
+    ("+QFLST:", ['+QFLST: "cacert.pem",1188', '+QFLST: "device_cert.pem",1224', '+QFLST: "device_private_key.pem",1679']),
+]
+
+def parse_response_data(data, response_pattern):
+    """
+    BG95M3.parse_response_data before the shared table
+    """
+    matched_data = []
+    for line in data:
+        matched_line = response_pattern.match(line)
+        if(matched_line):
+            stripped_line = matched_line.group(1)
+            split_line = [x.strip('"') for x in stripped_line.split(",")]
+            matched_data.append(split_line)
+
+    return matched_data
+
+def legacy_parse(key, data):
+    prefix = key[:-1]
+    pattern = re.compile(r"^\%s: (.*)$" % prefix)
+    parsed = parse_response_data(data, pattern)
+    return [[int(x) if x.isdigit() else x for x in row] for row in parsed]
+
+def table_parse(key, data):
+    return parse_lines(data, key)
+
+def measure(name, parse, rounds=20000):
+    # re caches compiled patterns on CPython; purge so each call pays for compilation like
+    # it does on CircuitPython, which has no pattern cache
+    purge = re.purge if parse is legacy_parse else (lambda: None)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for key, data in RESPONSES:
+            purge()
+            parse(key, data)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    peaks = []
+    for key, data in RESPONSES:
+        purge()
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        parse(key, data)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+
+    per_response = elapsed / (rounds * len(RESPONSES))
+    print(f"{name:>7}: {per_response * 1e6:7.2f} us/response | peak alloc {sum(peaks) / len(peaks):7.0f} B/response")
+
+    return per_response
+
+if __name__ == "__main__":
+    legacy = measure("legacy", legacy_parse, rounds=2000)
+    table = measure("table", table_parse)
+    print(f"Table parsing is {legacy / table:.1f}x faster per response")
@@ -0,0 +1,97 @@
+"""
+Host-side latency benchmark for the AT response reader.
+
+Runs a typical cycle of AT commands against a scripted FakeUART twice: once through the old
+get_response loop (fixed 100 ms sleep, rescanning every line on each pass) and once through
+at_stream.ATReader. Reports per-command return latency, measured from the moment the final
+result became readable, and total wall-clock time for the cycle.
+
+    python3 host/bench_at_reader.py
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+
+from at_stream import ATReader, Status
+from fake_uart import FakeUART
+
+CYCLE = [
+    ("AT", ((0.005, b"\r\nOK\r\n"),)),
+    ("AT+CREG?", ((0.010, b"\r\n+CREG: 0,5\r\n"), (0.012, b"\r\nOK\r\n"))),
+    ("AT+CGATT?", ((0.010, b"\r\n+CGATT: 1\r\n\r\nOK\r\n"),)),
+    ("AT+CGACT?", ((0.015, b"\r\n+CGACT: 1,1\r\n\r\nOK\r\n"),)),
+    ("AT+QMTOPEN?", ((0.010, b"\r\nOK\r\n"),)),
+    ("AT+CSQ", ((0.010, b"\r\n+CSQ: 18,99\r\n\r\nOK\r\n"),)),
+    ("AT+QNWINFO", ((0.020, b'\r\n+QNWINFO: "eMTC","310410","LTE BAND 2",700\r\n\r\nOK\r\n'),)),
+] + [(f'AT+QSSLCFG="param{i}",2,1', ((0.008, b"\r\nOK\r\n"),)) for i in range(12)] + [
+    ('AT+QMTCFG="ssl",0,1,2', ((0.008, b"\r\nOK\r\n"),)),
+    ("AT+QMTCONN?", ((0.010, b"\r\n+QMTCONN: 0,3\r\n\r\nOK\r\n"),)),
+] + [(f'AT+QMTPUBEX=0,{i},1,0,"XBX/test","{{}}"', ((0.010, b"\r\nOK\r\n"),)) for i in range(8)]
+
+def legacy_get_response(uart_bus, timeout=5):
+    """
+    The get_response loop BG95M3 used before ATReader, kept here as the baseline
+    """
+    response = ""
+    response_lines = []
+
+    timer = time.time()
+
+    ok_pattern = re.compile(r"^OK$")
+    error_pattern = re.compile(r"ERROR$")
+    cme_error_pattern = re.compile(r"^\+CME ERROR: (.*)$")
+    cms_error_pattern = re.compile(r"^\+CMS ERROR: (.*)$")
+
+    while True:
+        time.sleep(0.1)
+
+        if time.time() - timer < timeout:
+            while uart_bus.in_waiting:
+                response = uart_bus.read(uart_bus.in_waiting).decode("utf-8")
+        else:
+            return {"status": "Timeout", "status_code": Status.TIMEOUT, "data": []}
+
+        if response != "":
+            response_lines.extend([x for x in response.split("\r\n") if x != ""])
+            response = ""
+
+        for index, line in enumerate(response_lines):
+            if ok_pattern.match(line):
+                return {"status": line, "status_code": Status.OK, "data": response_lines[:index]}
+            elif error_pattern.match(line) or cme_error_pattern.match(line) or cms_error_pattern.match(line):
+                return {"status": line, "status_code": Status.ERROR, "data": response_lines[:index]}
+
+def run_cycle(name, get_response):
+    uart = FakeUART(dict(CYCLE))
+    reader = ATReader(uart)
+    latencies = []
+
+    start = time.monotonic()
+
+    for command, _ in CYCLE:
+        uart.reset_input_buffer()
+        reader.clear()
+        uart.write(f"{command}\r".encode("utf-8"))
+
+        response = get_response(uart, reader)
+        returned = time.monotonic()
+
+        assert response["status_code"] == Status.OK, (command, response)
+        latencies.append(returned - uart.arrivals[-1])
+
+    total = time.monotonic() - start
+    latencies.sort()
+
+    print(f"{name:>8}: {len(CYCLE)} commands in {total:.3f} s | "
+          f"latency median {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+          f"max {latencies[-1] * 1000:.1f} ms")
+
+    return total
+
+if __name__ == "__main__":
+    legacy = run_cycle("legacy", lambda uart, reader: legacy_get_response(uart))
+    current = run_cycle("ATReader", lambda uart, reader: reader.read_response())
+    print(f"Saved {legacy - current:.3f} s per cycle ({legacy / current:.1f}x faster)")
@@ -0,0 +1,153 @@
+"""
+Host-side benchmark for the per-channel series encoding (lib/series.py) on high-res CSV data.
+
+Reads every /sd/hrd/*.csv in a directory copied off a unit's SD card (one "<ISO8601>,<value>,<unit>" line
+per reading, named after the description), or, with no directory given, hrd files generated the way
+DataLogger writes them for a day of 1-minute cycles of 5 samples. For each channel it reports the bytes
+per sample as CSV, as JSON sample lines, as channel records and as series, and the encode and decode
+cost per sample, and checks the series decode to exactly what the records do.
+
+    python3 host/bench_series.py [hrd directory]
+"""
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from re import sub
+
+os.environ["TZ"] = "UTC"
+time.tzset()
+
+import shims
+shims.install()
+
+from channels import CHANNELS, RecordWriter, read_records
+from reading import Reading, struct_time_to_iso8601
+from series import decode_block, encode_blocks
+
+START = 1792281600      # 2026-10-18T00:00:00
+
+def file_name(description):
+    return sub(r'[^a-z0-9]', '', description.lower().strip()) + ".csv"
+
+def parse_value(text):
+    text = text.strip()
+
+    if text.startswith("("):
+        return tuple(parse_value(part) for part in text[1:-1].split(","))
+    if text == "None":
+        return None
+
+    return float(text) if any(c in text for c in ".eE") else int(text)
+
+def load_hrd(path, description):
+    readings = []
+
+    with open(path, "r") as csv_file:
+        for line in csv_file:
+            line = line.strip()
+            if not line:
+                continue
+
+            stamp, rest = line.split(",", 1)
+            value, unit = rest.rsplit(",", 1)
+            reading = Reading(parse_value(value), unit, description)
+            reading.datetime = stamp
+            readings.append(reading)
+
+    return readings
+
+def generate_hrd(directory):
+    """
+    Writes a day of hrd CSVs: 1440 cycles of 5 samples at 5 Hz, values wandering like a moored buoy's
+    """
+    random.seed(23)
+    walks = {"Ambient Pressure": 1013.2, "Ambient Temperature": 18.5, "IMU Temperature": 21.0, "CPU Temperature": 31.0,
+             "Salinity": 52000.0, "Dissolved Oxygen": 7.9, "Sea Temperature": 14.2}
+    steps = {"Ambient Pressure": (0.05, 2), "Ambient Temperature": (0.02, 2), "IMU Temperature": (0.02, 2), "CPU Temperature": (0.1, 2),
+             "Salinity": (3, 1), "Dissolved Oxygen": (0.01, 2), "Sea Temperature": (0.003, 3)}
+    units = {"Salinity": "uS/cm", "Dissolved Oxygen": "mg/l"}
+    lat, lon = 41.5236, -70.6713
+    files = {}
+
+    def write(description, value, unit, seconds):
+        if description not in files:
+            files[description] = open(os.path.join(directory, file_name(description)), "w")
+        files[description].write(f"{struct_time_to_iso8601(time.gmtime(seconds))},{value},{unit}\n")
+
+    for cycle in range(1440):
+        for sample in range(5):
+            seconds = START + cycle * 60 + sample // 5
+
+            for description in walks:
+                size, digits = steps[description]
+                walks[description] += random.gauss(0, size)
+                write(description, round(walks[description], digits), units.get(description, "hPa" if description == "Ambient Pressure" else "C"), seconds)
+
+            lat, lon = lat + random.gauss(0, 3e-6), lon + random.gauss(0, 3e-6)
+            write("Location", (round(lat, 6), round(lon, 6)), "degrees", seconds)
+            write("Acceleration Vector", tuple(round(random.gauss(0, 0.08) + g, 4) for g in (0, 0, 9.81)), "m/s^2", seconds)
+            write("Magnetic Field Vector", tuple(round(random.gauss(m, 0.3), 2) for m in (18.2, -4.1, 44.7)), "uT", seconds)
+            write("Satellites in View", random.choice((8, 9, 9, 10)), "-", seconds)
+
+    for csv_file in files.values():
+        csv_file.close()
+
+def records_of(readings):
+    stream = io.BytesIO()
+    writer = RecordWriter(stream)
+
+    for reading in readings:
+        writer.write(reading)
+
+    return stream.getvalue()
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        directory = sys.argv[1]
+        print(f"hrd data from {directory}")
+    else:
+        directory = tempfile.mkdtemp()
+        generate_hrd(directory)
+        print("hrd data generated (pass a directory copied from /sd/hrd to use recorded data)")
+
+    channels = {file_name(channel.description): channel for channel in reversed(CHANNELS)}
+    totals = {"csv": 0, "json": 0, "records": 0, "series": 0, "samples": 0}
+
+    print(f"{'channel':28s} {'samples':>8s} {'CSV':>6s} {'JSON':>6s} {'records':>8s} {'series':>7s} {'ratio':>6s} {'enc us':>7s} {'dec us':>7s}")
+
+    for name in sorted(os.listdir(directory)):
+        if name not in channels:
+            continue
+
+        path = os.path.join(directory, name)
+        readings = load_hrd(path, channels[name].description)
+        if not readings:
+            continue
+
+        started = time.perf_counter()
+        blocks = list(encode_blocks(readings))
+        encode_us = (time.perf_counter() - started) / len(readings) * 1e6
+
+        started = time.perf_counter()
+        decoded = [reading for block in blocks for reading in decode_block(block)]
+        decode_us = (time.perf_counter() - started) / len(readings) * 1e6
+
+        records = records_of(readings)
+        expected = list(read_records(io.BytesIO(records)))
+        assert [(r.datetime, r.value, r.unit) for r in decoded] == [(r.datetime, r.value, r.unit) for r in expected], f"{name} didn't decode bit-exact"
+
+        sizes = {"csv": os.path.getsize(path), "json": sum(len(json.dumps(r.__dict__)) + 1 for r in readings),
+                 "records": len(records), "series": sum(len(block) for block in blocks), "samples": len(readings)}
+        for key in totals:
+            totals[key] += sizes[key]
+
+        print(f"{channels[name].description[:28]:28s} {len(readings):8d} {sizes['csv'] / len(readings):6.1f} {sizes['json'] / len(readings):6.1f} "
+              f"{sizes['records'] / len(readings):8.2f} {sizes['series'] / len(readings):7.2f} {sizes['json'] / sizes['series']:5.1f}x {encode_us:7.1f} {decode_us:7.1f}")
+
+    samples = totals["samples"]
+    print(f"{'all':28s} {samples:8d} {totals['csv'] / samples:6.1f} {totals['json'] / samples:6.1f} {totals['records'] / samples:8.2f} "
+          f"{totals['series'] / samples:7.2f} {totals['json'] / totals['series']:5.1f}x   (bytes per sample; ratio is JSON / series)")
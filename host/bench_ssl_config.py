@@ -0,0 +1,139 @@
+"""
+Host-side benchmark for SSL/MQTT configuration per connection.
+
+Counts the AT command lines and seconds spent configuring the modem for each new MQTT_Socket, comparing
+the old behaviour (every QSSLCFG parameter and QMTCFG "ssl" sent unconditionally) against
+BG95M3.apply_config, on a fake modem that keeps its settings, answers concatenated queries and answers each
+command line after a fixed latency. Covers a modem we just power cycled, one left running and configured,
+and one that reset itself (RDY) behind the driver's back. Also compares boot-time cleanup: AT+QSSLCLOSE on
+contexts 0-5 vs one AT+QSSLSTATE.
+
+    python3 host/bench_ssl_config.py
+"""
+import time
+
+import shims
+shims.install()
+
+from fake_modem import make_modem
+from fake_uart import FakeUART
+
+LATENCY = 0.03          #seconds from command to final result, typical for a QSSLCFG round trip
+CONNECTIONS = 5
+
+LEGACY_COMMANDS = [
+    'AT+QSSLCFG="sslversion", 2, 4',
+    'AT+QSSLCFG="ciphersuite", 2, 0XFFFF',
+    'AT+QSSLCFG="cacert",2,"cacert.pem"',
+    'AT+QSSLCFG="clientcert",2,"device_cert.pem"',
+    'AT+QSSLCFG="clientkey",2,"device_private_key.pem"',
+    'AT+QSSLCFG="seclevel", 2, 2',
+    'AT+QSSLCFG="session", 2, 0',
+    'AT+QSSLCFG="sni", 2, 1',
+    'AT+QSSLCFG="checkhost", 2, 0',
+    'AT+QSSLCFG="ignorelocaltime", 2, 1',
+    'AT+QSSLCFG="renegotiation", 2, 0',
+    'AT+QMTCFG="ssl",0,1,2',
+]
+
+class ConfigModem(FakeUART):
+    """
+    Keeps QSSLCFG/QMTCFG settings and answers both their set and query forms
+    """
+    def __init__(self):
+        super().__init__()
+        self.settings = {}
+
+    def write(self, data):
+        line = bytes(data).strip(b"\r\n").decode("utf-8").replace(" ", "")
+        self.written.append(line)
+
+        #Concatenated commands (AT+X=a;+X=b) are answered in order, with one final result
+        replies = [self.answer(command) for command in line[2:].split(";")]
+        final = "ERROR" if None in replies else "OK"
+        reply = "".join(reply for reply in replies if reply) + f"\r\n{final}\r\n"
+
+        self.schedule(((LATENCY, reply.encode("utf-8")),))
+
+        return len(data)
+
+    def answer(self, command):
+        """
+        Returns the information response for one command ("" if there isn't one), or None if it's rejected
+        """
+        name, _, arguments = command.partition("=")
+        fields = arguments.split(",")
+        #QSSLCFG selectors are "<param>",<ctx>; QMTCFG "ssl" is "ssl",<client_idx> but doesn't echo the index back
+        selector, value = ",".join(fields[:2]), ",".join(fields[2:])
+        echo = selector if name == "+QSSLCFG" else fields[0]
+
+        if name in ("+QSSLCFG", "+QMTCFG") and value:
+            self.settings[(name, selector)] = value
+            return ""
+        elif name in ("+QSSLCFG", "+QMTCFG"):
+            return f"\r\n{name}: {echo},{self.settings.get((name, selector), '0')}\r\n"
+        elif name == "+QSSLCLOSE":
+            return None
+
+        return ""
+
+def measure(uart, action):
+    sent = len(uart.written)
+    start = time.monotonic()
+    action()
+    return len(uart.written) - sent, time.monotonic() - start
+
+def legacy_connection(modem):
+    for command in LEGACY_COMMANDS:
+        modem.send_comm_get_response(command)
+
+def new_connection(modem):
+    import bg95m3
+    socket = bg95m3.MQTT_Socket(modem, "bench", "example.invalid", 8883, 0)
+
+def report(label, legacy, new):
+    print(f"{label:<34} legacy {legacy[0]:3d} cmds {legacy[1]:6.2f} s | new {new[0]:3d} cmds {new[1]:6.2f} s | saved {legacy[0] - new[0]:3d} cmds {legacy[1] - new[1]:6.2f} s")
+
+if __name__ == "__main__":
+    #Boot cleanup
+    uart = ConfigModem()
+    modem = make_modem(uart)
+    legacy = measure(uart, lambda: [modem.send_comm_get_response(f"AT+QSSLCLOSE={ctx_id}", timeout=5) for ctx_id in range(6)])
+    new = measure(uart, lambda: [modem.send_comm_get_response(f"AT+QSSLCLOSE={client_id}") for client_id in modem.get_open_ssl_client_ids()])
+    report("boot SSL cleanup", legacy, new)
+
+    #Modem we just power cycled: settings are defaults, so apply_config sets without reading back
+    legacy_uart, new_uart = ConfigModem(), ConfigModem()
+    legacy_modem, new_modem = make_modem(legacy_uart), make_modem(new_uart)
+    new_modem.config_power_cycled = True
+    report("first connection, cold modem", measure(legacy_uart, lambda: legacy_connection(legacy_modem)), measure(new_uart, lambda: new_connection(new_modem)))
+
+    #Board restarted with the modem left running and configured: one query per config, nothing differs
+    warm_uart = ConfigModem()
+    warm_uart.settings = dict(new_uart.settings)
+    warm_modem = make_modem(warm_uart)
+    report("first connection, warm modem", measure(legacy_uart, lambda: legacy_connection(legacy_modem)), measure(warm_uart, lambda: new_connection(warm_modem)))
+    assert len(warm_uart.written) == 2 and not warm_modem.config_power_cycled
+
+    #After the first config following a power cycle, later configs are read back rather than set blind
+    assert not new_modem.config_power_cycled
+
+    #Every connection after that in the same power-up
+    legacy = measure(legacy_uart, lambda: [legacy_connection(legacy_modem) for _ in range(CONNECTIONS)])
+    new = measure(new_uart, lambda: [new_connection(new_modem) for _ in range(CONNECTIONS)])
+    report(f"next {CONNECTIONS} connections", legacy, new)
+    report("  per connection", (legacy[0] // CONNECTIONS, legacy[1] / CONNECTIONS), (new[0] // CONNECTIONS, new[1] / CONNECTIONS))
+
+    #The modem resets itself and comes back on its defaults: RDY makes the next connection configure it again
+    reset_uart = ConfigModem()
+    reset_modem = make_modem(reset_uart)
+    new_connection(reset_modem)
+    reset_uart.settings = {}
+    reset_uart.schedule(((0, b"\r\nRDY\r\n"),))
+    time.sleep(0.01)
+    reset_modem.poll_urcs()
+    report("connection after the modem reset", measure(legacy_uart, lambda: legacy_connection(legacy_modem)), measure(reset_uart, lambda: new_connection(reset_modem)))
+    assert reset_uart.settings == new_uart.settings
+
+    assert new_uart.settings == warm_uart.settings
+    print(f"apply_config counters: sent {new_modem.config_commands_sent}, saved {new_modem.config_commands_saved}")
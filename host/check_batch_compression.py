@@ -0,0 +1,67 @@
+"""
+Checks compressed batch publishing end to end: a cycle of readings shaped like sample queue lines is packed
+by BatchPublisher with and without compression, published through host/fake_modem.py, and read back with
+host/decode_batch.py. Every reading has to come back once, in order, with every payload inside the modem's
+limit. Reports the messages, payload bytes and MQTT bytes on air for both.
+
+    python3 host/check_batch_compression.py
+"""
+import json
+import random
+
+import shims
+shims.install()
+
+import bg95m3
+from decode_batch import decode_batch
+from fake_modem import FakeModem, make_modem, make_socket
+from services.batch_publisher import COMPRESSED_SUFFIX, BatchPublisher
+
+SENSORS = [
+    ("Ambient Pressure", "hPa", lambda: round(random.gauss(1013.2, 0.4), 2)),
+    ("Ambient Temperature", "C", lambda: round(random.gauss(18.5, 0.2), 2)),
+    ("Acceleration Vector", "m/s^2", lambda: [round(random.gauss(0, 0.3), 4) for _ in range(3)]),
+    ("Location", "degrees", lambda: [round(41.5236 + random.gauss(0, 1e-5), 6), round(-70.6713 + random.gauss(0, 1e-5), 6)]),
+    ("Conductivity", "uS/cm", lambda: round(random.gauss(52000, 40), 1)),
+    ("Water Temperature", "C", lambda: round(random.gauss(14.2, 0.05), 3)),
+]
+
+def sample_lines(samples):
+    random.seed(20)
+    lines = []
+
+    for index in range(samples):
+        for description, unit, value in SENSORS:
+            reading = {"value": value(), "unit": unit, "description": description, "datetime": f"2026-10-18T08:{index // 60 % 60:02d}:{index % 60:02d}"}
+            lines.append(json.dumps(reading) + "\n")
+
+    return lines
+
+def publish(lines, compress):
+    uart = FakeModem(latency=0, ack_delay=0)
+    socket = make_socket(make_modem(uart))
+    publisher = BatchPublisher("XBX/test", bg95m3.MQTT_MAX_PAYLOAD, compress=compress)
+
+    results = socket.publish_many(publisher.batches(lines))
+    assert all(result["result"] == 0 for result in results)
+
+    decoded = []
+    for topic, payload in uart.published:
+        assert len(payload) <= bg95m3.MQTT_MAX_PAYLOAD, len(payload)
+        assert topic.endswith(COMPRESSED_SUFFIX) == compress, topic
+        decoded.extend(decode_batch(payload))
+
+    assert decoded == [json.loads(line) for line in lines], "readings didn't come back intact"
+
+    return publisher
+
+if __name__ == "__main__":
+    for samples in (5, 100, 600):
+        lines = sample_lines(samples)
+        plain = publish(lines, compress=False)
+        packed = publish(lines, compress=True)
+
+        print(f"{len(lines):5d} readings: plain {plain.messages_built:3d} msgs {plain.bytes_on_air:7d} B on air | "
+              f"zlib {packed.messages_built:3d} msgs {packed.bytes_on_air:7d} B on air, ratio {packed.compression_ratio:.1f}x")
+
+    print("OK")
@@ -0,0 +1,105 @@
+"""
+Checks SSL_Context.sync_certs against a fake modem file system: the first sync uploads every cert
+byte-exact with a matching +QFUPL checksum, a second sync uploads nothing, and changing one local
+cert (same size, different content) uploads only that one.
+
+    python3 host/check_cert_sync.py
+"""
+import os
+import tempfile
+
+import shims
+shims.install()
+
+from fake_modem import make_modem
+from fake_uart import FakeUART
+
+def reference_checksum(data):
+    checksum = 0
+    padded = data + b"\x00" if len(data) % 2 else data
+
+    for index in range(0, len(padded), 2):
+        checksum ^= (padded[index] << 8) | padded[index + 1]
+
+    return checksum
+
+class FakeUFS(FakeUART):
+    """
+    Answers AT+QFLST, AT+QFDEL and AT+QFUPL against an in-memory file system
+    """
+    def __init__(self):
+        super().__init__()
+        self.files = {}
+        self.uploads = []
+        self.awaiting = None        #(file name, size) while taking upload data
+        self.data = b""
+
+    def respond(self, data):
+        self.schedule(((0.002, data),))
+
+    def write(self, data):
+        data = bytes(data)
+
+        if self.awaiting is not None:
+            self.data += data
+            name, size = self.awaiting
+
+            if len(self.data) >= size:
+                self.files[name], self.data, self.awaiting = self.data[:size], b"", None
+                self.uploads.append(name)
+                self.respond(f"\r\n+QFUPL: {size},{reference_checksum(self.files[name]):x}\r\n\r\nOK\r\n".encode("utf-8"))
+
+            return len(data)
+
+        command = data.strip(b"\r\n").decode("utf-8")
+        self.written.append(command)
+
+        if command.startswith("AT+QFLST"):
+            listing = "".join(f'\r\n+QFLST: "{name}",{len(content)}' for name, content in self.files.items())
+            self.respond(f"{listing}\r\n\r\nOK\r\n".encode("utf-8"))
+        elif command.startswith("AT+QFDEL="):
+            self.files.pop(command.split('"')[1], None)
+            self.respond(b"\r\nOK\r\n")
+        elif command.startswith("AT+QFUPL="):
+            name, arguments = command.split('"')[1], command.split(",")
+            self.awaiting = (name, int(arguments[1]))
+            self.respond(b"\r\nCONNECT\r\n")
+        else:
+            self.respond(b"\r\nOK\r\n")
+
+        return len(data)
+
+if __name__ == "__main__":
+    import bg95m3
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = {}
+        for variable, size in (("CA_CERT_PATH", 1187), ("DEVICE_CERT_PATH", 1224), ("DEVICE_PRIVATE_KEY_PATH", 1679)):
+            paths[variable] = os.path.join(directory, f"{variable.lower()}.pem")
+            with open(paths[variable], "wb") as file:
+                file.write(os.urandom(size))
+            os.environ[variable] = paths[variable]
+
+        bg95m3.CERT_MANIFEST_PATH = os.path.join(directory, "cert_manifest.json")
+
+        uart = FakeUFS()
+        context = bg95m3.SSL_Context(make_modem(uart))
+
+        assert context.sync_certs() == 3
+        for name, path in context.cert_files():
+            with open(path, "rb") as file:
+                assert uart.files[name] == file.read(), f"{name}: content mismatch"
+        print(f"first sync:  uploaded {uart.uploads}")
+
+        uart.uploads.clear()
+        assert context.sync_certs() == 0 and not uart.uploads
+        print(f"second sync: uploaded {uart.uploads}")
+
+        with open(paths["DEVICE_CERT_PATH"], "r+b") as file:
+            file.seek(100)
+            file.write(b"\x00\x01")
+
+        assert context.sync_certs() == 1 and uart.uploads == ["device_cert.pem"]
+        print(f"after edit:  uploaded {uart.uploads}")
+
+    print("OK")
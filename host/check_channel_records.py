@@ -0,0 +1,139 @@
+"""
+Checks the channel record format (lib/channels.py): every registered channel round-trips through a record
+stream as binary records, with values generated to fit each struct code (floats to float32, locations to
+1e-7 degrees), re-encoding the decoded readings gives the same bytes, unregistered readings and values that
+don't fit their channel come back through JSON records, gaps over MAX_DELTA seconds get a new time record,
+and record batches published through host/fake_modem.py decode with host/decode_batch.py. Reports bytes per
+reading against JSON lines.
+
+    python3 host/check_channel_records.py
+"""
+import io
+import json
+import os
+import random
+import struct
+import time
+
+os.environ["TZ"] = "UTC"
+time.tzset()
+
+import shims
+shims.install()
+
+import bg95m3
+from channels import CHANNELS, MAX_DELTA, TIME_CHANNEL, RecordWriter, read_records
+from decode_batch import decode_batch
+from fake_modem import FakeModem, make_modem, make_socket
+from reading import Reading, struct_time_to_iso8601
+from services.batch_publisher import RECORDS_SUFFIX, BatchPublisher
+
+START = 1792312200      # 2026-10-18T08:30:00
+
+def value_for(channel):
+    values = []
+
+    for code in channel.layout:
+        if(channel.scale != 1):
+            values.append(round(random.uniform(-90, 90), 6))
+        elif(code in "fd"):
+            values.append(round(random.gauss(20, 15), 3))
+        elif(code == "B"):
+            values.append(random.randint(0, 12))
+        elif(code == "b"):
+            values.append(random.randint(-12, 12))
+        elif(code in "HI"):
+            values.append(random.randint(0, 60000))
+        else:
+            values.append(random.randint(-130, -3))
+
+    return tuple(values) if len(values) > 1 else values[0]
+
+def reading_at(seconds, value, unit, description):
+    reading = Reading(value, unit, description)
+    reading.datetime = struct_time_to_iso8601(time.localtime(seconds))
+
+    return reading
+
+def cycle_readings(samples):
+    random.seed(21)
+    readings = []
+
+    for index in range(samples):
+        for channel in CHANNELS:
+            readings.append(reading_at(START + index // 5, value_for(channel), channel.unit, channel.description))
+
+    return readings
+
+def encode(readings):
+    stream = io.BytesIO()
+    writer = RecordWriter(stream)
+
+    for reading in readings:
+        writer.write(reading)
+
+    return stream.getvalue()
+
+def same_value(channel, original, decoded):
+    originals = original if isinstance(original, tuple) else (original,)
+    decodeds = decoded if isinstance(decoded, tuple) else (decoded,)
+
+    for a, b in zip(originals, decodeds):
+        if(a is None or b is None):
+            assert a is None and b is None, (channel.description, original, decoded)
+        elif(channel.is_float):
+            assert struct.unpack("<f", struct.pack("<f", a))[0] == b, (channel.description, original, decoded)
+        else:
+            assert abs(a - b) <= 0.5 / channel.scale, (channel.description, original, decoded)
+
+if __name__ == "__main__":
+    readings = cycle_readings(50)
+    data = encode(readings)
+    decoded = list(read_records(io.BytesIO(data)))
+
+    assert len(decoded) == len(readings)
+    for channel, original, reading in zip(CHANNELS * 50, readings, decoded):
+        assert (reading.description, reading.unit, reading.datetime) == (original.description, original.unit, original.datetime)
+        same_value(channel, original.value, reading.value)
+        channel.pack(original.value)    #raises if it would have gone out as a JSON record instead
+
+    assert encode(decoded) == data, "re-encoding the decoded readings changed the bytes"
+    print(f"roundtrip: {len(CHANNELS)} channels x 50 samples, re-encoded bit-exact")
+
+    odd = [
+        reading_at(START, (None, None), "degrees", "Location"),
+        reading_at(START, None, "C", "Sea Temperature"),
+        reading_at(START, 3.5, "ppt", "Salinity"),
+        reading_at(START, "no probe", "C", "Sea Temperature"),
+        reading_at(START + MAX_DELTA + 1, 7, "-", "Signal CSQ"),
+        reading_at(START + 10, 7, "-", "Signal CSQ"),
+    ]
+    data = encode(odd)
+    back = list(read_records(io.BytesIO(data)))
+
+    assert [(r.value, r.unit, r.description, r.datetime) for r in back] == [(r.value, r.unit, r.description, r.datetime) for r in odd], [r.__dict__ for r in back]
+    assert data.count(bytes([TIME_CHANNEL, 0])) >= 3
+    assert list(read_records(io.BytesIO(data[:-1])))[-1].datetime == odd[-2].datetime
+    print("edges:     missing values, unregistered channels, odd values, clock gaps and truncation")
+
+    uart = FakeModem(latency=0, ack_delay=0)
+    socket = make_socket(make_modem(uart))
+    publisher = BatchPublisher("XBX/test", bg95m3.MQTT_MAX_PAYLOAD)
+    results = socket.publish_many(publisher.record_batches(readings))
+    assert all(result["result"] == 0 for result in results)
+
+    published = []
+    for topic, payload in uart.published:
+        assert len(payload) <= bg95m3.MQTT_MAX_PAYLOAD and topic.endswith(RECORDS_SUFFIX), (topic, len(payload))
+        published.extend(decode_batch(payload))
+
+    assert [(r["description"], r["datetime"]) for r in published] == [(r.description, r.datetime) for r in readings]
+    print(f"publish:   {publisher.messages_built} messages on {RECORDS_SUFFIX}, each decoding on its own")
+
+    json_bytes = sum(len(json.dumps(r.__dict__)) + 1 for r in readings)
+    record_bytes = len(encode(readings))
+
+    print(f"size:      JSON {json_bytes / len(readings):.1f} B/reading, records {record_bytes / len(readings):.1f} B/reading "
+          f"({json_bytes / record_bytes:.1f}x smaller), {publisher.bytes_on_air} B on air for {len(readings)} readings")
+
+    print("OK")
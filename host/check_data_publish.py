@@ -0,0 +1,41 @@
+"""
+Checks that MQTT_Socket delivers payloads byte-exact through the length-prefixed publish path,
+including JSON with double quotes, binary bytes and memoryviews, against host/fake_modem.py.
+
+    python3 host/check_data_publish.py
+"""
+import json
+import zlib
+
+import shims
+shims.install()
+
+from fake_modem import FakeModem, make_modem, make_socket
+
+if __name__ == "__main__":
+    readings = [{"value": 1013.25 + i, "unit": "hPa", "description": "Ambient Pressure", "datetime": "2025-06-25T12:00:00"} for i in range(20)]
+    text = json.dumps(readings)
+    binary = bytes(range(256)) * 4
+    compressed = zlib.compress(text.encode("utf-8"))
+
+    payloads = [
+        ("XBX/test/inline", "Connected!"),
+        ("XBX/test/json", text),
+        ("XBX/test/binary", binary),
+        ("XBX/test/view", memoryview(bytearray(compressed))),
+        ("XBX/test/crlf", b"line one\r\nline two\r\n> not a prompt\r\nOK\r\n"),
+    ]
+
+    uart = FakeModem()
+    socket = make_socket(make_modem(uart))
+    results = socket.publish_many(payloads)
+
+    for (topic, sent), (received_topic, received), result in zip(payloads, uart.published, results):
+        expected = sent.encode("utf-8") if isinstance(sent, str) else bytes(sent)
+        assert received_topic == topic, (received_topic, topic)
+        assert received == expected, f"{topic}: payload mismatch"
+        assert result["result"] == 0, result
+        print(f"{topic:>18}: {len(expected):5d} bytes delivered byte-exact")
+
+    assert len(uart.published) == len(payloads)
+    print("OK")
@@ -0,0 +1,160 @@
+"""
+Checks the two-phase EZO API in lib/boards/atlassenseboard against fake circuits that take CONVERSION
+seconds per R: three started together are all collected in about one conversion time instead of three,
+a circuit that's slower than read_delay answers 254 and is collected once it's done, error codes and I2C
+failures give {}, a cancelled conversion isn't collected, and a disabled circuit doesn't start.
+
+    python3 host/check_ezo_overlap.py
+"""
+import importlib.util
+import os
+import sys
+import time
+import types
+
+import shims
+shims.install()
+
+CONVERSION = 0.2
+
+class FakeCircuit:
+    """
+    An EZO circuit's I2C side: R starts a conversion, reads answer 254 until it's done, then 1 and the value
+    """
+    def __init__(self, value, conversion=CONVERSION, code=1, fail=False):
+        self.value = value
+        self.conversion = conversion
+        self.code = code
+        self.fail = fail
+        self.started = None
+        self.reads = 0
+
+    def __enter__(self):
+        if self.fail:
+            raise OSError("I2C bus error")
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def write(self, data):
+        assert bytes(data) == b"R"
+        self.started = time.monotonic()
+
+    def readinto(self, buffer):
+        self.reads += 1
+        buffer[:] = bytes(len(buffer))
+
+        if(time.monotonic() - self.started < self.conversion):
+            buffer[0] = 254
+            return
+
+        text = self.value.encode("ascii")
+        buffer[0] = self.code
+        buffer[1:1 + len(text)] = text
+
+class FakeDriver:
+    def __init__(self, circuit):
+        self.i2c_device = circuit
+
+    def blocking(self):
+        time.sleep(self.i2c_device.conversion)
+        return float(self.i2c_device.value.split(",")[0])
+
+    EC = MGL = T = property(blocking)
+
+class FakeBus:
+    def __init__(self, addresses):
+        self.addresses = addresses
+
+    def try_lock(self):
+        return True
+
+    def unlock(self):
+        pass
+
+    def scan(self):
+        return self.addresses
+
+#The drivers are only built as .mpy, and boards/__init__ brings up every board, so load the module on its own
+for name in ("atlas_ezo_ec", "atlas_ezo_do", "atlas_ezo_rtd"):
+    sys.modules.setdefault(name, types.ModuleType(name))
+
+spec = importlib.util.spec_from_file_location("atlassenseboard", os.path.join(shims.LIB, "boards", "atlassenseboard", "atlassenseboard.py"))
+atlassenseboard = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(atlassenseboard)
+
+EZODO, EZOEC, EZORTD = atlassenseboard.EZODO, atlassenseboard.EZOEC, atlassenseboard.EZORTD
+
+def circuit(device_class, fake, address):
+    device = device_class(FakeBus([address]), address)
+    device.base_device = FakeDriver(fake)
+    device.enabled = True
+    device.read_delay = CONVERSION
+
+    return device
+
+def collect_all(devices):
+    results = {}
+
+    while len(results) < len(devices):
+        for device in devices:
+            if device.description not in results:
+                readings = device.collect_reading()
+                if readings is not None:
+                    results[device.description] = readings
+        time.sleep(0.01)
+
+    return results
+
+if __name__ == "__main__":
+    devices = [circuit(EZOEC, FakeCircuit("52013.4,28107,33.41,1.025"), 100),
+               circuit(EZODO, FakeCircuit("7.91"), 97),
+               circuit(EZORTD, FakeCircuit("14.217"), 102)]
+
+    started = time.monotonic()
+    sequential = [device.read() for device in devices]
+    sequential_time = time.monotonic() - started
+
+    started = time.monotonic()
+    assert all(device.start_reading() for device in devices)
+    results = collect_all(devices)
+    overlapped_time = time.monotonic() - started
+
+    values = {description: [(r.value, r.unit, r.description) for r in readings.values()] for description, readings in results.items()}
+    assert values == {"conductivity": [(52013.4, "uS/cm", "Salinity")], "Dissolved Oxygen": [(7.91, "mg/l", "Dissolved Oxygen")],
+                      "Sea Temperature": [(14.217, "C", "Sea Temperature")]}, values
+    assert [[r.value for r in readings.values()] for readings in sequential] == [[52013.4], [7.91], [14.217]]
+    assert overlapped_time < CONVERSION * 1.5 < sequential_time, (overlapped_time, sequential_time)
+    print(f"overlap:  3 conversions in {overlapped_time:.2f} s started together, {sequential_time:.2f} s one after another")
+
+    slow = circuit(EZODO, FakeCircuit("8.02", conversion=CONVERSION * 2), 97)
+    slow.start_reading()
+    assert slow.collect_reading() is None and slow.base_device.i2c_device.reads == 0
+    time.sleep(CONVERSION * 1.2)
+    assert slow.collect_reading() is None and slow.base_device.i2c_device.reads == 1
+    time.sleep(CONVERSION)
+    assert slow.collect_reading()['MGL'].value == 8.02
+    assert slow.collect_reading() == {}
+
+    abandoned = circuit(EZODO, FakeCircuit("8.02", conversion=CONVERSION * 2), 97)
+    abandoned.start_reading()
+    abandoned.cancel_reading()
+    time.sleep(CONVERSION * 2.2)
+    assert abandoned.collect_reading() == {} and abandoned.base_device.i2c_device.reads == 0
+    print("pending:  not read before read_delay, 254 kept waiting, collected once done, not at all once cancelled")
+
+    failed = circuit(EZORTD, FakeCircuit("", code=2), 102)
+    failed.start_reading()
+    time.sleep(CONVERSION)
+    assert failed.collect_reading() == {}
+
+    broken = circuit(EZOEC, FakeCircuit("1.0", fail=True), 100)
+    assert not broken.start_reading()
+
+    disabled = circuit(EZODO, FakeCircuit("7.0"), 97)
+    disabled.enabled = False
+    assert not disabled.start_reading() and disabled.collect_reading() == {}
+    print("failures: error codes, I2C errors and disabled circuits give no readings")
+
+    print("OK")
@@ -0,0 +1,118 @@
+"""
+Checks bg95m3.GNSS against a fake receiver: expired XTRA data is downloaded to UFS over HTTP, injected
+and deleted; a start injects the time and gives GNSS priority; polling records the time to first fix
+once AT+QGPSLOC stops answering +CME ERROR: 516, hands priority back to LTE and caches the fix, and a
+second GNSS on the same cache reports a hot start and the last known location.
+
+    python3 host/check_gnss.py
+"""
+import logging
+import os
+import tempfile
+import time
+
+import shims
+shims.install()
+
+import bg95m3
+from fake_modem import make_modem
+from fake_uart import FakeUART
+
+FIX_AFTER = 0.3         #seconds after AT+QGPS=1 before the fake has a fix
+
+class FakeGNSS(FakeUART):
+    def __init__(self):
+        super().__init__()
+        self.xtra_enabled = 1
+        self.xtra_minutes = 0
+        self.files = set()
+        self.gnss_on_at = None
+        self.awaiting_url = None
+
+    def respond(self, *chunks):
+        self.schedule([(0.002 + delay, data) for delay, data in chunks])
+
+    def write(self, data):
+        data = bytes(data)
+
+        if self.awaiting_url is not None:
+            self.awaiting_url = None
+            self.respond((0, b"\r\nOK\r\n"))
+            return len(data)
+
+        command = data.strip(b"\r\n").decode("utf-8")
+        self.written.append(command)
+
+        if command == "AT+QGPSXTRA?":
+            self.respond((0, f"\r\n+QGPSXTRA: {self.xtra_enabled}\r\n\r\nOK\r\n".encode("utf-8")))
+        elif command == "AT+QGPSXTRADATA?":
+            self.respond((0, f'\r\n+QGPSXTRADATA: {self.xtra_minutes},"2026/10/18,08:00:00"\r\n\r\nOK\r\n'.encode("utf-8")))
+        elif command.startswith('AT+QGPSXTRADATA="UFS:'):
+            self.xtra_minutes = 10080 if command[len('AT+QGPSXTRADATA="UFS:'):-1] in self.files else 0
+            self.respond((0, b"\r\nOK\r\n" if self.xtra_minutes else b"\r\n+CME ERROR: 505\r\n"))
+        elif command.startswith("AT+QHTTPURL="):
+            self.awaiting_url = int(command[len("AT+QHTTPURL="):].split(",")[0])
+            self.respond((0, b"\r\nCONNECT\r\n"))
+        elif command.startswith("AT+QHTTPGET="):
+            self.respond((0, b"\r\nOK\r\n"), (0.02, b"\r\n+QHTTPGET: 0,200,61440\r\n"))
+        elif command.startswith('AT+QHTTPREADFILE="UFS:'):
+            self.files.add(command[len('AT+QHTTPREADFILE="UFS:'):].split('"')[0])
+            self.respond((0, b"\r\nOK\r\n\r\n+QHTTPREADFILE: 0\r\n"))
+        elif command.startswith("AT+QFDEL="):
+            self.files.discard(command[len("AT+QFDEL="):].strip('"'))
+            self.respond((0, b"\r\nOK\r\n"))
+        elif command == "AT+QGPS?":
+            self.respond((0, f"\r\n+QGPS: {int(self.gnss_on_at is not None)}\r\n\r\nOK\r\n".encode("utf-8")))
+        elif command == "AT+QGPS=1":
+            self.gnss_on_at = time.monotonic()
+            self.respond((0, b"\r\nOK\r\n"))
+        elif command == "AT+QGPSEND":
+            self.gnss_on_at = None
+            self.respond((0, b"\r\nOK\r\n"))
+        elif command == "AT+QGPSLOC=2":
+            if self.gnss_on_at is not None and time.monotonic() - self.gnss_on_at >= FIX_AFTER:
+                self.respond((0, b"\r\n+QGPSLOC: 081523.000,41.52361,-70.67135,1.1,12.4,3,91.20,0.4,0.2,181026,09\r\n\r\nOK\r\n"))
+            else:
+                self.respond((0, b"\r\n+CME ERROR: 516\r\n"))
+        else:
+            self.respond((0, b"\r\nOK\r\n"))
+
+        return len(data)
+
+def priorities(fake):
+    return [command[-1] for command in fake.written if command.startswith('AT+QGPSCFG="priority"')]
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.ERROR)
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = os.path.join(directory, "gnss_cache.json")
+        fake = FakeGNSS()
+        modem = make_modem(fake)
+        gnss = bg95m3.GNSS(modem, cache_path=cache)
+
+        assert gnss.refresh_xtra() and fake.xtra_minutes and not fake.files
+        print(f"XTRA:  downloaded and injected, valid {fake.xtra_minutes} min, UFS copy deleted")
+        fake.written = []
+
+        assert gnss.start() and any(command.startswith("AT+QGPSXTRATIME=0,") for command in fake.written)
+        polls = 0
+        while not gnss.poll():
+            polls += 1
+            time.sleep(0.05)
+
+        assert FIX_AFTER <= gnss.ttff < FIX_AFTER + 0.2, gnss.ttff
+        assert priorities(fake) == [str(bg95m3.GNSS_PRIORITY_GNSS), str(bg95m3.GNSS_PRIORITY_WWAN)], priorities(fake)
+        readings = gnss.read()
+        assert readings['location'].value == (41.52361, -70.67135) and readings['sv'].value == 9
+        print(f"fix:   TTFF {gnss.ttff:.2f} s after {polls} polls without one")
+
+        gnss.stop()
+        assert fake.gnss_on_at is None
+
+        cached = bg95m3.GNSS(modem, cache_path=cache)
+        assert cached.read()['location'].description == "GNSS Last Known Location"
+        assert cached.refresh_xtra() and not any(command.startswith("AT+QHTTPGET") for command in fake.written)
+        print("cache: last known location kept, XTRA still valid so nothing downloaded")
+
+    print("OK")
@@ -0,0 +1,145 @@
+"""
+Checks the HTTPS bulk upload path (BG95M3.http_post_file and services/bulk_uploader.py) against a fake
+modem HTTP client: every POST body has to be a whole number of lines no bigger than max_body, the bodies
+for each file have to add up to the file byte for byte, a second upload sends nothing (the sample queue's
+cursor file included), and only the lines appended since then go up on the third. A refused POST has to leave the manifest where the last accepted
+part ended.
+
+    python3 host/check_http_upload.py
+"""
+import os
+import tempfile
+
+import shims
+shims.install()
+
+from fake_modem import make_modem
+from fake_uart import FakeUART
+from services.bulk_uploader import BulkUploader
+
+MAX_BODY = 8 * 1024
+
+class FakeHTTP(FakeUART):
+    """
+    Answers AT+QHTTPURL and AT+QHTTPPOST, taking the URL and body after CONNECT. Every other command gets OK
+    """
+    def __init__(self):
+        super().__init__()
+        self.url = None
+        self.posts = []             #(url, body)
+        self.refuse = set()         #indexes of POSTs to answer with a 403
+        self.awaiting = None        #(command, length) while taking data
+        self.data = b""
+
+    def respond(self, *chunks):
+        self.schedule([(0.002 + delay, data) for delay, data in chunks])
+
+    def write(self, data):
+        data = bytes(data)
+
+        if self.awaiting is not None:
+            self.data += data
+            command, length = self.awaiting
+
+            if len(self.data) >= length:
+                body, self.data, self.awaiting = self.data[:length], b"", None
+
+                if command == "url":
+                    self.url = body.decode("utf-8")
+                    self.respond((0, b"\r\nOK\r\n"))
+                else:
+                    code = 403 if len(self.posts) in self.refuse else 200
+                    self.posts.append((self.url, body))
+
+                    #Alternate between the result arriving with the OK and arriving on its own
+                    if len(self.posts) % 2:
+                        self.respond((0, f"\r\nOK\r\n\r\n+QHTTPPOST: 0,{code},0\r\n".encode("utf-8")))
+                    else:
+                        self.respond((0, b"\r\nOK\r\n"), (0.01, f"\r\n+QHTTPPOST: 0,{code},0\r\n".encode("utf-8")))
+
+            return len(data)
+
+        command = data.strip(b"\r\n").decode("utf-8")
+        self.written.append(command)
+
+        if command.startswith("AT+QHTTPURL="):
+            self.awaiting = ("url", int(command[len("AT+QHTTPURL="):].split(",")[0]))
+            self.respond((0, b"\r\nCONNECT\r\n"))
+        elif command.startswith("AT+QHTTPPOST="):
+            self.awaiting = ("post", int(command[len("AT+QHTTPPOST="):].split(",")[0]))
+            self.respond((0, b"\r\nCONNECT\r\n"))
+        else:
+            self.respond((0, b"\r\nOK\r\n"))
+
+        return len(data)
+
+def write_lines(path, count, start=0, mode="w"):
+    with open(path, mode) as file:
+        for index in range(start, start + count):
+            file.write(f"2025-06-01T12:{index // 60 % 60:02d}:{index % 60:02d},{index * 0.37:.3f},C\n")
+
+def check_bodies(fake, path, since=0):
+    """
+    Asserts the POSTs for path are line-aligned, within MAX_BODY and cover the file from since, returns how many there were
+    """
+    name = os.path.basename(path).split(".")[0]
+    bodies = [body for url, body in fake.posts if url.endswith(f"/{name}?qos=1")]
+
+    with open(path, "rb") as file:
+        expected = file.read()[since:]
+
+    assert all(body.endswith(b"\n") and len(body) <= MAX_BODY for body in bodies), [len(body) for body in bodies]
+    assert b"".join(bodies) == expected, f"{path}: {sum(len(body) for body in bodies)} of {len(expected)} bytes"
+
+    return len(bodies)
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        hrd = os.path.join(directory, "hrd")
+        os.mkdir(hrd)
+        write_lines(os.path.join(hrd, "watertemperature.csv"), 1200)
+        write_lines(os.path.join(hrd, "barometer.csv"), 150)
+
+        fake = FakeHTTP()
+        modem = make_modem(fake)
+        modem.config_power_cycled = True
+        assert modem.configure_http()
+
+        manifest = os.path.join(directory, "upload_manifest.json")
+        url = "https://example.iot.amazonaws.com:8443/topics/XBX/test/upload/{name}?qos=1"
+
+        uploader = BulkUploader(modem, url, (hrd,), max_body=MAX_BODY, manifest_path=manifest)
+        queued = uploader.queued_bytes()
+        assert uploader.upload()
+        posts = sum(check_bodies(fake, os.path.join(hrd, name)) for name in ("watertemperature.csv", "barometer.csv"))
+        assert posts == len(fake.posts) and uploader.bytes_sent == queued
+        print(f"first upload:  {queued} bytes in {posts} POSTs")
+
+        fake.posts = []
+        uploader = BulkUploader(modem, url, (hrd,), max_body=MAX_BODY, manifest_path=manifest)
+        assert uploader.queued_bytes() == 0 and uploader.upload() and not fake.posts
+        print("second upload: nothing sent")
+
+        #Sample queue bookkeeping is never data
+        with open(os.path.join(hrd, "cursor.json"), "w") as cursor_file:
+            cursor_file.write('{"segment": 1, "offset": 0}\n')
+        assert BulkUploader(modem, url, (hrd,), max_body=MAX_BODY, manifest_path=manifest).queued_bytes() == 0
+
+        path = os.path.join(hrd, "watertemperature.csv")
+        since = os.stat(path)[6]
+        write_lines(path, 400, start=1200, mode="a")
+        uploader = BulkUploader(modem, url, (hrd,), max_body=MAX_BODY, manifest_path=manifest)
+        assert uploader.upload()
+        print(f"third upload:  {check_bodies(fake, path, since)} POSTs for the {os.stat(path)[6] - since} bytes appended")
+
+        fake.posts = []
+        fake.refuse = {1}
+        since = os.stat(path)[6]
+        write_lines(path, 1200, start=1600, mode="a")
+        uploader = BulkUploader(modem, url, (hrd,), max_body=MAX_BODY, manifest_path=manifest)
+        assert not uploader.upload()
+        accepted = len(fake.posts[0][1])
+        assert BulkUploader(modem, url, (hrd,), manifest_path=manifest).manifest[path] == since + accepted
+        print(f"refused POST:  manifest stopped at the {accepted} bytes accepted before it")
+
+    print("OK")
@@ -0,0 +1,137 @@
+"""
+Checks bg95m3.NetworkCache against a fake modem: the first attach scans with the configured sequence and
+bands and caches what AT+QNWINFO reports; the next attach puts the cached RAT first and narrows that
+RAT's band mask to the cached band and leaves it there once registered, so registration holds with no
+further AT+QCFG writes and the boot after that finds the narrowed settings already in NVM and writes
+nothing; if registration is later lost for the timeout, or the narrowed attach doesn't register within it,
+the configured scan sequence and bands go back on, with the time to registration still counted from the
+start of the attach.
+
+    python3 host/check_network_cache.py
+"""
+import os
+import tempfile
+import time
+
+import shims
+shims.install()
+
+import bg95m3
+from fake_modem import make_modem
+from fake_uart import FakeUART
+
+FULL_BANDS = "0xf,0x100002000000000f0e189f,0x10004200000000090e189f"
+
+class FakeRadio(FakeUART):
+    def __init__(self, network):
+        super().__init__()
+        self.network = network      #(act, oper, band) the fake registers on
+        self.qcfg = {'"iotopmode"': "2", '"nwscanseq"': "020301", '"band"': FULL_BANDS}
+        self.registered = False
+        self.accepts_narrowed = True
+
+    def respond(self, data):
+        self.schedule(((0.002, data),))
+
+    def write(self, data):
+        command = bytes(data).strip(b"\r\n").decode("utf-8")
+        self.written.append(command)
+
+        if command.startswith("AT+QCFG="):
+            #Queries come concatenated: AT+QCFG="iotopmode";+QCFG="nwscanseq";+QCFG="band"
+            reply = ""
+
+            for part in command[2:].split(";"):
+                selector, _, value = part[len("+QCFG="):].partition(",")
+
+                if value:
+                    self.qcfg[selector] = value
+                else:
+                    reply += f"\r\n+QCFG: {selector},{self.qcfg[selector]}\r\n"
+
+            self.respond(f"{reply}\r\nOK\r\n".encode("utf-8"))
+        elif command == "AT+CREG?":
+            narrowed = self.qcfg['"band"'] != FULL_BANDS
+            stat = 1 if self.registered and (self.accepts_narrowed or not narrowed) else 2
+            self.respond(f"\r\n+CREG: 0,{stat}\r\n\r\nOK\r\n".encode("utf-8"))
+        elif command == "AT+QNWINFO":
+            act, oper, band = self.network
+            self.respond(f'\r\n+QNWINFO: "{act}","{oper}","{band}",5110\r\n\r\nOK\r\n'.encode("utf-8"))
+        else:
+            self.respond(b"\r\nOK\r\n")
+
+        return len(data)
+
+def qcfg_writes(fake):
+    """
+    AT+QCFG commands that set something (and so write NVM), not the concatenated read-back queries
+    """
+    return [command for command in fake.written if command.startswith("AT+QCFG=") and "," in command]
+
+def attach(cache_path, fake, timeout=60):
+    modem = make_modem(fake)
+    network = bg95m3.NetworkCache(modem, timeout=timeout, cache_path=cache_path)
+    network.configure()
+    fake.registered = True
+
+    start = time.monotonic()
+    while not network.step():
+        modem.link_state.invalidate()
+        assert time.monotonic() - start < 5, "never registered"
+        time.sleep(0.02)
+
+    return network
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        cache_path = os.path.join(directory, "network_cache.json")
+
+        fake = FakeRadio(("NBIoT", "310410", "LTE BAND 13"))
+        network = attach(cache_path, fake)
+        assert fake.qcfg['"nwscanseq"'] == "020301" and not network.narrowed
+        assert network.load_cache()['band'] == "LTE BAND 13"
+        print(f"first attach:  full scan, cached {network.cache['oper']} {network.cache['act']} {network.cache['band']}")
+
+        fake = FakeRadio(("NBIoT", "310410", "LTE BAND 13"))
+        network = attach(cache_path, fake)
+        narrowed_qcfg = dict(fake.qcfg)
+        assert narrowed_qcfg['"nwscanseq"'] == "030201", fake.qcfg
+        assert narrowed_qcfg['"band"'] == f"0xf,0x100002000000000f0e189f,0x{1 << 12:x}", fake.qcfg
+        assert network.narrowed and network.take_reading() is None
+        nbiot_bands = fake.qcfg['"band"'].split(",")[2]
+        print(f"second attach: NB-IoT first, NB-IoT bands narrowed to {nbiot_bands}")
+
+        #Registered on the narrowed bands: nothing is rewritten, so nothing can detach or re-scan
+        writes = len(qcfg_writes(fake))
+        for _ in range(5):
+            network.modem.link_state.invalidate()
+            assert network.step()
+        assert len(qcfg_writes(fake)) == writes and fake.qcfg == narrowed_qcfg, qcfg_writes(fake)
+        print(f"registered:    stayed registered over 5 checks with no AT+QCFG writes")
+
+        #Next boot, same network: the narrowed settings are read back from NVM, not written again
+        fake = FakeRadio(("NBIoT", "310410", "LTE BAND 13"))
+        fake.qcfg = dict(narrowed_qcfg)
+        network = attach(cache_path, fake, timeout=0.2)
+        assert qcfg_writes(fake) == [] and network.narrowed, fake.written
+        print(f"third attach:  narrowed settings already in NVM, {len(fake.written) - fake.written.count('AT+CREG?')} commands, no writes")
+
+        #Registration lost on the narrowed bands for the timeout: the full scan goes back on
+        fake.registered = False
+        start = time.monotonic()
+        while network.narrowed:
+            network.modem.link_state.invalidate()
+            assert not network.step() and time.monotonic() - start < 5, "never fell back"
+            time.sleep(0.02)
+        assert fake.qcfg['"nwscanseq"'] == "020301" and fake.qcfg['"band"'] == FULL_BANDS, fake.qcfg
+        print(f"lost:          unregistered for {time.monotonic() - start:.2f} s on the cached band, scanning all bands")
+
+        fake = FakeRadio(("eMTC", "310260", "LTE BAND 4"))
+        fake.accepts_narrowed = False
+        network = attach(cache_path, fake, timeout=0.2)
+        assert not network.narrowed and fake.qcfg['"nwscanseq"'] == "020301"
+        assert network.time_to_registration >= 0.2, network.time_to_registration
+        assert network.load_cache()['band'] == "LTE BAND 4"
+        print(f"cache miss:    fell back to a full scan, registered {network.time_to_registration:.2f} s after the attach started")
+
+    print("OK")
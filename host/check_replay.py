@@ -0,0 +1,57 @@
+"""
+Checks the transcript recorder and replay emulator end to end: records an MQTT publish cycle against
+host/fake_modem.py through lib/at_transcript.py, then replays the transcript into a fresh driver at
+recorded speed and with no delays. Both replays have to match every recorded write and deliver the
+same publish results. Reports how long the cycle took each time. Also checks that the recorder has written
+every reply out by the end of the cycle without being flushed, and that a second boot appending to the same
+file starts a session of its own.
+
+    python3 host/check_replay.py
+"""
+import os
+import tempfile
+import time
+
+import shims
+shims.install()
+
+from at_transcript import TranscriptRecorder
+from fake_modem import FakeModem, make_modem, make_socket
+from replay_uart import ReplayUART, load_sessions, load_transcript
+
+def publish_cycle(uart):
+    socket = make_socket(make_modem(uart))
+    messages = [(f"XBX/test/{index}", ('{"value": %d, "unit": "C"}' % index) * (1 + index * 20)) for index in range(8)]
+
+    start = time.monotonic()
+    assert socket.ensure_connected()
+    results = socket.publish_many(messages)
+
+    return results, time.monotonic() - start
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "publish.at")
+
+        #An earlier boot's session, then this one's, appended to the same file
+        for boot in range(2):
+            recorder = TranscriptRecorder(FakeModem(latency=0.01, ack_delay=0.05), path)
+            recorded, recorded_time = publish_cycle(recorder)
+
+            assert not recorder.pending, f"{len(recorder.pending)} events still buffered after the last reply"
+            recorder.close()
+
+        sessions = load_sessions(path)
+        events = load_transcript(path)
+        assert len(sessions) == 2 and events == sessions[1] and events[0][0] < sessions[0][-1][0]
+        print(f"recorded:  {recorded_time:6.3f} s, {len(events)} events, {len(sessions)} sessions")
+
+        for label, speed in (("replay 1x", 1.0), ("replay max", None)):
+            uart = ReplayUART(path, speed=speed)
+            replayed, replay_time = publish_cycle(uart)
+
+            assert replayed == recorded, (replayed, recorded)
+            assert uart.finished and not uart.unmatched, f"{label}: stopped at event {uart.cursor} of {len(uart.events)}"
+            print(f"{label}: {replay_time:6.3f} s, {len(replayed)} publishes matched")
+
+    print("OK")
@@ -0,0 +1,116 @@
+"""
+Checks services/sample_queue.py in a temporary directory: cycles that can't transmit stay queued, drain()
+sends them oldest-first and only moves the cursor on what was acknowledged, a segment that's partly
+acknowledged is sent again from the cursor, sent segments are deleted, the cursor survives a reset (even
+one between writing it and renaming it into place), the queue is capped at max_bytes, depth/drain rate
+readings are handed out, and drain_async() acknowledges the same way under asyncio.
+
+    python3 host/check_sample_queue.py
+"""
+import asyncio
+import os
+import tempfile
+
+import shims
+shims.install()
+
+from services.sample_queue import CURSOR_NAME, CURSOR_TMP_NAME, SampleQueue
+
+class Link:
+    """
+    A send() for drain(): keeps the lines it's given, acknowledging at most `budget` of them
+    """
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.received = []
+
+    def send(self, path, offset, size):
+        with open(path, "r") as segment_file:
+            segment_file.seek(offset)
+            lines = segment_file.read(size - offset).splitlines(keepends=True)
+
+        acked = offset
+        for line in lines:
+            if(self.budget is not None):
+                if(self.budget == 0):
+                    break
+                self.budget -= 1
+
+            self.received.append(line.strip())
+            acked += len(line.encode("utf-8"))
+
+        return acked
+
+def append_cycle(queue, cycle, readings=10):
+    with queue.open_segment() as segment_file:
+        for index in range(readings):
+            segment_file.write(f'{{"cycle": {cycle}, "reading": {index}, "value": {cycle * 0.5 + index}}}\n')
+
+    return [f'{{"cycle": {cycle}, "reading": {index}, "value": {cycle * 0.5 + index}}}' for index in range(readings)]
+
+if __name__ == "__main__":
+    directory = tempfile.mkdtemp()
+    queue = SampleQueue(directory, segment_size=1024)
+
+    expected = []
+    for cycle in range(3):
+        expected += append_cycle(queue, cycle)
+        assert not queue.drain(Link(budget=0).send)
+    assert queue.depth() == sum(len(line) + 1 for line in expected)
+    print(f"offline:   3 cycles kept, {queue.depth()} bytes in {len(queue.segments)} segments")
+
+    link = Link(budget=15)
+    assert not queue.drain(link.send)
+    assert link.received == expected[:15]
+
+    queue = SampleQueue(directory, segment_size=1024)
+    assert queue.depth() == sum(len(line) + 1 for line in expected[15:])
+    print(f"partial:   15 lines acked, cursor {queue.cursor} survived a reset")
+
+    for cycle in range(3, 12):
+        expected += append_cycle(queue, cycle)
+    assert len(queue.segments) > 2
+
+    link = Link()
+    assert queue.drain(link.send)
+    assert link.received == expected[15:]
+    assert queue.depth() == 0 and len(queue.segments) == 1
+    assert sorted(os.listdir(directory)) == sorted([CURSOR_NAME, f"{queue.segments[0]:08d}.seg"])
+    print(f"drain:     {len(link.received)} lines oldest-first, sent segments deleted")
+
+    readings = {reading.description: reading for reading in queue.take_readings()}
+    assert readings["Queue Depth"].value == 0 and readings["Queue Drain Rate"].unit == "B/s"
+    assert [reading.description for reading in queue.take_readings()] == ["Queue Depth"]
+    print("readings:  queue depth every cycle, drain rate after a drain")
+
+    os.rename(f"{directory}/{CURSOR_NAME}", f"{directory}/{CURSOR_TMP_NAME}")
+    expected = append_cycle(queue, 12)
+    queue = SampleQueue(directory, segment_size=1024)
+    link = Link()
+    assert queue.drain(link.send) and link.received == expected
+    print("reset:     cursor recovered from the temporary file")
+
+    capped = SampleQueue(tempfile.mkdtemp(), segment_size=1024, max_bytes=4096)
+    for cycle in range(40):
+        append_cycle(capped, cycle)
+    assert capped.depth() <= 4096 + 1024 + 600
+    link = Link()
+    capped.drain(link.send)
+    assert link.received[0].startswith('{"cycle": 30,') and link.received[-1].startswith('{"cycle": 39,'), link.received[0]
+    print(f"cap:       oldest segments dropped, newest kept ({len(link.received)} of 400 lines left)")
+
+    queue = SampleQueue(tempfile.mkdtemp(), segment_size=1024)
+    expected = [line for cycle in range(6) for line in append_cycle(queue, cycle)]
+    link = Link(budget=25)
+
+    async def send(path, offset, size):
+        await asyncio.sleep(0)
+        return link.send(path, offset, size)
+
+    assert not asyncio.run(queue.drain_async(send))
+    assert link.received == expected[:25] and queue.depth() == sum(len(line) + 1 for line in expected[25:])
+    link.budget = None
+    assert asyncio.run(queue.drain_async(send)) and link.received == expected
+    print("async:     drain_async() commits only acknowledged lines, the rest is sent next time")
+
+    print("OK")
@@ -0,0 +1,101 @@
+"""
+Checks the deadline scheduler behind SM_TIMED and SM_COUNT (lib/services/sample_scheduler.py) on a fake
+clock: samples start on the start + k * period grid however long each one takes, so a window of
+SAMPLE_WINDOW_DURATION at SAMPLE_FREQ takes exactly its SAMPLE_WINDOW_DURATION * SAMPLE_FREQ samples where
+sleeping SAMPLE_INTERVAL after the work drifts and falls short; a sample that runs over skips the slots it
+covered and counts them as overruns instead of bunching up samples to catch up; late starts are measured
+as jitter; and the window's jitter and overruns come back as readings that pack as channel records.
+
+    python3 host/check_sample_scheduler.py
+"""
+import types
+
+import shims
+shims.install()
+
+from channels import channel_for
+from services import sample_scheduler
+from services.sample_scheduler import NS_PER_SECOND, SampleScheduler
+
+SAMPLE_FREQ = 5
+SAMPLE_WINDOW_DURATION = 5
+SAMPLE_INTERVAL = 1 / SAMPLE_FREQ
+
+class FakeClock:
+    """
+    time.monotonic_ns() and time.sleep() on a clock that only moves when slept on or worked against
+    """
+    def __init__(self, wake_latency=0):
+        self.now = 10 * NS_PER_SECOND
+        self.wake_latency = wake_latency
+
+    def monotonic_ns(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += round(seconds * NS_PER_SECOND) + self.wake_latency
+
+    def work(self, seconds):
+        self.now += round(seconds * NS_PER_SECOND)
+
+def run(scheduler, clock, work):
+    """
+    Returns the offset in seconds from the window's start at which each sample started
+    """
+    starts = []
+
+    while scheduler.wait():
+        starts.append((clock.now - scheduler.start_time) / NS_PER_SECOND)
+        clock.work(work(len(starts) - 1))
+
+    return starts
+
+def use(clock):
+    sample_scheduler.time = types.SimpleNamespace(monotonic_ns=clock.monotonic_ns, sleep=clock.sleep)
+
+if __name__ == "__main__":
+    clock = FakeClock()
+    use(clock)
+    scheduler = SampleScheduler(SAMPLE_FREQ, duration=SAMPLE_WINDOW_DURATION)
+    starts = run(scheduler, clock, lambda index: 0.13)
+
+    assert len(starts) == SAMPLE_FREQ * SAMPLE_WINDOW_DURATION, len(starts)
+    assert all(abs(start - index * SAMPLE_INTERVAL) < 1e-6 for index, start in enumerate(starts)), starts
+    assert scheduler.overruns == 0 and scheduler.jitter_max == 0
+
+    old_clock, old_starts = FakeClock(), []
+    while old_clock.now - 10 * NS_PER_SECOND < SAMPLE_WINDOW_DURATION * NS_PER_SECOND:
+        old_starts.append(old_clock.now)
+        old_clock.work(0.13)
+        old_clock.sleep(SAMPLE_INTERVAL)
+    print(f"timed:    {len(starts)} samples on the {SAMPLE_INTERVAL} s grid in {SAMPLE_WINDOW_DURATION} s, "
+          f"sleeping after the work managed {len(old_starts)} ({len(old_starts) / SAMPLE_WINDOW_DURATION:.1f} Hz)")
+
+    clock = FakeClock()
+    use(clock)
+    scheduler = SampleScheduler(SAMPLE_FREQ, duration=SAMPLE_WINDOW_DURATION)
+    starts = run(scheduler, clock, lambda index: 0.5 if index == 3 else 0.05)
+
+    assert scheduler.overruns == 1, scheduler.overruns
+    assert len(starts) == SAMPLE_FREQ * SAMPLE_WINDOW_DURATION - 1
+    assert abs(starts[4] - 1.1) < 1e-6 and abs(starts[5] - 1.2) < 1e-6, starts[:6]
+    assert all(abs(start / SAMPLE_INTERVAL - round(start / SAMPLE_INTERVAL)) < 1e-6 for start in starts[:4] + starts[5:])
+    assert abs(scheduler.jitter_max - 0.1 * NS_PER_SECOND) < 1000
+    print(f"overrun:  a 0.5 s sample skipped {scheduler.overruns} slot, the next ran 100 ms late, then back on the grid")
+
+    clock = FakeClock(wake_latency=3000000)
+    use(clock)
+    scheduler = SampleScheduler(SAMPLE_FREQ, count=3)
+    starts = run(scheduler, clock, lambda index: 0.01)
+    jitter, overruns = scheduler.take_readings()
+
+    assert len(starts) == 3 and scheduler.overruns == 0
+    assert jitter.description == "Sample Jitter" and overruns.description == "Sample Overruns"
+    assert abs(jitter.value[0] - 2.0) < 1e-6 and abs(jitter.value[1] - 3.0) < 1e-6, jitter.value
+    assert overruns.value == 0 and clock.now - scheduler.start_time < 0.5 * NS_PER_SECOND
+    assert channel_for(jitter).unpack(channel_for(jitter).pack(jitter.value)) == jitter.value
+    assert channel_for(overruns).unpack(channel_for(overruns).pack(overruns.value)) == 0
+    print(f"count:    3 samples, 3 ms wake latency gives {jitter.value[0]:.1f} ms mean / {jitter.value[1]:.1f} ms max jitter, "
+          "no sleep after the last one")
+
+    print("OK")
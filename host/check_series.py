@@ -0,0 +1,125 @@
+"""
+Checks the per-channel series encoding (lib/series.py): a window of slowly changing readings decodes to
+exactly what the channel records would have (same float32 and scaled-integer values, same times), the
+decoded readings re-encode to the same bytes, missing values, unregistered channels, clock steps and
+vectors survive, oversized windows are split to fit, a segment of appended blocks reads back, and series
+batches published through host/fake_modem.py decode with host/decode_batch.py.
+
+    python3 host/check_series.py
+"""
+import io
+import os
+import random
+import time
+
+os.environ["TZ"] = "UTC"
+time.tzset()
+
+import shims
+shims.install()
+
+import bg95m3
+from channels import RecordWriter, read_records
+from decode_batch import decode_batch
+from fake_modem import FakeModem, make_modem, make_socket
+from reading import Reading, struct_time_to_iso8601
+from series import decode_block, encode_block, encode_blocks, read_blocks
+from services.batch_publisher import SERIES_SUFFIX, BatchPublisher
+
+START = 1792312200      # 2026-10-18T08:30:00
+
+def reading_at(seconds, value, unit, description):
+    reading = Reading(value, unit, description)
+    reading.datetime = struct_time_to_iso8601(time.localtime(seconds))
+
+    return reading
+
+def window(samples, seed=23):
+    """
+    Readings a cycle at SAMPLE_FREQ = 5 would take: slow random walks, noisy IMU vectors, a drifting fix
+    """
+    random.seed(seed)
+    pressure, temperature, ec, lat, lon = 1013.2, 18.5, 52000.0, 41.5236, -70.6713
+    readings = []
+
+    for index in range(samples):
+        seconds = START + index // 5
+        pressure += random.gauss(0, 0.02)
+        temperature += random.gauss(0, 0.005)
+        ec += random.gauss(0, 2)
+        lat += random.gauss(0, 2e-6)
+        lon += random.gauss(0, 2e-6)
+
+        readings += [
+            reading_at(seconds, round(pressure, 2), "hPa", "Ambient Pressure"),
+            reading_at(seconds, round(temperature, 2), "C", "Ambient Temperature"),
+            reading_at(seconds, round(ec, 1), "uS/cm", "Salinity"),
+            reading_at(seconds, tuple(round(random.gauss(0, 0.05) + g, 4) for g in (0, 0, 9.81)), "m/s^2", "Acceleration Vector"),
+            reading_at(seconds, (round(lat, 6), round(lon, 6)), "degrees", "Location"),
+            reading_at(seconds, 9, "-", "Satellites in View"),
+        ]
+
+    return readings
+
+def as_records(readings):
+    stream = io.BytesIO()
+    writer = RecordWriter(stream)
+
+    for reading in readings:
+        writer.write(reading)
+
+    return list(read_records(io.BytesIO(stream.getvalue()))), len(stream.getvalue())
+
+def by_channel(readings):
+    return sorted(((r.description, r.unit, r.datetime, str(r.value)) for r in readings))
+
+if __name__ == "__main__":
+    readings = window(300)
+    block = encode_block(readings)
+    decoded = decode_block(block)
+    expected, record_bytes = as_records(readings)
+
+    assert by_channel(decoded) == by_channel(expected), "series and records disagree"
+    assert encode_block(decoded) == block, "re-encoding the decoded readings changed the bytes"
+    print(f"roundtrip: {len(readings)} readings match the channel records exactly, re-encoded bit-exact")
+    print(f"size:      records {record_bytes / len(readings):.2f} B/reading, series {len(block) / len(readings):.2f} B/reading "
+          f"({record_bytes / len(block):.1f}x smaller)")
+
+    odd = [
+        reading_at(START, 1013.0, "hPa", "Ambient Pressure"),
+        reading_at(START + 1, None, "hPa", "Ambient Pressure"),
+        reading_at(START + 2, 1013.5, "hPa", "Ambient Pressure"),
+        reading_at(START - 3600, 1012.0, "hPa", "Ambient Pressure"),
+        reading_at(START + 86400 * 400, 1011.0, "hPa", "Ambient Pressure"),
+        reading_at(START, (None, None), "degrees", "Location"),
+        reading_at(START + 5, (41.5, -70.6), "degrees", "Location"),
+        reading_at(START, 3.5, "ppt", "Salinity"),
+        reading_at(START, "no probe", "C", "Sea Temperature"),
+        reading_at(START, 0, "B", "Queue Depth"),
+        reading_at(START + 1, 4294967295 - 1, "B", "Queue Depth"),
+    ]
+    assert by_channel(decode_block(encode_block(odd))) == by_channel(as_records(odd)[0])
+    print("edges:     missing values, clock steps, unregistered channels, odd values, full-range integers")
+
+    blocks = list(encode_blocks(readings, 512))
+    assert all(len(block) <= 512 for block in blocks) and len(blocks) > 1
+    segment = b"".join(blocks)
+    assert by_channel(read_blocks(io.BytesIO(segment))) == by_channel(expected)
+    assert len(list(read_blocks(io.BytesIO(segment[:-1])))) < len(readings)
+    print(f"segment:   split into {len(blocks)} blocks of at most 512 bytes, read back from one stream")
+
+    uart = FakeModem(latency=0, ack_delay=0)
+    socket = make_socket(make_modem(uart))
+    publisher = BatchPublisher("XBX/test", bg95m3.MQTT_MAX_PAYLOAD)
+    results = socket.publish_many(publisher.series_batches(window(1500)))
+    assert all(result["result"] == 0 for result in results)
+
+    published = []
+    for topic, payload in uart.published:
+        assert len(payload) <= bg95m3.MQTT_MAX_PAYLOAD and topic.endswith(SERIES_SUFFIX), (topic, len(payload))
+        published.extend(Reading(r["value"], r["unit"], r["description"]) for r in decode_batch(payload))
+
+    assert len(published) == publisher.readings_packed == 9000
+    print(f"publish:   {publisher.readings_packed} readings in {publisher.messages_built} messages, {publisher.bytes_on_air} B on air")
+
+    print("OK")
@@ -0,0 +1,79 @@
+"""
+Checks the time service: +QLTS/+CCLK times convert to UTC (zone in quarter hours, 2 or 4 digit years,
+the modem's 1980 power-on clock rejected), network time wins over GPS time, GPS time is used while the
+modem isn't registered, both clocks are set and the offset is handed out once, and nothing is asked
+again until the resync interval passes.
+
+    python3 host/check_time_sync.py
+"""
+import calendar
+import os
+import time
+import types
+
+os.environ["TZ"] = "UTC"
+time.tzset()
+
+import shims
+shims.install()
+
+from bg95m3 import modem_time_to_epoch
+from services.time_service import SOURCE_GPS, SOURCE_MODEM, TimeService
+
+NETWORK_TIME = calendar.timegm((2026, 10, 18, 8, 30, 0))
+
+class Clock:
+    def __init__(self):
+        self.datetime = None
+
+class FakeModem:
+    def __init__(self, registered):
+        self.is_up = True
+        self.registered = registered
+        self.queries = 0
+
+    def is_registered_to_network(self):
+        return self.registered
+
+    def get_network_time(self):
+        self.queries += 1
+        return NETWORK_TIME
+
+    def get_clock_time(self):
+        return None
+
+def fake_gps(utc):
+    return types.SimpleNamespace(enabled=True, base_device=types.SimpleNamespace(fix_quality=1, datetime=utc))
+
+if __name__ == "__main__":
+    assert modem_time_to_epoch('2026/10/18,08:30:00+04,0', is_local=False) == NETWORK_TIME
+    assert modem_time_to_epoch('26/10/18,09:30:00+04') == NETWORK_TIME
+    assert modem_time_to_epoch('26/10/18,04:30:00-16') == NETWORK_TIME
+    assert modem_time_to_epoch('80/01/06,00:00:12+00') is None
+    assert modem_time_to_epoch('') is None
+    print("parse: +QLTS and +CCLK times converted to UTC, power-on clock rejected")
+
+    gps = fake_gps(time.gmtime(NETWORK_TIME + 5))
+
+    ds3231, onboard = Clock(), Clock()
+    modem = FakeModem(registered=True)
+    service = TimeService(ds3231, onboard, modem, gps)
+    assert service.step() and service.source == SOURCE_MODEM
+    assert calendar.timegm(ds3231.datetime) == NETWORK_TIME and onboard.datetime == ds3231.datetime
+    offset = service.take_reading()
+    assert offset.description == "Clock Offset" and abs(offset.value - (NETWORK_TIME - time.time())) < 2
+    assert service.take_reading() is None
+    assert service.step() and modem.queries == 1
+    print(f"modem: clocks set from network time, offset {offset.value:+.0f} s recorded once, not asked again")
+
+    ds3231, onboard = Clock(), Clock()
+    service = TimeService(ds3231, onboard, FakeModem(registered=False), gps)
+    assert service.step() and service.source == SOURCE_GPS
+    assert calendar.timegm(ds3231.datetime) == NETWORK_TIME + 5
+    print("gps:   used while the modem isn't registered")
+
+    service = TimeService(Clock(), Clock(), FakeModem(registered=False), fake_gps(None), resync_interval=0)
+    assert not service.step() and service.take_reading() is None
+    print("none:  no source, clocks left alone")
+
+    print("OK")
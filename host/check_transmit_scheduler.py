@@ -0,0 +1,64 @@
+"""
+Checks services/transmit_scheduler.py against a scripted signal trace: a good LTE link transmits, a poor
+one is held back until max_latency has passed, a link reporting only AT+CSQ is judged on CSQ, single
+outlier readings don't flip the decision (medians), and record() hands out s/KB and J/KB readings.
+
+    python3 host/check_transmit_scheduler.py
+"""
+import time
+
+import shims
+shims.install()
+
+from services.transmit_scheduler import TransmitScheduler
+
+class SignalTrace:
+    """
+    Answers get_signal_quality/get_serving_signal_quality from a list of (csq, rsrp, rsrq) readings
+    """
+    def __init__(self, readings):
+        self.readings = list(readings)
+        self.current = None
+
+    def get_signal_quality(self):
+        self.current = self.readings.pop(0)
+        return {'rssi': self.current[0], 'ber': 99}
+
+    def get_serving_signal_quality(self):
+        csq, rsrp, rsrq = self.current
+        if rsrp is None:
+            return {'sysmode': "GSM", 'rssi': -80}
+        return {'sysmode': "eMTC", 'rssi': -70, 'rsrp': rsrp, 'sinr': 60, 'rsrq': rsrq}
+
+GOOD = (20, -95, -9)
+POOR = (6, -124, -18)
+
+def scheduler(readings, max_latency=3600):
+    return TransmitScheduler(SignalTrace(readings), max_latency=max_latency, sample_interval=0)
+
+if __name__ == "__main__":
+    assert scheduler([GOOD] * 3).should_transmit()
+    assert not scheduler([POOR] * 3).should_transmit()
+    assert scheduler([POOR, GOOD, GOOD]).should_transmit()
+    assert not scheduler([GOOD, POOR, POOR]).should_transmit()
+    print("signal: good link sends, poor link holds, one outlier doesn't flip it")
+
+    assert scheduler([(12, None, None)] * 3).should_transmit()
+    assert not scheduler([(5, None, None)] * 3).should_transmit()
+    assert not scheduler([(99, None, None)] * 3).should_transmit()
+    print("csq:    judged on AT+CSQ without RSRP/RSRQ, 99 (unknown) never sends")
+
+    held = scheduler([POOR] * 9, max_latency=0.2)
+    assert not held.should_transmit() and not held.should_transmit()
+    time.sleep(0.25)
+    assert held.should_transmit() and held.deferred_since is None
+    print("latency: poor link sent anyway once data was held for max_latency")
+
+    held.take_readings()
+    held.record(10 * 1024, 5.0)
+    readings = {reading.description: reading.value for reading in held.take_readings()}
+    assert readings == {"Transmit Time Per KB": 0.5, "Transmit Energy Per KB": 0.3}, readings
+    assert held.take_readings() == []
+    print(f"cost:   {readings}")
+
+    print("OK")
@@ -0,0 +1,43 @@
+"""
+Decodes the batches lib/services/batch_publisher.py publishes: a zlib-compressed JSON array of readings
+on <topic>/zlib, channel records on <topic>/records (see host/decode_records.py), series blocks on
+<topic>/series (see host/decode_series.py), or a plain JSON array on any other topic. Prints one
+reading per line.
+
+    python3 host/decode_batch.py payload.bin [...]     # payloads saved from the broker
+    python3 host/decode_batch.py --hex 789c8b56...     # a payload as hex, e.g. from an IoT rule
+"""
+import json
+import sys
+import zlib
+
+def decode_batch(payload):
+    """
+    Returns the readings in one published payload (bytes), compressed, as records or series, or plain
+    """
+    #Record payloads always open with a time record, channel 0
+    if payload[:1] == b"\x00":
+        from decode_records import decode_records
+        return decode_records(payload)
+
+    if payload[:1] == b"S":
+        from decode_series import decode_series
+        return decode_series(payload)
+
+    if payload[:1] != b"[":
+        payload = zlib.decompress(payload)
+
+    return json.loads(payload.decode("utf-8"))
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--hex":
+        payloads = [bytes.fromhex(text) for text in sys.argv[2:]]
+    else:
+        payloads = []
+        for path in sys.argv[1:]:
+            with open(path, "rb") as payload_file:
+                payloads.append(payload_file.read())
+
+    for payload in payloads:
+        for reading in decode_batch(payload):
+            print(json.dumps(reading))
@@ -0,0 +1,35 @@
+"""
+Decodes channel records (lib/channels.py): a sample queue segment (/sd/sample_data/*.seg) written with
+SAMPLE_FORMAT = SF_RECORDS, or a payload published on <topic>/records. Prints one reading per line, as the
+JSON sample lines would have been.
+
+    python3 host/decode_records.py 00000001.seg [...]
+    python3 host/decode_records.py --hex 0000f0a1...
+"""
+import io
+import json
+import sys
+
+import shims
+shims.install()
+
+from channels import read_records
+
+def decode_records(data):
+    """
+    Returns the readings in a record stream (bytes) as dicts of value, unit, description and datetime
+    """
+    return [reading.__dict__ for reading in read_records(io.BytesIO(data))]
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--hex":
+        streams = [bytes.fromhex(text) for text in sys.argv[2:]]
+    else:
+        streams = []
+        for path in sys.argv[1:]:
+            with open(path, "rb") as record_file:
+                streams.append(record_file.read())
+
+    for data in streams:
+        for reading in decode_records(data):
+            print(json.dumps(reading))
@@ -0,0 +1,35 @@
+"""
+Decodes per-channel series blocks (lib/series.py): a sample queue segment written with
+SAMPLE_FORMAT = SF_SERIES, or a payload published on <topic>/series. Prints one reading per line,
+channel by channel within each block.
+
+    python3 host/decode_series.py 00000001.seg [...]
+    python3 host/decode_series.py --hex 5301...
+"""
+import io
+import json
+import sys
+
+import shims
+shims.install()
+
+from series import read_blocks
+
+def decode_series(data):
+    """
+    Returns the readings in a stream of series blocks (bytes) as dicts of value, unit, description and datetime
+    """
+    return [reading.__dict__ for reading in read_blocks(io.BytesIO(data))]
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "--hex":
+        streams = [bytes.fromhex(text) for text in sys.argv[2:]]
+    else:
+        streams = []
+        for path in sys.argv[1:]:
+            with open(path, "rb") as series_file:
+                streams.append(series_file.read())
+
+    for data in streams:
+        for reading in decode_series(data):
+            print(json.dumps(reading))
@@ -0,0 +1,86 @@
+"""
+Host-side BG95 MQTT stand-in, built on FakeUART.
+
+Answers the AT commands MQTT_Socket sends for an already connected socket, including the
+length-prefixed AT+QMTPUBEX form: it answers with the "> " prompt, takes exactly <length> raw
+bytes as the payload, then acks with +QMTPUB. Every payload is kept in `published` for
+byte-exact comparison.
+"""
+from fake_uart import FakeUART
+
+def make_modem(uart):
+    """
+    Builds a BG95M3 on a fake UART without running the power-up sequence in __init__
+    """
+    import bg95m3
+
+    modem = object.__new__(bg95m3.BG95M3)
+    modem.init_channel(uart)
+
+    return modem
+
+def make_socket(modem, socket_id=0):
+    """
+    Builds an MQTT_Socket for an already open and connected client, skipping the SSL setup in __init__
+    """
+    import bg95m3
+
+    socket = object.__new__(bg95m3.MQTT_Socket)
+    socket.modem = modem
+    socket.socket_id = socket_id
+    socket.last_msg_id = 0
+    socket.in_flight = {}
+
+    return socket
+
+class FakeModem(FakeUART):
+    def __init__(self, latency=0.005, ack_delay=0.02):
+        super().__init__()
+        self.latency = latency
+        self.ack_delay = ack_delay
+        self.published = []         #(topic, payload bytes)
+        self.awaiting = None        #(socket_id, msg_id, topic, length) while taking data
+        self.data = b""
+
+    def respond(self, *chunks):
+        self.schedule([(self.latency + delay, data) for delay, data in chunks])
+
+    def ack(self, socket_id, msg_id, topic, payload):
+        self.published.append((topic, payload))
+        self.respond((0, b"\r\nOK\r\n"), (self.ack_delay, f"\r\n+QMTPUB: {socket_id},{msg_id},0\r\n".encode("utf-8")))
+
+    def write(self, data):
+        data = bytes(data)
+
+        if self.awaiting is not None:
+            self.data += data
+            socket_id, msg_id, topic, length = self.awaiting
+
+            if len(self.data) >= length:
+                payload, self.data, self.awaiting = self.data[:length], b"", None
+                self.ack(socket_id, msg_id, topic, payload)
+
+            return len(data)
+
+        command = data.strip(b"\r\n").decode("utf-8")
+        self.written.append(command)
+
+        if command == "AT+QMTCONN?":
+            self.respond((0, b"\r\n+QMTCONN: 0,3\r\n\r\nOK\r\n"))
+        elif command.startswith("AT+QMTPUBEX="):
+            self.publish(command[len("AT+QMTPUBEX="):])
+        else:
+            self.respond((0, b"\r\nOK\r\n"))
+
+        return len(data)
+
+    def publish(self, arguments):
+        socket_id, msg_id, qos, retain, rest = arguments.split(",", 4)
+        topic_end = rest.index('"', 1)
+        topic, tail = rest[1:topic_end], rest[topic_end + 2:]
+
+        if tail.startswith('"'):
+            self.ack(socket_id, msg_id, topic, tail[1:-1].encode("utf-8"))
+        else:
+            self.awaiting = (socket_id, msg_id, topic, int(tail))
+            self.respond((0, b"\r\n> "))
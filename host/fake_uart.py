@@ -0,0 +1,62 @@
+"""
+Scripted stand-in for busio.UART, for driving the modem code on a host machine.
+
+Each command written to the fake is looked up in a script of responses. A response is a list of
+(delay, bytes) chunks that become readable `delay` seconds after the command was written, so
+modem latency and URCs that trickle in after the final result can be reproduced.
+"""
+import time
+
+class FakeUART:
+    def __init__(self, script=None, default=((0.02, b"\r\nOK\r\n"),)):
+        self.script = script if script is not None else {}
+        self.default = default
+        self.pending = []       #(ready_at, bytes), in arrival order
+        self.written = []
+        self.arrivals = []      #ready_at of every chunk, for latency accounting
+
+    def schedule(self, chunks, start=None):
+        start = time.monotonic() if start is None else start
+
+        for delay, data in chunks:
+            self.pending.append((start + delay, data))
+            self.arrivals.append(start + delay)
+
+        self.pending.sort(key=lambda chunk: chunk[0])
+
+    def write(self, data):
+        self.written.append(bytes(data))
+        command = bytes(data).strip(b"\r\n").decode("utf-8", "replace")
+
+        self.schedule(self.script.get(command, self.default))
+
+        return len(data)
+
+    def _ready(self):
+        now = time.monotonic()
+        ready = b""
+
+        while self.pending and self.pending[0][0] <= now:
+            ready += self.pending.pop(0)[1]
+
+        return ready
+
+    @property
+    def in_waiting(self):
+        ready = self._ready()
+        if ready:
+            self.pending.insert(0, (0, ready))
+
+        return len(ready)
+
+    def read(self, nbytes=None):
+        ready = self._ready()
+
+        if nbytes is not None and len(ready) > nbytes:
+            self.pending.insert(0, (0, ready[nbytes:]))
+            ready = ready[:nbytes]
+
+        return ready or None
+
+    def reset_input_buffer(self):
+        self._ready()
@@ -0,0 +1,135 @@
+"""
+Deterministic replay of an AT transcript recorded by lib/at_transcript.py, behind the same
+read/write/in_waiting/reset_input_buffer surface as busio.UART.
+
+Every write the driver makes is matched byte for byte against the next recorded write. Once a recorded
+write is complete, the reads that followed it (responses, prompts and URCs alike) become readable after
+the same delays they had on hardware, divided by speed. speed=None plays them back with no delay at all.
+A transcript holds one session per boot; session picks which one to replay, the last by default.
+
+With strict=True a write that doesn't match the transcript raises ReplayMismatch; otherwise the replay
+skips ahead to the next recorded write it does match and notes the mismatch in `mismatches`.
+
+    python3 host/replay_uart.py transcript.at      # summarise each session in a transcript
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib"))
+
+from at_transcript import READ, SESSION, WRITE
+from fake_uart import FakeUART
+
+class ReplayMismatch(AssertionError):
+    pass
+
+def load_sessions(path):
+    """
+    Returns each session's events as lists of (seconds, direction, bytes), oldest session first. Events from
+    before the first session header (transcripts recorded without them) are a session of their own
+    """
+    sessions = [[]]
+
+    with open(path, "r") as transcript:
+        for line in transcript:
+            if line.startswith(SESSION):
+                if sessions[-1]:
+                    sessions.append([])
+                continue
+
+            fields = line.split()
+            if len(fields) != 3:
+                continue
+
+            sessions[-1].append((int(fields[0]) / 1000000, fields[1], bytes.fromhex(fields[2])))
+
+    return sessions
+
+def load_transcript(path, session=-1):
+    """
+    Returns one session's events as (seconds, direction, bytes), the last one by default
+    """
+    return load_sessions(path)[session]
+
+class ReplayUART(FakeUART):
+    def __init__(self, path, speed=1.0, strict=True, session=-1):
+        super().__init__()
+        self.events = load_transcript(path, session)
+        self.speed = speed
+        self.strict = strict
+        self.cursor = 0             #index of the next event not yet matched or scheduled
+        self.unmatched = b""        #bytes written that haven't completed a recorded write yet
+        self.mismatches = []
+
+        #Anything the modem sent before the first command, e.g. RDY and boot URCs
+        self.schedule_reads(0)
+
+    @property
+    def finished(self):
+        return self.cursor >= len(self.events) and not self.pending
+
+    def delay(self, seconds):
+        return seconds / self.speed if self.speed else 0
+
+    def schedule_reads(self, since):
+        chunks = []
+
+        while self.cursor < len(self.events) and self.events[self.cursor][1] == READ:
+            at, direction, data = self.events[self.cursor]
+            chunks.append((self.delay(max(0, at - since)), data))
+            self.cursor += 1
+
+        self.schedule(chunks)
+
+    def write(self, data):
+        data = bytes(data)
+        self.written.append(data)
+        self.unmatched += data
+
+        while self.unmatched and self.cursor < len(self.events):
+            at, direction, expected = self.events[self.cursor]
+            length = min(len(expected), len(self.unmatched))
+
+            if self.unmatched[:length] != expected[:length]:
+                if not self.resync(expected):
+                    break
+                continue
+
+            if len(self.unmatched) < len(expected):
+                break
+
+            self.unmatched = self.unmatched[len(expected):]
+            self.cursor += 1
+            self.schedule_reads(at)
+
+        return len(data)
+
+    def resync(self, expected):
+        """
+        Handles a write that doesn't match the transcript. Returns True if the replay found a later recorded
+        write to carry on from
+        """
+        if self.strict:
+            raise ReplayMismatch(f"event {self.cursor}: expected {expected!r}, got {self.unmatched!r}")
+
+        self.mismatches.append((self.cursor, expected, self.unmatched))
+
+        for index in range(self.cursor + 1, len(self.events)):
+            at, direction, data = self.events[index]
+            if direction == WRITE and data.startswith(self.unmatched[:len(data)]):
+                self.cursor = index
+                return True
+
+        self.unmatched = b""
+        return False
+
+if __name__ == "__main__":
+    for index, events in enumerate(load_sessions(sys.argv[1])):
+        writes = [data for at, direction, data in events if direction == WRITE]
+        read_bytes = sum(len(data) for at, direction, data in events if direction == READ)
+
+        print(f"session {index}: {len(events)} events over {events[-1][0] if events else 0:.2f} s: {len(writes)} writes, {read_bytes} bytes read")
+
+        for data in writes:
+            if data.startswith(b"AT"):
+                print(f"  {data.decode('utf-8', 'replace').strip()}")
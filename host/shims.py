@@ -0,0 +1,42 @@
+"""
+Minimal stand-ins for the CircuitPython modules lib/bg95m3.py imports, so the driver can be
+exercised on CPython against a FakeUART. Only modules that aren't importable are shimmed.
+
+    import shims; shims.install()
+    import bg95m3
+"""
+import logging
+import os
+import sys
+import types
+
+LIB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib")
+
+class DigitalInOut:
+    def __init__(self, pin):
+        self.pin = pin
+        self.value = False
+        self.direction = None
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    return module
+
+def install(log_level=logging.WARNING):
+    if LIB not in sys.path:
+        sys.path.insert(0, LIB)
+
+    shims = {
+        "microcontroller": lambda: _module("microcontroller", watchdog=types.SimpleNamespace(feed=lambda: None, timeout=8, mode=None)),
+        "board": lambda: _module("board", __getattr__=lambda name: name),
+        "digitalio": lambda: _module("digitalio", DigitalInOut=DigitalInOut, Direction=types.SimpleNamespace(INPUT=0, OUTPUT=1)),
+        "adafruit_logging": lambda: _module("adafruit_logging", getLogger=logging.getLogger, StreamHandler=logging.StreamHandler,
+                                            FileHandler=logging.FileHandler, DEBUG=log_level),
+    }
+
+    for name, build in shims.items():
+        try:
+            __import__(name)
+        except ImportError:
+            sys.modules[name] = build()
@@ -0,0 +1,157 @@
+"""
+Shared +PREFIX: response table for the BG95M3.
+
+Each entry lists the named, typed fields of one information response or URC. Lines are split
+once, honouring quoted fields that contain commas (+QLTS, +QMTRECV), and each field is decoded
+by its column type, so callers get ints back without compiling a regex per call.
+
+Where a query answers with a different layout than the URC of the same name (AT+QMTOPEN? vs
++QMTOPEN: <client_idx>,<result>), the query layout is keyed as "+QMTOPEN?".
+"""
+
+def as_int(field):
+    try:
+        return int(field)
+    except ValueError:
+        return None
+
+def as_float(field):
+    try:
+        return float(field)
+    except ValueError:
+        return None
+
+def as_str(field):
+    return field.strip()
+
+def as_quoted(field):
+    return field.strip().strip('"')
+
+RESPONSE_FIELDS = {
+    #---DEVICE---#
+    "+QCCID:": (("iccid", as_str),),
+    "+QINDCFG:": (("urc_type", as_quoted), ("enable", as_int)),
+
+    #---NETWORK---#
+    "+CREG:": (("n", as_int), ("stat", as_int), ("lac", as_quoted), ("ci", as_quoted), ("act", as_int)),
+    "+COPS:": (("mode", as_int), ("format", as_int), ("operator", as_quoted), ("act", as_int)),
+    "+COPN:": (("numeric", as_quoted), ("alphanumeric", as_quoted)),
+    "+CSQ:": (("rssi", as_int), ("ber", as_int)),
+    "+QCSQ:": (("sysmode", as_quoted), ("rssi", as_int), ("rsrp", as_int), ("sinr", as_int), ("rsrq", as_int)),
+    "+QNWINFO:": (("act", as_quoted), ("oper", as_quoted), ("band", as_quoted), ("channel", as_int)),
+    "+QLTS:": (("datetime", as_quoted),),
+    "+CCLK:": (("datetime", as_quoted),),
+    "+CEREG:": (("n", as_int), ("stat", as_int), ("tac", as_quoted), ("ci", as_quoted), ("act", as_int), ("cause_type", as_int), ("reject_cause", as_int), ("active_time", as_quoted), ("periodic_tau", as_quoted)),
+
+    #---POWER SAVING---#
+    "+CPSMS:": (("mode", as_int), ("periodic_rau", as_quoted), ("gprs_ready_timer", as_quoted), ("periodic_tau", as_quoted), ("active_time", as_quoted)),
+    "+CEDRXS:": (("act_type", as_int), ("edrx_value", as_quoted)),
+    "+CEDRXRDP:": (("act_type", as_int), ("requested_edrx_value", as_quoted), ("network_edrx_value", as_quoted), ("paging_time_window", as_quoted)),
+
+    #---PACKET DATA---#
+    "+CGATT:": (("state", as_int),),
+    "+CGDCONT:": (("cid", as_int), ("pdp_type", as_quoted), ("apn", as_quoted), ("pdp_address", as_quoted), ("data_comp", as_int), ("head_comp", as_int), ("ipv4_address_allocation", as_int)),
+    "+CGACT:": (("cid", as_int), ("state", as_int)),
+    "+CGPADDR:": (("cid", as_int), ("pdp_address", as_quoted)),
+
+    #---SSL---#
+    "+QSSLSTATE:": (("client_id", as_int), ("service_type", as_quoted), ("ip_address", as_quoted), ("remote_port", as_int), ("local_port", as_int), ("socket_state", as_int), ("pdp_ctx", as_int), ("server_id", as_int), ("access_mode", as_int), ("at_port", as_quoted), ("ssl_ctx", as_int)),
+
+    #---GNSS---#
+    "+QGPS:": (("state", as_int),),
+    "+QGPSLOC:": (("time", as_str), ("latitude", as_float), ("longitude", as_float), ("hdop", as_float), ("altitude", as_float), ("fix", as_int), ("course_over_ground", as_float), ("speed_km", as_float), ("speed_kn", as_float), ("date", as_str), ("satellites", as_int)),
+    "+QGPSXTRA:": (("enable", as_int),),
+    "+QGPSXTRADATA:": (("valid_minutes", as_int), ("inject_time", as_quoted)),
+
+    #---FILE---#
+    "+QFLST:": (("file_name", as_quoted), ("file_size", as_int)),
+    "+QFUPL:": (("upload_size", as_int), ("checksum", as_str)),
+
+    #---HTTP---#
+    "+QHTTPPOST:": (("err", as_int), ("http_code", as_int), ("content_length", as_int)),
+    "+QHTTPGET:": (("err", as_int), ("http_code", as_int), ("content_length", as_int)),
+    "+QHTTPREADFILE:": (("err", as_int),),
+
+    #---MQTT---#
+    "+QMTOPEN:": (("socket_id", as_int), ("result", as_int)),
+    "+QMTOPEN?": (("socket_id", as_int), ("hostname", as_quoted), ("port", as_int)),
+    "+QMTCONN:": (("socket_id", as_int), ("result", as_int), ("ret_code", as_int)),
+    "+QMTCONN?": (("socket_id", as_int), ("state", as_int)),
+    "+QMTCLOSE:": (("socket_id", as_int), ("result", as_int)),
+    "+QMTDISC:": (("socket_id", as_int), ("result", as_int)),
+    "+QMTSTAT:": (("socket_id", as_int), ("err_code", as_int)),
+    "+QMTSUB:": (("socket_id", as_int), ("msgID", as_int), ("result", as_int), ("value", as_int)),
+    "+QMTUNS:": (("socket_id", as_int), ("msgID", as_int), ("result", as_int)),
+    "+QMTPUB:": (("socket_id", as_int), ("msgID", as_int), ("result", as_int), ("packet_retries", as_int)),
+    "+QMTRECV:": (("socket_id", as_int), ("msgID", as_int), ("topic", as_quoted), ("payload_len", as_int), ("payload", as_quoted)),
+}
+
+def line_prefix_for(key):
+    """
+    Returns the prefix a table key matches on the wire: "+QMTOPEN?" -> "+QMTOPEN:"
+    """
+    if key.endswith(":"):
+        return key
+
+    return key[:-1] + ":"
+
+RESPONSES = {key: (line_prefix_for(key), fields) for key, fields in RESPONSE_FIELDS.items()}
+
+def split_fields(text):
+    """
+    Splits a response's arguments on commas, keeping commas inside quotes
+    """
+    if '"' not in text:
+        return text.split(",")
+
+    fields = []
+    start = 0
+    quoted = False
+
+    for index, char in enumerate(text):
+        if char == '"':
+            quoted = not quoted
+        elif char == "," and not quoted:
+            fields.append(text[start:index])
+            start = index + 1
+
+    fields.append(text[start:])
+
+    return fields
+
+def parse_line(line, key):
+    """
+    Decodes one line against the table entry for key, returns a dict of its fields or None if the prefix doesn't match
+    """
+    prefix, fields = RESPONSES[key]
+
+    if not line.startswith(prefix):
+        return None
+
+    values = split_fields(line[len(prefix):])
+
+    return {name: decode(value) for (name, decode), value in zip(fields, values)}
+
+def parse_lines(lines, key):
+    """
+    Decodes every line in lines that carries the prefix for key
+    """
+    parsed = []
+
+    for line in lines:
+        parsed_line = parse_line(line, key)
+        if parsed_line is not None:
+            parsed.append(parsed_line)
+
+    return parsed
+
+def parse_first(lines, key):
+    """
+    Decodes the first line in lines that carries the prefix for key, or returns None
+    """
+    for line in lines:
+        parsed_line = parse_line(line, key)
+        if parsed_line is not None:
+            return parsed_line
+
+    return None
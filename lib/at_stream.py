@@ -0,0 +1,388 @@
+import time
+
+class Status:
+    OK = 0
+    ERROR = 1
+    TIMEOUT = 2
+    ONGOING = 3
+    UNKNOWN = 99
+
+def final_result_status(line):
+    """
+    Returns the status code for a final result line (OK, ERROR, +CME ERROR: , +CMS ERROR: ), or None if the line isn't one
+    """
+    if line == "OK":
+        return Status.OK
+    elif line == "ERROR" or line.startswith("+CME ERROR: ") or line.startswith("+CMS ERROR: "):
+        return Status.ERROR
+
+    return None
+
+def line_matches(pattern, line):
+    """
+    Matches a line against either a string prefix or a compiled regex
+    """
+    if isinstance(pattern, str):
+        return line.startswith(pattern)
+
+    return pattern.match(line) is not None
+
+def command_prefix(command):
+    """
+    Returns the information response prefix for an AT command, e.g. AT+CREG? -> +CREG:
+    """
+    if not command.startswith("AT+"):
+        return None
+
+    end = len(command)
+    for terminator in "=?":
+        index = command.find(terminator)
+        if 0 <= index < end:
+            end = index
+
+    return f"{command[2:end]}:"
+
+def line_prefix(line):
+    """
+    Returns the +PREFIX: of a result line, or None if it doesn't have one
+    """
+    if not line.startswith("+"):
+        return None
+
+    end = line.find(":")
+    if end < 0:
+        return None
+
+    return line[:end + 1]
+
+def timeout_response():
+    return {"status": "Timeout", "status_code": Status.TIMEOUT, "data": [], "response_line": ""}
+
+URC_PREFIXES = (
+    "+QMTSTAT:",
+    "+QMTOPEN:",
+    "+QMTCLOSE:",
+    "+QMTCONN:",
+    "+QMTDISC:",
+    "+QMTSUB:",
+    "+QMTUNS:",
+    "+QMTPUB:",
+    "+QMTRECV:",
+    "+CREG:",
+    "+CEREG:",
+    "+CGEV:",
+    "+QHTTPPOST:",
+    "+QHTTPGET:",
+    "+QHTTPREADFILE:",
+)
+
+class URCRouter:
+    """
+    Pulls unsolicited result codes out of the modem line stream into per-prefix queues, and
+    hands them to any callbacks registered for that prefix. Lines are only routed when they
+    aren't the information response of the command currently in flight (AT+CREG? answers
+    with +CREG: too).
+    """
+    def __init__(self, prefixes=URC_PREFIXES, max_queued=16):
+        self.queues = {}
+        self.callbacks = {}
+        self.max_queued = max_queued
+        self.dropped = 0
+
+        for prefix in prefixes:
+            self.register(prefix)
+
+    def register(self, prefix, callback=None):
+        """
+        Starts routing lines with this prefix, optionally calling callback(line) for each one
+        """
+        if prefix not in self.queues:
+            self.queues[prefix] = []
+
+        if callback is not None:
+            self.callbacks.setdefault(prefix, []).append(callback)
+
+    def route(self, line, solicited=None):
+        """
+        Queues the line if it's a URC, returns True if it was routed
+        """
+        #Bare URCs like RDY are routed by the whole line
+        prefix = line_prefix(line) or (line if line in self.queues else None)
+
+        if prefix is None or prefix == solicited:
+            return False
+
+        queue = self.queues.get(prefix)
+        if queue is None:
+            return False
+
+        if len(queue) >= self.max_queued:
+            queue.pop(0)
+            self.dropped += 1
+
+        queue.append(line)
+
+        for callback in self.callbacks.get(prefix, ()):
+            try:
+                callback(line)
+            except Exception:
+                pass
+
+        return True
+
+    def pop(self, prefix, args=None):
+        """
+        Removes and returns the oldest queued line for prefix whose arguments start with args, or None
+        """
+        queue = self.queues.get(prefix)
+        if not queue:
+            return None
+
+        if args is None:
+            return queue.pop(0)
+
+        start = len(prefix) + 1
+        for index, line in enumerate(queue):
+            if line[start:].startswith(args):
+                return queue.pop(index)
+
+        return None
+
+    def clear(self, prefix=None):
+        """
+        Drops queued lines for one prefix, or for all of them
+        """
+        for key, queue in self.queues.items():
+            if prefix is None or key == prefix:
+                queue.clear()
+
+class ATReader:
+    """
+    Incremental line assembler for the modem UART.
+
+    Bytes are moved off the UART as soon as they arrive and split into lines on CR/LF. A wait only
+    looks at lines completed since the last check, and returns as soon as the line it is waiting
+    for arrives instead of sleeping a fixed interval and rescanning everything it has read.
+    """
+    def __init__(self, uart_bus, router=None, idle=None, poll_interval=0.005):
+        self.uart_bus = uart_bus
+        self.router = router
+        self.idle = idle                    #called between empty polls, e.g. watchdog.feed
+        self.poll_interval = poll_interval
+
+        self.partial = b""
+        self.lines = []
+        self.solicited = None               #+PREFIX: of the command awaiting its final result
+
+    def clear(self):
+        """
+        Drops any buffered partial or completed lines
+        """
+        self.partial = b""
+        self.lines = []
+
+    def drain(self):
+        """
+        Reads everything waiting on the UART ahead of a new command. URCs are routed, stale response lines are dropped
+        """
+        try:
+            while self.uart_bus.in_waiting:
+                self.poll()
+        except Exception:
+            pass
+
+        self.lines = []
+
+    def expect(self, command):
+        """
+        Marks command as in flight, so its information response isn't mistaken for a URC
+        """
+        self.solicited = command_prefix(command)
+
+    def feed(self, chunk):
+        """
+        Adds raw bytes to the assembler, returns the number of lines completed by this chunk (routed URCs included)
+        """
+        data = self.partial + chunk if self.partial else chunk
+        completed = 0
+        start = 0
+
+        while True:
+            end = data.find(b"\n", start)
+            if end < 0:
+                break
+
+            line = data[start:end].strip(b"\r")
+            start = end + 1
+
+            if line:
+                try:
+                    line = line.decode("utf-8")
+                except Exception:
+                    continue
+
+                completed += 1
+
+                if self.router is not None and self.router.route(line, self.solicited):
+                    continue
+
+                self.lines.append(line)
+
+                #Anything after the final result is unsolicited again, e.g. a +QHTTPPOST: result arriving in the same read
+                if self.solicited is not None and final_result_status(line) is not None:
+                    self.solicited = None
+
+        self.partial = data[start:]
+
+        return completed
+
+    def poll(self):
+        """
+        Moves whatever is waiting on the UART into the assembler, returns the number of new lines
+        """
+        try:
+            waiting = self.uart_bus.in_waiting
+            if not waiting:
+                return 0
+
+            chunk = self.uart_bus.read(waiting)
+        except Exception:
+            return 0
+
+        if not chunk:
+            return 0
+
+        return self.feed(bytes(chunk))
+
+    def wait(self, deadline):
+        """
+        Yields between polls until the deadline (time.monotonic()) passes. Returns False once it has
+        """
+        if time.monotonic() >= deadline:
+            return False
+
+        if self.idle is not None:
+            self.idle()
+
+        time.sleep(self.poll_interval)
+
+        return True
+
+    def wait_until(self, take, timeout=5):
+        """
+        Polls the UART until take() returns something other than None and returns it, or returns None once timeout
+        passes. take is one of the take_* methods; an asyncio caller runs the same loop with its own sleep
+        """
+        deadline = time.monotonic() + timeout
+
+        while True:
+            result = take()
+            if result is not None:
+                return result
+
+            if not self.poll():
+                if not self.wait(deadline):
+                    return None
+
+    def take_response(self, data):
+        """
+        Moves completed lines into data up to a final result code, and returns the response it ends. None if it hasn't arrived yet
+        """
+        while self.lines:
+            line = self.lines.pop(0)
+            status_code = final_result_status(line)
+
+            if status_code is None:
+                data.append(line)
+            else:
+                self.solicited = None
+                return {"status": line, "status_code": status_code, "data": data, "response_line": line}
+
+        return None
+
+    def take_match(self, data, pattern, secondary_pattern=None):
+        """
+        Moves completed lines into data until one matches pattern (OK) or secondary_pattern (Unknown)
+        """
+        while self.lines:
+            line = self.lines.pop(0)
+
+            if line_matches(pattern, line):
+                return {"status": "OK", "status_code": Status.OK, "data": data, "response_line": line}
+            elif secondary_pattern is not None and line_matches(secondary_pattern, line):
+                return {"status": "Unknown", "status_code": Status.UNKNOWN, "data": data, "response_line": line}
+
+            data.append(line)
+
+        return None
+
+    def take_prompt(self, prompt=b">"):
+        """
+        Returns OK once an unterminated data prompt (the "> " after a length-prefixed command) has arrived, or ERROR if
+        the command was rejected instead
+        """
+        index = self.partial.find(prompt)
+        if index >= 0:
+            self.partial = self.partial[index + len(prompt):].lstrip(b" ")
+            return {"status": "OK", "status_code": Status.OK, "data": [], "response_line": ""}
+
+        while self.lines:
+            line = self.lines.pop(0)
+            #A URC landing right behind the prompt terminates it into a line of its own
+            if line.encode("utf-8").startswith(prompt):
+                return {"status": "OK", "status_code": Status.OK, "data": [], "response_line": ""}
+
+            if final_result_status(line) == Status.ERROR:
+                self.solicited = None
+                return {"status": line, "status_code": Status.ERROR, "data": [], "response_line": line}
+
+        return None
+
+    def take_urc(self, prefix, args=None, secondary_prefix=None):
+        """
+        Returns a routed URC with this prefix (OK) or secondary_prefix (Unknown), including one that arrived earlier
+        """
+        line = self.router.pop(prefix, args)
+        if line is not None:
+            return {"status": "OK", "status_code": Status.OK, "data": [], "response_line": line}
+
+        if secondary_prefix is not None:
+            line = self.router.pop(secondary_prefix, args)
+            if line is not None:
+                return {"status": "Unknown", "status_code": Status.UNKNOWN, "data": [], "response_line": line}
+
+        return None
+
+    def read_response(self, timeout=5):
+        """
+        Collects lines until a final result code and returns them in the same shape as BG95M3.get_response
+        """
+        data = []
+        response = self.wait_until(lambda: self.take_response(data), timeout)
+
+        if response is None:
+            self.solicited = None
+            return timeout_response()
+
+        return response
+
+    def wait_for(self, pattern, secondary_pattern=None, timeout=5):
+        """
+        Collects lines until one matches pattern (or secondary_pattern) and returns them in the same shape as BG95M3.wait_for_response
+        """
+        data = []
+
+        return self.wait_until(lambda: self.take_match(data, pattern, secondary_pattern), timeout) or timeout_response()
+
+    def wait_for_prompt(self, prompt=b">", timeout=5):
+        """
+        Waits for an unterminated data prompt (the "> " after a length-prefixed command). Returns ERROR if the
+        command is rejected instead
+        """
+        return self.wait_until(lambda: self.take_prompt(prompt), timeout) or timeout_response()
+
+    def wait_for_urc(self, prefix, args=None, secondary_prefix=None, timeout=5):
+        """
+        Waits for a routed URC, including one that arrived before the wait started. Returns the same shape as wait_for
+        """
+        return self.wait_until(lambda: self.take_urc(prefix, args, secondary_prefix), timeout) or timeout_response()
@@ -0,0 +1,97 @@
+"""
+Timed transcripts of the modem UART.
+
+TranscriptRecorder stands in for the busio.UART the BG95M3 is given. It logs every chunk written to or read
+from the modem, stamped with the time since recording started, so a session on real hardware can be
+played back on a host by host/replay_uart.py. One event per line:
+
+    <microseconds> <w|r> <hex bytes>
+
+The file is appended to across boots, and each boot's events follow a session header line, since their
+timestamps restart at 0:
+
+    # session <UTC seconds since the epoch at boot>
+
+Events are buffered in RAM and appended to the file once the modem's reply has been read in full (or
+ahead of a write, if flush_bytes or flush_interval is reached first), so recording adds an SD write per
+AT round trip rather than per UART chunk. close() writes out whatever is left.
+"""
+from binascii import hexlify
+import time
+
+WRITE = "w"
+READ = "r"
+SESSION = "# session"
+
+class TranscriptRecorder:
+    def __init__(self, uart_bus, path, flush_bytes=2048, flush_interval=2):
+        self.uart_bus = uart_bus
+        self.path = path
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+
+        self.started = time.monotonic_ns()
+        self.last_flush = time.monotonic()
+        self.pending = [f"{SESSION} {int(time.time())}\n"]
+        self.pending_bytes = 0
+
+    def record(self, direction, data):
+        event = f"{(time.monotonic_ns() - self.started) // 1000} {direction} {hexlify(data).decode()}\n"
+        self.pending.append(event)
+        self.pending_bytes += len(event)
+
+    def flush(self):
+        """
+        Appends buffered events to the transcript file
+        """
+        if self.pending:
+            try:
+                with open(self.path, "a") as transcript:
+                    for event in self.pending:
+                        transcript.write(event)
+            except OSError:
+                pass
+
+        self.pending = []
+        self.pending_bytes = 0
+        self.last_flush = time.monotonic()
+
+    def write(self, data):
+        #Flush ahead of a command rather than while a response is streaming in
+        if self.pending_bytes >= self.flush_bytes or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+        count = self.uart_bus.write(data)
+
+        if count:
+            self.record(WRITE, bytes(data)[:count])
+
+        return count
+
+    def read(self, nbytes=None):
+        data = self.uart_bus.read(nbytes) if nbytes is not None else self.uart_bus.read()
+
+        if data:
+            self.record(READ, bytes(data))
+
+            #End of a read burst, the driver has everything the modem has sent so far
+            if not self.uart_bus.in_waiting:
+                self.flush()
+
+        return data
+
+    def close(self):
+        """
+        Writes out the events still buffered
+        """
+        self.flush()
+
+    @property
+    def in_waiting(self):
+        return self.uart_bus.in_waiting
+
+    def reset_input_buffer(self):
+        self.uart_bus.reset_input_buffer()
+
+    def __getattr__(self, name):
+        return getattr(self.uart_bus, name)
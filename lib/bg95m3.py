@@ -2,22 +2,316 @@ from microcontroller import watchdog
 import board
 import digitalio
 import gc
+from json import dump, load
 import os
 import re
 import time
 
+from at_responses import parse_first, parse_line, parse_lines, split_fields
+from at_stream import ATReader, Status, URCRouter
+from reading import Reading
 from services.global_logger import logger
+from services.time_service import MIN_CLOCK_YEAR
 
 gc.enable()
 
-from random import randint
+POWERED_DOWN_PATTERN = re.compile(r"\+?POWERED\s+DOWN")
+ERROR_PATTERN = re.compile(r"(\+CM[ES] )?ERROR")
+
+#Largest message AT+QMTPUBEX accepts inline in the command, and after a length-prefixed > prompt
+MQTT_MAX_INLINE_PAYLOAD = 560
+MQTT_MAX_PAYLOAD = 4096
+
+#Seconds a passing readiness check is trusted before it's asked again
+LINK_STATE_TTL = 30
+
+#Longest command line the modem takes, concatenated queries are split to fit
+AT_MAX_COMMAND_LINE = 256
+
+#Modem bring-up states, see BG95M3.step_bring_up
+BRINGUP_POWER = 0
+BRINGUP_BOOT = 1
+BRINGUP_CLEANUP = 2
+BRINGUP_CONFIGURE = 3
+BRINGUP_DONE = 4
+
+MODEM_BOOT_TIMEOUT = 20      #seconds without an AT response before the modem is hard restarted
+MODEM_PROBE_INTERVAL = 1     #seconds between AT probes while it boots
+MODEM_PROBE_TIMEOUT = 0.3    #seconds a single probe waits for OK
+
+#Digests of the certs last uploaded to the modem, so unchanged ones aren't uploaded again
+CERT_MANIFEST_PATH = "/sd/cert_manifest.json"
+
+#Bytes read from flash and written to the UART per step of a streamed AT+QFUPL or AT+QHTTPPOST
+FILE_UPLOAD_CHUNK = 512
+
+#AT+QHTTPCFG="contenttype" values
+HTTP_CONTENT_TYPE_TEXT = 1
+HTTP_CONTENT_TYPE_OCTET_STREAM = 2
+
+#AT+QGPSCFG="priority" values: GNSS and LTE share the RF front end, whichever has priority gets it
+GNSS_PRIORITY_GNSS = 0
+GNSS_PRIORITY_WWAN = 1
+
+#Last fix and time to first fix, kept between boots
+GNSS_CACHE_PATH = "/sd/gnss_cache.json"
+GNSS_HOT_START_AGE = 4 * 3600      #seconds a fix's ephemeris stays usable for a hot start
+
+XTRA_URL = "http://xtrapath1.izatcloud.net/xtra2.bin"
+XTRA_FILE = "xtra2.bin"
+XTRA_REFRESH_MARGIN = 12 * 60      #minutes of XTRA validity left before a new file is downloaded
+
+#AT+QCFG="nwscanseq" RAT codes, scanned in the order they're listed
+RAT_GSM = "01"
+RAT_EMTC = "02"
+RAT_NBIOT = "03"
+
+#AT+QCFG="iotopmode" values
+IOT_OP_MODE_EMTC = 0
+IOT_OP_MODE_NBIOT = 1
+IOT_OP_MODE_BOTH = 2
+
+#The BG95-M3's factory scan sequence and band masks (GSM, eMTC, NB-IoT)
+DEFAULT_SCAN_SEQUENCE = RAT_EMTC + RAT_NBIOT + RAT_GSM
+DEFAULT_BANDS = (0xf, 0x100002000000000f0e189f, 0x10004200000000090e189f)
+
+#AT+QNWINFO access technology -> scan sequence RAT code
+QNWINFO_RATS = {"eMTC": RAT_EMTC, "NBIoT": RAT_NBIOT, "GSM": RAT_GSM, "GPRS": RAT_GSM, "EDGE": RAT_GSM}
+
+#Last network registered on, tried first on the next cold attach
+NETWORK_CACHE_PATH = "/sd/network_cache.json"
+CACHED_ATTACH_TIMEOUT = 60      #seconds without registration on the cached band before falling back to a full scan
+
+def file_checksum(path, buffer):
+    """
+    Returns (size, checksum) of a local file, read through buffer. The checksum is the one AT+QFUPL reports:
+    the XOR of the data as big-endian 16 bit words, an odd trailing byte padded with 0
+    """
+    size = 0
+    checksum = 0
+    high = None             #first byte of a word split across two reads
+    
+    with open(path, "rb") as file:
+        while True:
+            count = file.readinto(buffer)
+            if not count:
+                break
+            
+            size += count
+            index = 0
+            
+            if high is not None:
+                checksum ^= (high << 8) | buffer[0]
+                high = None
+                index = 1
+            
+            while index + 1 < count:
+                checksum ^= (buffer[index] << 8) | buffer[index + 1]
+                index += 2
+            
+            if index < count:
+                high = buffer[index]
+    
+    if high is not None:
+        checksum ^= high << 8
+    
+    return size, checksum
+
+#---PSM/eDRX TIMER ENCODING (3GPP TS 24.008 GPRS Timer 2/3, TS 24.008 eDRX value)---#
+#Timer unit bits -> seconds per step
+T3412_UNITS = (("110", 1152000), ("010", 36000), ("001", 3600), ("000", 600), ("101", 60), ("100", 30), ("011", 2))
+T3324_UNITS = (("010", 360), ("001", 60), ("000", 2))
+
+#LTE-M eDRX cycle lengths in seconds, indexed by their 4 bit value
+EDRX_CYCLES = (5.12, 10.24, 20.48, 40.96, 61.44, 81.92, 102.4, 122.88, 143.36, 163.84, 327.68, 655.36, 1310.72, 2621.44, 5242.88, 10485.76)
+
+def encode_timer(seconds, units):
+    """
+    Encodes seconds as an 8 bit timer string, picking the finest unit whose 5 bit value can still hold it
+    """
+    for bits, step in reversed(units):
+        value = (seconds + step - 1) // step
+        if value <= 31:
+            return f"{bits}{value:05b}"
+    
+    bits, step = units[0]
+    return f"{bits}{31:05b}"
+
+def decode_timer(timer, units):
+    """
+    Decodes an 8 bit timer string back into seconds, None if it's deactivated or unrecognised
+    """
+    if not timer or len(timer) != 8:
+        return None
+    
+    for bits, step in units:
+        if timer[:3] == bits:
+            return int(timer[3:], 2) * step
+    
+    return None
+
+def encode_edrx(seconds):
+    """
+    Returns the 4 bit eDRX value for the longest LTE-M cycle that is no longer than seconds
+    """
+    value = 0
+    for index, cycle in enumerate(EDRX_CYCLES):
+        if cycle <= seconds:
+            value = index
+    
+    return f"{value:04b}"
+
+def decode_edrx(value):
+    if not value or len(value) != 4:
+        return None
+    
+    return EDRX_CYCLES[int(value, 2)]
+
+def modem_time_to_epoch(text, is_local=True):
+    """
+    Converts a +QLTS or +CCLK time ("yy/MM/dd,hh:mm:ss+zz[,dst]", with a 2 or 4 digit year and the zone in
+    quarter hours) to UTC seconds since the epoch. Returns None for an empty time or the power-on default
+    """
+    try:
+        date, clock = text.split(",")[0:2]
+        year, month, day = (int(field) for field in date.split("/"))
+        
+        zone_index = max(clock.rfind("+"), clock.rfind("-"))
+        if zone_index < 0:
+            zone_index = len(clock)
+        
+        hour, minute, second = (int(field) for field in clock[:zone_index].split(":"))
+        zone = int(clock[zone_index:]) if zone_index < len(clock) else 0
+    except (ValueError, IndexError):
+        return None
+    
+    #2 digit years from 80 up are 19xx, the modem's clock powers on at 80/01/06
+    if year < 80:
+        year += 2000
+    elif year < 100:
+        year += 1900
+    
+    if year < MIN_CLOCK_YEAR:
+        return None
+    
+    seconds = time.mktime((year, month, day, hour, minute, second, 0, -1, -1))
+    
+    return seconds - zone * 15 * 60 if is_local else seconds
+
+class LinkStateCache:
+    """
+    Remembers passing readiness checks (responsive, registered, attached, PDP active) for ttl seconds.
+    Failing checks are never cached, so a link that is coming up is still noticed on the next poll.
+    +CREG, +CGEV and +QMTSTAT URCs and command timeouts throw the whole cache away.
+    """
+    def __init__(self, ttl=LINK_STATE_TTL):
+        self.ttl = ttl
+        self.expiries = {}          #check name -> time.monotonic() it stops being trusted
+        self.commands_saved = 0
+        self.invalidations = 0
+    
+    def check(self, name, run_check):
+        if(self.trusted(name)):
+            return True
+        
+        return self.record(name, run_check())
+    
+    def trusted(self, name):
+        """
+        True if the check passed within the last ttl seconds, so it doesn't need running
+        """
+        expiry = self.expiries.get(name)
+        
+        if(expiry is not None and time.monotonic() < expiry):
+            self.commands_saved += 1
+            return True
+        
+        return False
+    
+    def record(self, name, passed):
+        if(passed):
+            self.expiries[name] = time.monotonic() + self.ttl
+        else:
+            self.expiries.pop(name, None)
+        
+        return passed
+    
+    def prime(self, names):
+        """
+        Marks checks as passing without running them, e.g. when a cheaper query already proved them
+        """
+        expiry = time.monotonic() + self.ttl
+        
+        for name in names:
+            self.expiries[name] = expiry
+    
+    def invalidate(self, line=None):
+        if(self.expiries):
+            self.invalidations += 1
+            
+            if(line is not None):
+                logger.info(f"Link state invalidated by: {line}")
+        
+        self.expiries = {}
+    
+    def reset_stats(self):
+        self.commands_saved = 0
+        self.invalidations = 0
+
+def fingerprint(text):
+    """
+    32 bit FNV-1a hash of a string, stable across boots unlike hash()
+    """
+    value = 0x811C9DC5
+    
+    for byte in text.encode("utf-8"):
+        value = ((value ^ byte) * 0x01000193) & 0xFFFFFFFF
+    
+    return value
+
+class DesiredConfig:
+    """
+    The settings one configuration command (AT+QSSLCFG, AT+QMTCFG) should leave on the modem, as
+    (selector, value) pairs: ('"sslversion",2', '4') is set with AT+QSSLCFG="sslversion",2,4 and read back
+    with AT+QSSLCFG="sslversion",2. BG95M3.apply_config compares against the modem and only sends what differs,
+    and skips the whole config when its fingerprint matches the one last applied. volatile settings go back to
+    their defaults when the modem powers up; the rest (AT+QCFG band and scan settings) are kept in NVM.
+    """
+    def __init__(self, name, command, params, volatile=True):
+        self.name = name
+        self.command = command
+        self.params = params
+        self.volatile = volatile
+        self.fingerprint = fingerprint(";".join(f"{command}={selector},{value}" for selector, value in params))
+    
+    @staticmethod
+    def key(text):
+        """
+        The parameter name a selector or query response starts with, e.g. '"sslversion",2' -> "sslversion"
+        """
+        return split_fields(text[text.find(":") + 1:] if text.startswith("+") else text)[0].strip().strip('"').lower()
+    
+    @staticmethod
+    def matches(response_line, value):
+        """
+        True if a query response ends with the same fields as value, ignoring case and spacing
+        """
+        expected = [field.strip().lower() for field in split_fields(value)]
+        current = [field.strip().lower() for field in split_fields(response_line[response_line.find(":") + 1:])]
+        
+        return current[-len(expected):] == expected
 
-class Status:
-    OK = 0
-    ERROR = 1
-    TIMEOUT = 2
-    ONGOING = 3
-    UNKNOWN = 99
+def radio_config(scan_sequence=DEFAULT_SCAN_SEQUENCE, iot_op_mode=IOT_OP_MODE_BOTH, bands=DEFAULT_BANDS):
+    """
+    The DesiredConfig for BG95M3.configure_radio
+    """
+    gsm_bands, emtc_bands, nbiot_bands = bands
+    
+    return DesiredConfig("radio", "AT+QCFG", (
+        ('"iotopmode"', f"{iot_op_mode}"),
+        ('"nwscanseq"', scan_sequence),
+        ('"band"', f"0x{gsm_bands:x},0x{emtc_bands:x},0x{nbiot_bands:x}")
+        ), volatile=False)
 
 class SSL_Context:
     def __init__(self, modem, ssl_context_id=2, sync_certs=False):
@@ -38,69 +332,129 @@ class SSL_Context:
         if(sync_certs):
             try:
                 logger.info("Syncing certs...")
-                self.upload_cacert()
-                self.upload_device_cert()
-                self.upload_device_private_key()
+                self.sync_certs()
             except Exception as e:
                 logger.info(f"Failed to automatically sync certs")
                 logger.info("Try running: 'from helper_scripts import sync_certs' from the REPL")
     
-    def upload_cacert(self, new_ca_cert_path=os.getenv('CA_CERT_PATH')):
-        #Delete old cacert.pem
-        self.modem.delete_file_from_modem('cacert.pem')
+    def cert_files(self):
+        """
+        Returns (modem file name, local path) for every cert this context uses
+        """
+        return (
+            (self.cacert, os.getenv('CA_CERT_PATH')),
+            (self.clientcert, os.getenv('DEVICE_CERT_PATH')),
+            (self.clientkey, os.getenv('DEVICE_PRIVATE_KEY_PATH'))
+            )
+    
+    def load_manifest(self):
+        try:
+            with open(CERT_MANIFEST_PATH, "r") as manifest_file:
+                return load(manifest_file)
+        except Exception:
+            return {}
+    
+    def save_manifest(self, manifest):
+        try:
+            with open(CERT_MANIFEST_PATH, "w") as manifest_file:
+                dump(manifest, manifest_file)
+        except Exception as e:
+            logger.warning(f"Couldn't save cert manifest, certs will be uploaded again next sync: {e}")
+    
+    def sync_certs(self, force=False):
+        """
+        Uploads only the certs whose size or checksum differ from what was last uploaded to the modem. The modem's
+        file sizes come from a single AT+QFLST, the local checksums are streamed from flash. Returns the number uploaded
+        """
+        modem_sizes = {entry['file_name']: entry['file_size'] for entry in (self.modem.get_file_list() or [])}
+        manifest = self.load_manifest()
+        buffer = bytearray(FILE_UPLOAD_CHUNK)
+        uploaded = 0
         
-        #Upload new cacert.pem
-        with open(new_ca_cert_path, "r") as new_ca_cert_file:
-            new_ca_cert = new_ca_cert_file.read()
+        for file_name, path in self.cert_files():
+            if path is None:
+                logger.warning(f"No local path configured for {file_name}")
+                continue
             
-            try:
-                self.modem.upload_file_to_modem('cacert.pem', new_ca_cert)
-            except Exception as e:
-                logger.info(f"Error uploading new CA Cert to modem: {e}")
+            size, checksum = file_checksum(path, buffer)
+            recorded = manifest.get(file_name)
+            
+            if(not force and modem_sizes.get(file_name) == size and recorded == [size, checksum]):
+                logger.info(f"{file_name} is up to date ({size} bytes, checksum {checksum:04x})")
+                continue
+            
+            if(self.upload_cert(file_name, path, size, checksum, buffer)):
+                manifest[file_name] = [size, checksum]
+                uploaded += 1
+            else:
+                manifest.pop(file_name, None)
+        
+        if(uploaded):
+            self.save_manifest(manifest)
+        
+        return uploaded
     
-    def upload_device_cert(self, new_device_cert_path=os.getenv('DEVICE_CERT_PATH')):
-        #Delete old device_cert.pem
-        self.modem.delete_file_from_modem('device_cert.pem')
+    def upload_cert(self, file_name, path, size=None, checksum=None, buffer=None):
+        """
+        Replaces a cert on the modem with a local file, streamed in FILE_UPLOAD_CHUNK sized pieces, and checks the
+        size and checksum the modem reports back
+        """
+        buffer = buffer if buffer is not None else bytearray(FILE_UPLOAD_CHUNK)
         
-        #Upload new device_cert.pem
-        with open(new_device_cert_path, "r") as new_device_cert_file:
-            new_device_cert = new_device_cert_file.read()
-            
-            try:
-                self.modem.upload_file_to_modem('device_cert.pem', new_device_cert)
-            except Exception as e:
-                logger.info(f"Error uploading new Device Cert to modem: {e}")
+        if(size is None or checksum is None):
+            size, checksum = file_checksum(path, buffer)
+        
+        logger.info(f"Uploading {path} to {file_name} ({size} bytes)")
+        
+        self.modem.delete_file_from_modem(file_name)
+        
+        try:
+            confirmation = self.modem.upload_file_stream(file_name, path, size, buffer)
+        except Exception as e:
+            logger.info(f"Error uploading {file_name} to modem: {e}")
+            return False
+        
+        if(confirmation is None):
+            logger.warning(f"Upload of {file_name} failed")
+            return False
+        
+        if(confirmation.get('upload_size') != size or int(confirmation.get('checksum') or "-1", 16) != checksum):
+            logger.warning(f"Upload of {file_name} doesn't match the local file: {confirmation}, expected {size},{checksum:04x}")
+            return False
+        
+        return True
+    
+    def upload_cacert(self, new_ca_cert_path=os.getenv('CA_CERT_PATH')):
+        return self.upload_cert(self.cacert, new_ca_cert_path)
+    
+    def upload_device_cert(self, new_device_cert_path=os.getenv('DEVICE_CERT_PATH')):
+        return self.upload_cert(self.clientcert, new_device_cert_path)
     
     def upload_device_private_key(self, new_device_private_key_path=os.getenv('DEVICE_PRIVATE_KEY_PATH')):
-        #Delete old device_private_key.pem
-        self.modem.delete_file_from_modem('device_private_key.pem')
-        
-        #Upload new private_key.pem
-        with open(new_device_private_key_path, "r") as new_device_private_key_file:
-            new_device_private_key = new_device_private_key_file.read()
-            
-            try:
-                self.modem.upload_file_to_modem('device_private_key.pem', new_device_private_key)
-            except Exception as e:
-                logger.info(f"Error uploading new Device private_key to modem: {e}")
+        return self.upload_cert(self.clientkey, new_device_private_key_path)
             
+    def desired_config(self):
+        """
+        Returns this context's settings as a DesiredConfig for BG95M3.apply_config
+        """
+        return DesiredConfig(f"ssl{self.ssl_context_id}", "AT+QSSLCFG", (
+            (f'"sslversion",{self.ssl_context_id}', f"{self.sslversion}"),
+            (f'"ciphersuite",{self.ssl_context_id}', f"{self.ciphersuite}"),
+            (f'"cacert",{self.ssl_context_id}', f'"{self.cacert}"'),
+            (f'"clientcert",{self.ssl_context_id}', f'"{self.clientcert}"'),
+            (f'"clientkey",{self.ssl_context_id}', f'"{self.clientkey}"'),
+            (f'"seclevel",{self.ssl_context_id}', f"{self.seclevel}"),
+            (f'"session",{self.ssl_context_id}', f"{self.session}"),
+            (f'"sni",{self.ssl_context_id}', f"{self.sni}"),
+            (f'"checkhost",{self.ssl_context_id}', f"{self.checkhost}"),
+            (f'"ignorelocaltime",{self.ssl_context_id}', f"{self.ignorelocaltime}"),
+            (f'"renegotiation",{self.ssl_context_id}', f"{self.renegotiation}")
+            ))
+    
     def set_context(self):
         logger.info("Setting SSL Context")
-    
-        self.set_parameter("sslversion", self.sslversion)
-        self.set_parameter("ciphersuite", self.ciphersuite)
         
-        #TODO get self.set_parameter working for values that need to be enapsulated in quotes
-        self.modem.send_comm_get_response('AT+QSSLCFG="cacert",2,"cacert.pem"')
-        self.modem.send_comm_get_response('AT+QSSLCFG="clientcert",2,"device_cert.pem"')
-        self.modem.send_comm_get_response('AT+QSSLCFG="clientkey",2,"device_private_key.pem"')
-        
-        self.set_parameter("seclevel", self.seclevel)
-        self.set_parameter("session", self.session)
-        self.set_parameter("sni", self.sni)
-        self.set_parameter("checkhost", self.checkhost)
-        self.set_parameter("ignorelocaltime", self.ignorelocaltime)
-        self.set_parameter("renegotiation", self.renegotiation)
+        return self.modem.apply_config(self.desired_config())
 
     def set_parameter(self, key, value):
         response = self.modem.send_comm_get_response(f'AT+QSSLCFG="{key}", {self.ssl_context_id}, {value}')
@@ -119,21 +473,31 @@ class SSL_Context:
             logger.warning(f"Something else weird happened: {response}")
             
 class MQTT_Socket:
-    def __init__(self, modem, client_id, hostname, port, socket_id):
+    def __init__(self, modem, client_id, hostname, port, socket_id, configure=True):
         self.modem = modem
         
         self.client_id = client_id
         self.hostname = hostname
         self.port = port
         self.socket_id = socket_id  #client_idx in modem docs
+        
+        self.last_msg_id = 0
+        self.in_flight = {}         #msgID -> publish awaiting its +QMTPUB
+        
+        #With configure=False the caller applies desired_configs() itself, e.g. AsyncModem
+        if(configure):
+            for config in self.desired_configs():
+                self.modem.apply_config(config)
     
-        #Set default SSL context to use SSL/TLS and certificates
+    def desired_configs(self):
+        """
+        The default SSL context (SSL/TLS with the device certificates) and this socket set to use it
+        """
         default_ssl_context = SSL_Context(self.modem, ssl_context_id=2)
-        default_ssl_context.set_context()
         
-        #Use SSL context 2
-        logger.info("Setting SSL Context")
-        self.modem.send_comm_get_response(f'AT+QMTCFG="ssl",{self.socket_id},1,2')
+        return (default_ssl_context.desired_config(), DesiredConfig(f"mqtt{self.socket_id}", "AT+QMTCFG", (
+            (f'"ssl",{self.socket_id}', f"1,{default_ssl_context.ssl_context_id}"),
+            )))
         
     #open socket, connect, do your thing, disconnect, close
     def open(self):
@@ -143,20 +507,27 @@ class MQTT_Socket:
                 logger.warning(f"Failed to open the socket: modem isn't comms ready")
             
             logger.info(f'Open Command: AT+QMTOPEN={self.socket_id},"{self.hostname}",{self.port}')
-            response = self.modem.send_comm_get_response(f'AT+QMTOPEN={self.socket_id},"{self.hostname}",{self.port}', timeout=60)
+            response = self.modem.send_comm_get_response(f'AT+QMTOPEN={self.socket_id},"{self.hostname}",{self.port}', timeout=60, discard_urcs=("+QMTOPEN:",))
 
             #Check that the open connection command was RECEIVED AND PARSED successfully
             if(response['status_code'] == Status.OK):
                 logger.info("Waiting for socket to open...")
-                pattern = re.compile(r"^\+QMTOPEN: (.*)$")
 
                 #Wait for a +QMTOPEN: message
-                open_result_response = self.modem.wait_for_response(pattern, timeout=60)
+                open_result_response = self.modem.wait_for_urc("+QMTOPEN:", args=f"{self.socket_id},", timeout=60)
                 logger.info(f"Open Result Response: {open_result_response}")           
-                logger.info("Successfully opened socket")
+                
+                if(open_result_response['status_code'] == Status.OK):
+                    if(parse_line(open_result_response['response_line'], "+QMTOPEN:")['result'] == 0):
+                        self.modem.mqtt_handshakes += 1
+                        logger.info("Successfully opened socket")
+                        return
                 
             else:
                 logger.warning(f"Potentially failed to open socket: {response}")
+            
+            #The SSL or MQTT config may not be what we last applied (e.g. the modem reset itself), so check it next time
+            self.modem.forget_config()
                                
         except Exception as e:
             logger.warning(f"Failed to open the socket: {e}")
@@ -176,25 +547,23 @@ class MQTT_Socket:
                 return True
                 
             #Try to open the connection
-            response = self.modem.send_comm_get_response(f'AT+QMTCLOSE={self.socket_id}')
+            response = self.modem.send_comm_get_response(f'AT+QMTCLOSE={self.socket_id}', discard_urcs=("+QMTCLOSE:",))
 
             #Check that the open connection command was RECEIVED AND PARSED successfully
             if(response['status_code'] == Status.OK):
                 logger.info("Waiting for connection to close...")
-                pattern = re.compile(r"^\+QMTCLOSE: (.*)$")
 
                 #Wait for a +QMTOPEN: message to check result of attempting to open connection
-                close_result_response = self.modem.wait_for_response(pattern, timeout=30)
+                close_result_response = self.modem.wait_for_urc("+QMTCLOSE:", args=f"{self.socket_id},", timeout=30)
 
                 if(close_result_response['status_code'] == Status.OK):
-                    parsed_responses = self.modem.parse_response_data([close_result_response['response_line']], pattern)
-                    parsed_response = parsed_responses[0]
+                    parsed_response = parse_line(close_result_response['response_line'], "+QMTCLOSE:")
                     
-                    if(int(parsed_response[1]) == 0):
-                        logger.info(f"Successfully closed socket: {parsed_response[0]}: {parsed_response[1]}")
+                    if(parsed_response['result'] == 0):
+                        logger.info(f"Successfully closed socket: {parsed_response['socket_id']}: {parsed_response['result']}")
                         return True
                     else:
-                        logger.warning(f"Failed to close socket: {parsed_response[0]}: {parsed_response[1]}")
+                        logger.warning(f"Failed to close socket: {parsed_response['socket_id']}: {parsed_response['result']}")
                         return False
                 else:
                     logger.warning(f"Failed to close socket, something weird...")
@@ -215,28 +584,25 @@ class MQTT_Socket:
                 logger.info(f"Connecting to MQTT Broker. Retries remaining: {retries}")
                 #Try to connect to broker
                 logger.info(f'Connecting with command: AT+QMTCONN={self.socket_id},"{self.client_id}"')
-                response = self.modem.send_comm_get_response(f'AT+QMTCONN={self.socket_id},"{self.client_id}"', timeout=30)
+                response = self.modem.send_comm_get_response(f'AT+QMTCONN={self.socket_id},"{self.client_id}"', timeout=30, discard_urcs=("+QMTCONN:", "+QMTSTAT:"))
                 
                 #Check that the connect command was RECEIVED AND PARSED successfully
                 if(response['status_code'] == Status.OK):
                     logger.info("Waiting to establish connection to broker...")
-                    pattern = re.compile(r"^\+QMTCONN: (.*)$")
-                    qmtstat_pattern = re.compile(r"^\+QMTSTAT: (.*)$")
                     
                     #Wait for a +QMTCONN: message to check result of attempting to connect to broker
-                    connect_result_response = self.modem.wait_for_response(pattern, secondary_pattern = qmtstat_pattern, timeout=120)
+                    connect_result_response = self.modem.wait_for_urc("+QMTCONN:", args=f"{self.socket_id},", secondary_prefix="+QMTSTAT:", timeout=120)
                     
                     logger.info(f"Connect Result Response: {connect_result_response}")
 
                     if(connect_result_response['status_code'] == Status.OK):
                         logger.info(f"Status OK")
                         logger.info(f"Data: {response['data']}")
-                        parsed_responses = self.modem.parse_response_data([connect_result_response['response_line']], pattern)
-                        logger.info(f"Parsed Response: {parsed_responses}")
-                        parsed_response = parsed_responses[0]
+                        parsed_response = parse_line(connect_result_response['response_line'], "+QMTCONN:")
+                        logger.info(f"Parsed Response: {parsed_response}")
                         logger.info("Connected!")
 
-                        return {'socket_id': parsed_response[0], 'result': parsed_response[1]}
+                        return parsed_response
                     else:
                         logger.warning(f"Unknown connection result: {connect_result_response}")
                         
@@ -254,29 +620,24 @@ class MQTT_Socket:
     def disconnect(self):
         try:
             #Try to connect to broker
-            response = self.modem.send_comm_get_response(f'AT+QMTDISC={self.socket_id}')
+            response = self.modem.send_comm_get_response(f'AT+QMTDISC={self.socket_id}', discard_urcs=("+QMTDISC:", "+QMTSTAT:"))
 
             #Check that the connect command was RECEIVED AND PARSED successfully
             if(response['status_code'] == Status.OK):
                 logger.info("Waiting to confirm disconnection with broker...")
-                pattern = re.compile(r"^\+QMTDISC: (.*)$")
 
                 #Wait for a +QMTCONN: message to check result of attempting to connect to broker
-                connect_result_response = self.modem.wait_for_response(pattern, timeout=10)
+                connect_result_response = self.modem.wait_for_urc("+QMTDISC:", args=f"{self.socket_id},", timeout=10)
 
                 if(connect_result_response['status_code'] == Status.OK):
                     logger.info("Successfully sent disconnect command")
-                    # parsed_responses = self.modem.parse_response_data(response['data'], pattern)
-                    # parsed_response = parsed_responses[0]
-                    
-                    disconnected_pattern = re.compile(r"^\+QMTSTAT: (.*)$")
                     logger.info("Waiting for QMSTAT: +0,5")
-                    disconnected_response = self.modem.wait_for_response(disconnected_pattern, timeout=30)
+                    disconnected_response = self.modem.wait_for_urc("+QMTSTAT:", args=f"{self.socket_id},", timeout=30)
                     logger.info(f"disconnect_response: {disconnected_response}")
-                    parsed_disconnected_response = self.modem.parse_response_data([disconnected_response['response_line']], disconnected_pattern)[0]
+                    parsed_disconnected_response = parse_line(disconnected_response['response_line'], "+QMTSTAT:")
                     logger.info(f"parsed_disconnected_response: {parsed_disconnected_response}")
                     
-                    if(int(parsed_disconnected_response[1]) == 5):
+                    if(parsed_disconnected_response['err_code'] == 5):
                         logger.info(f"Disconnected \t {disconnected_response}")
                     else:
                         logger.info(f"Have to force close...")
@@ -293,29 +654,27 @@ class MQTT_Socket:
             if(not self.is_connected()):
                 raise RuntimeError("MQTT isn't connected")
             
-            msg_id = randint(0,65535)
+            msg_id = self.allocate_msg_id()
             
             response = self.modem.send_comm_get_response(f'AT+QMTSUB={self.socket_id},{msg_id},"{topic}",{qos}')
 
             #Check that the subscribe command was RECEIVED AND PARSED successfully
             if(response['status_code'] == Status.OK):
                 logger.info("Waiting to confirm subscription with broker...")
-                pattern = re.compile(r"^\+QMTSUB: (.*)$")
 
                 #Wait for a +QMTCONN: message to check result of attempting to connect to broker
-                subscribe_result_response = self.modem.wait_for_response(pattern, timeout=10)
+                subscribe_result_response = self.modem.wait_for_urc("+QMTSUB:", args=f"{self.socket_id},{msg_id},", timeout=10)
 
                 if(subscribe_result_response['status_code'] == Status.OK):
-                    parsed_responses = self.modem.parse_response_data(response['data'], pattern)
-                    logger.info(parsed_responses)
-                    parsed_response = parsed_responses[0]
-
-                    if(parsed_response[2] == 0):
-                        return {'socket_id': parsed_response[0], 'msgID': parsed_response[1], 'result': parsed_response[2], 'granted_qos_level': parsed_response[3]}
-                    if(parsed_response[2] == 1):
-                        return {'socket_id': parsed_response[0], 'msgID': parsed_response[1], 'result': parsed_response[2], 'packet_retries': parsed_response[3]}
-                    if(parsed_response[2] == 2):
-                        return {'socket_id': parsed_response[0], 'msgID': parsed_response[1], 'result': parsed_response[2]}
+                    parsed_response = parse_line(subscribe_result_response['response_line'], "+QMTSUB:")
+                    logger.info(parsed_response)
+
+                    if(parsed_response['result'] == 0):
+                        return {'socket_id': parsed_response['socket_id'], 'msgID': parsed_response['msgID'], 'result': parsed_response['result'], 'granted_qos_level': parsed_response.get('value')}
+                    if(parsed_response['result'] == 1):
+                        return {'socket_id': parsed_response['socket_id'], 'msgID': parsed_response['msgID'], 'result': parsed_response['result'], 'packet_retries': parsed_response.get('value')}
+                    if(parsed_response['result'] == 2):
+                        return {'socket_id': parsed_response['socket_id'], 'msgID': parsed_response['msgID'], 'result': parsed_response['result']}
                 else:
                     #Failed to set
                     pass
@@ -327,24 +686,22 @@ class MQTT_Socket:
             if(not self.is_connected()):
                 raise RuntimeError("MQTT isn't connected")
             
-            msg_id = randint(0,65535)
+            msg_id = self.allocate_msg_id()
             
             response = self.modem.send_comm_get_response(f'AT+QMTUNS={self.socket_id},{msg_id},"{topic}"')
 
             #Check that the subscribe command was RECEIVED AND PARSED successfully
             if(response['status_code'] == Status.OK):
                 logger.info("Waiting to confirm unsubscription with broker...")
-                pattern = re.compile(r"^\+QMTUNS: (.*)$")
 
                 #Wait for a +QMTCONN: message to check result of attempting to connect to broker
-                unsubscribe_result_response = self.modem.wait_for_response(pattern, timeout=10)
+                unsubscribe_result_response = self.modem.wait_for_urc("+QMTUNS:", args=f"{self.socket_id},{msg_id},", timeout=10)
 
                 if(unsubscribe_result_response['status_code'] == Status.OK):
-                    parsed_responses = self.modem.parse_response_data(response['data'], pattern)
-                    parsed_response = parsed_responses[0]
+                    parsed_response = parse_line(unsubscribe_result_response['response_line'], "+QMTUNS:")
                     
-                    if(parsed_response[2] == 0):
-                        return {'socket_id': parsed_response[0], 'msgID': parsed_response[1], 'result': parsed_response[2]}
+                    if(parsed_response['result'] == 0):
+                        return parsed_response
                     
         except Exception as e:
             logger.warning(f"Failed to unsubscribe from topic {topic}: {e}")
@@ -354,28 +711,21 @@ class MQTT_Socket:
             if(not self.is_connected()):
                 raise RuntimeError("MQTT isn't connected")
             
-            msg_id = randint(0,65535)
+            msg_id = self.allocate_msg_id() if qos > 0 else 0
             logger.info(f"Publishing message: {msg} to topic: {topic} with a QoS of {qos}")
-            response = self.modem.send_comm_get_response(f'AT+QMTPUBEX={self.socket_id},{msg_id},{qos},{retain},"{topic}","{msg}"')
+            response = self.send_publish(msg_id, topic, msg, qos, retain)
 
             #Check that the subscribe command was RECEIVED AND PARSED successfully
             if(response['status_code'] == Status.OK):
                 logger.info(f"Successfully sent publish command")
                 
                 logger.info("Waiting to confirm publish with broker...")
-                pattern = re.compile(r"^\+QMTPUB: (.*)$")
 
                 #Wait for a +QMTCONN: message to check result of attempting to connect to broker
-                publish_result_response = self.modem.wait_for_response(pattern, timeout=10)
+                publish_result_response = self.modem.wait_for_urc("+QMTPUB:", args=f"{self.socket_id},{msg_id},", timeout=10)
 
                 if(publish_result_response['status_code'] == Status.OK):
-                    parsed_responses = self.modem.parse_response_data([publish_result_response['response_line']], pattern)
-                    parsed_response = parsed_responses[0]
-
-                    if(parsed_response[2] == 1):
-                        return {'socket_id': parsed_response[0], 'msgID': parsed_response[1], 'result': parsed_response[2], 'packet_retries': parsed_response[3]}
-                    else:
-                        return {'socket_id': parsed_response[0], 'msgID': parsed_response[1], 'result': parsed_response[2]}
+                    return parse_line(publish_result_response['response_line'], "+QMTPUB:")
                 else:
                     #Failed to set
                     pass
@@ -385,6 +735,124 @@ class MQTT_Socket:
         except Exception as e:
             logger.warning(f"Failed to publish to topic: {e}")
 
+    def send_publish(self, msg_id, topic, msg, qos, retain):
+        """
+        Hands one message to the modem and returns the command's response.
+        Short text without double quotes goes inline in AT+QMTPUBEX. Anything else (bytes, memoryviews,
+        JSON, or text over the inline limit) uses the length-prefixed form: wait for the > prompt, then
+        write the raw bytes with no quoting or escaping
+        """
+        if(isinstance(msg, str) and '"' not in msg and len(msg) <= MQTT_MAX_INLINE_PAYLOAD):
+            return self.modem.send_comm_get_response(f'AT+QMTPUBEX={self.socket_id},{msg_id},{qos},{retain},"{topic}","{msg}"')
+        
+        if(isinstance(msg, str)):
+            msg = msg.encode('utf-8')
+        
+        if(len(msg) > MQTT_MAX_PAYLOAD):
+            logger.warning(f"Payload of {len(msg)} bytes is over the {MQTT_MAX_PAYLOAD} byte limit")
+            return {"status": "ERROR", "status_code": Status.ERROR, "data": [], "response_line": ""}
+        
+        self.modem.send_comm(f'AT+QMTPUBEX={self.socket_id},{msg_id},{qos},{retain},"{topic}",{len(msg)}')
+        prompt = self.modem.wait_for_prompt()
+        
+        if(prompt['status_code'] != Status.OK):
+            logger.warning(f"Modem didn't prompt for publish data: {prompt}")
+            return prompt
+        
+        self.modem.send_data(msg)
+        
+        return self.modem.get_response()
+    
+    def allocate_msg_id(self):
+        """
+        Returns the next msgID (1-65535) that isn't awaiting an ack. msgID 0 is reserved for QoS 0
+        """
+        msg_id = self.last_msg_id
+        
+        while True:
+            msg_id = msg_id % 65535 + 1
+            if msg_id not in self.in_flight:
+                self.last_msg_id = msg_id
+                return msg_id
+    
+    def publish_many(self, messages, qos=1, retain=0, window=4, timeout=10):
+        """
+        Publishes (topic, msg) pairs with up to window messages awaiting their +QMTPUB ack at once.
+        Acks are matched to messages by msgID in whatever order they arrive, and sending only blocks
+        while the window is full. Returns one result per message, in order:
+            {'topic', 'msgID', 'result', 'packet_retries'}
+        where result is 0 (acked), 1 (still retransmitting when it timed out), 2 (failed to send) or None (not sent or no ack)
+        """
+        results = []
+        self.in_flight = {}
+        
+        try:
+            if(not self.is_connected()):
+                raise RuntimeError("MQTT isn't connected")
+            
+            for topic, msg in messages:
+                while len(self.in_flight) >= window:
+                    self.collect_publish_ack()
+                
+                msg_id = self.allocate_msg_id() if qos > 0 else 0
+                result = {'topic': topic, 'msgID': msg_id, 'result': None, 'packet_retries': 0}
+                results.append(result)
+                
+                response = self.send_publish(msg_id, topic, msg, qos, retain)
+                
+                if(response['status_code'] == Status.OK):
+                    if(qos > 0):
+                        self.in_flight[msg_id] = (result, time.monotonic() + timeout)
+                    else:
+                        result['result'] = 0
+                else:
+                    logger.warning(f"Failed to send publish command for msgID {msg_id}: {response}")
+            
+            while self.in_flight:
+                self.collect_publish_ack()
+                
+        except Exception as e:
+            logger.warning(f"Failed to publish batch: {e}")
+        
+        self.in_flight = {}
+        
+        delivered = len([result for result in results if result['result'] == 0])
+        logger.info(f"Delivered {delivered}/{len(results)} messages")
+        
+        return results
+    
+    def collect_publish_ack(self):
+        """
+        Waits for the next +QMTPUB on this socket and settles the in-flight message it acks.
+        A message whose deadline passes first is given up on, freeing its slot in the window
+        """
+        oldest_id = min(self.in_flight, key=lambda msg_id: self.in_flight[msg_id][1])
+        deadline = self.in_flight[oldest_id][1]
+        
+        ack = self.modem.wait_for_urc("+QMTPUB:", args=f"{self.socket_id},", timeout=max(0, deadline - time.monotonic()))
+        
+        if(ack['status_code'] != Status.OK):
+            logger.warning(f"Timed out waiting for ack of msgID {oldest_id}")
+            del self.in_flight[oldest_id]
+            return
+        
+        parsed_ack = parse_line(ack['response_line'], "+QMTPUB:")
+        pending = self.in_flight.get(parsed_ack['msgID'])
+        
+        if(pending is None):
+            logger.info(f"Ignoring ack for unknown msgID: {ack['response_line']}")
+            return
+        
+        result = pending[0]
+        result['result'] = parsed_ack['result']
+        
+        if(parsed_ack.get('packet_retries') is not None):
+            result['packet_retries'] = parsed_ack['packet_retries']
+        
+        #1 means the modem is still retransmitting, the final ack follows
+        if(parsed_ack['result'] != 1):
+            del self.in_flight[parsed_ack['msgID']]
+
     def read(self):
         try:
             if(not self.is_connected()):
@@ -392,20 +860,12 @@ class MQTT_Socket:
             
             response = self.modem.send_comm_get_response(f'AT+QMTRECV={self.socket_id}')
 
-            #Check that the subscribe command was RECEIVED AND PARSED successfully
+            #Buffered messages come back as +QMTRECV: lines ahead of the OK
             if(response['status_code'] == Status.OK):
-                logger.info("Waiting for read...")
-                pattern = re.compile(r"^\+QMTRECV: (.*)$")
-
-                #Wait for a +QMTCONN: message to check result of attempting to connect to broker
-                recv_result_response = self.modem.wait_for_response(pattern, imeout=10)
+                messages = parse_lines(response['data'], "+QMTRECV:")
+                logger.info(messages)
 
-                if(recv_result_response['status_code'] == Status.OK):
-                    parsed_responses = self.modem.parse_response_data(response['data'], pattern)
-                    logger.info(parsed_responses)
-                    messages = [{'socket_id': parsed_response[0], 'msgID': parsed_response[1], 'topic': parsed_response[2], 'payload_len': parsed_response[3], 'payload': parsed_response[4]} for parsed_response in parsed_responses]
-
-                    return messages
+                return messages
         except Exception as e:
             logger.warning(f"Failed to read message from topic: {e}")
     
@@ -413,10 +873,7 @@ class MQTT_Socket:
         response = self.modem.send_comm_get_response(f'AT+QMTOPEN?')
         
         if(response['status_code'] == Status.OK):
-            pattern = re.compile(r"^\+QMTOPEN: (.*)$")
-            parsed_responses = self.modem.parse_response_data(response['data'], pattern)
-            
-            open_socket_ids = [int(parsed_response[0]) for parsed_response in parsed_responses]
+            open_socket_ids = [parsed_response['socket_id'] for parsed_response in parse_lines(response['data'], "+QMTOPEN?")]
             
             if(self.socket_id in open_socket_ids):
                 return True
@@ -433,12 +890,10 @@ class MQTT_Socket:
         response = self.modem.send_comm_get_response(f'AT+QMTCONN?')
         
         if(response['status_code'] == Status.OK):
-            pattern = re.compile(r"^\+QMTCONN: (.*)$")
-            parsed_responses = self.modem.parse_response_data(response['data'], pattern)
             socket_states = {}
             
-            for parsed_response in parsed_responses:
-                socket_states[int(parsed_response[0])] = int(parsed_response[1])
+            for parsed_response in parse_lines(response['data'], "+QMTCONN?"):
+                socket_states[parsed_response['socket_id']] = parsed_response['state']
             
             if(self.socket_id in socket_states.keys()):
                 return socket_states[self.socket_id]
@@ -455,131 +910,607 @@ class MQTT_Socket:
             return True
         else:
             return False
+    
+    def ensure_connected(self):
+        """
+        Checks a kept-alive session with a single AT+QMTCONN? and only reopens/reconnects if the socket actually dropped
+        """
+        state = self.get_mqtt_connection_state()
         
-class BG95M3:
-    """Class for handling AT communication with modem"""
-    def __init__(self, uart_bus):
-        self.uart_bus = uart_bus
-        self.power_button = digitalio.DigitalInOut(board.GP17)
-        self.power_button.direction = digitalio.Direction.OUTPUT
-        self.power_status = digitalio.DigitalInOut(board.GP20)
-        self.power_status.direction = digitalio.Direction.INPUT
-
-        self.power_on()
-
-        retries = 0
-        max_retries = 3
-
-        while not self.check_communication():
-            logger.info("Waiting for device to initialize")
-            retries += 1
-            if retries >= max_retries:
-                logger.info("Communication failed. Restarting modem.")
-                self.restart(graceful=False)
-                retries = 0
-            time.sleep(1)
-
-        logger.info("Finding inherited sockets")
-        inherited_sockets = self.get_open_mqtt_sockets()
+        if(state == 3):
+            logger.info("Reusing MQTT session")
+            return True
         
-        for i in inherited_sockets:
-            logger.info(f"Inherited socket: {i}")
-            try:
-                response = self.modem.send_comm_get_response(f'AT+QMTCLOSE={i['socket_id']}')
-                
-                pattern = re.compile(r"^\+QMTCLOSE: (.*)$")
-                
-                #Wait for a +QMTOPEN: message to check result of attempting to open connection
-                close_result_response = self.modem.wait_for_response(pattern, timeout=30)
-
-                if(close_result_response['status_code'] == Status.OK):
-                    parsed_responses = self.modem.parse_response_data([close_result_response['response_line']], pattern)
-                    parsed_response = parsed_responses[0]
-                    
-                    if(int(parsed_response[1]) == 0):
-                        logger.info(f"Successfully closed socket: {parsed_response[0]}: {parsed_response[1]}")
-                    else:
-                        logger.warning(f"Failed to close socket: {parsed_response[0]}: {parsed_response[1]}")
-                else:
-                    logger.warning(f"Failed to close socket{i['socket_id']}")
-                    logger.warning(f"{close_result_response}")
-                    
-            except Exception as e:
-                logger.info(f"Failed to close inherited sockets: {e}")
+        logger.info(f"MQTT session dropped (state {state}), reconnecting")
         
-        gc.collect()
-        # Clear any existing SSL contexts
-        logger.info("Clearing existing SSL contexts...")
-        for ctx_id in range(0, 6):
-            try:
-                self.send_comm_get_response(f'AT+QSSLCLOSE={ctx_id}', timeout=5)
-            except:
-                pass
+        if(not self.is_open()):
+            self.open()
         
-        gc.collect()
+        self.connect()
         
-        logger.info("Setting Echo Mode to OFF")
-        self.send_comm_get_response("ATE0") 
+        return self.is_connected()
+    
+class NetworkCache:
+    """
+    Remembers the operator, RAT and band the modem last registered on (from AT+QNWINFO) on the SD card, and
+    points the next cold attach straight at them: that RAT first in the scan sequence and only that band in
+    the band mask. If that doesn't register within timeout seconds, or registration is lost for that long
+    while the bands are narrowed, the configured scan sequence and bands are put back. Otherwise the narrowed
+    settings are left in NVM, so the next boot's apply_config reads them back unchanged and only writes them
+    when the cached network changes. Times how long each attach and each cycle took to register.
+    """
+    def __init__(self, modem, scan_sequence=DEFAULT_SCAN_SEQUENCE, iot_op_mode=IOT_OP_MODE_BOTH, bands=DEFAULT_BANDS,
+                 timeout=CACHED_ATTACH_TIMEOUT, cache_path=NETWORK_CACHE_PATH):
+        self.modem = modem
+        self.scan_sequence = scan_sequence
+        self.iot_op_mode = iot_op_mode
+        self.bands = bands
+        self.timeout = timeout
+        self.cache_path = cache_path
+        self.cache = self.load_cache()
         
-        gc.collect()
+        self.narrowed = False           #bands are limited to the cached one
+        self.attach_started = None      #time.monotonic() the current attach was configured
+        self.unregistered_since = None
+        self.cycle_started = None
+        self.time_to_registration = None
+        self.pending_reading = None
+    
+    def load_cache(self):
+        try:
+            with open(self.cache_path, "r") as cache_file:
+                return load(cache_file)
+        except Exception:
+            return {}
+    
+    def save_cache(self):
+        try:
+            with open(self.cache_path, "w") as cache_file:
+                dump(self.cache, cache_file)
+        except OSError as e:
+            logger.warning(f"Failed to save network cache: {e}")
+    
+    def cached_config(self):
+        """
+        Returns (scan sequence, bands) aimed at the cached network, or None if there isn't a usable one
+        """
+        rat = QNWINFO_RATS.get(self.cache.get('act'))
+        band = self.cache.get('band', "")
         
-        logger.info(f"Device ICCID: {self.get_iccid()}")
-        logger.info("Device is ready")
-        gc.collect()
+        if(rat is None or rat == RAT_GSM or not band.startswith("LTE BAND ")):
+            return None
         
-    #---SUPER HIGH LEVEL CHECKERS---#
-    def is_responsive(self):
-        return self.check_communication()
-    
-    def is_registered_to_network(self):
-        network_registration_status = self.get_network_registration_status()
+        try:
+            band_mask = 1 << (int(band[len("LTE BAND "):]) - 1)
+        except ValueError:
+            return None
         
-        stat = network_registration_status.get('stat')
+        gsm_bands, emtc_bands, nbiot_bands = self.bands
         
-        if stat in [1, 5]:
-            return True
+        if(rat == RAT_EMTC):
+            bands = (gsm_bands, band_mask, nbiot_bands)
         else:
-            return False
-        
-    def is_pds_connected(self):
-        packet_service_status = self.get_packet_service_status()
+            bands = (gsm_bands, emtc_bands, band_mask)
         
-        connected = packet_service_status.get('state')
+        others = [self.scan_sequence[index:index + 2] for index in range(0, len(self.scan_sequence), 2)]
+        scan_sequence = rat + "".join(code for code in others if code != rat)
         
-        if connected:
-            return True
-        else:
-            return False
+        return scan_sequence, bands
     
-    def is_pdp_connected(self):
-        pdp_status = self.get_pdp_status()
-        connected = pdp_status[0].get('state')
-        if connected:
-            return True
-        else:
-            return False
+    def attach_config(self, use_cache=True):
+        """
+        Starts timing an attach and returns the radio config for it, aimed at the cached network if there is one
+        """
+        cached = self.cached_config() if use_cache else None
         
-    def is_comms_ready(self):
-        if self.is_responsive() and self.is_registered_to_network() and self.is_pds_connected() and self.is_pdp_connected():
-            return True
+        if(cached is not None):
+            logger.info(f"Trying cached network first: {self.cache['oper']} {self.cache['act']} {self.cache['band']}")
+            scan_sequence, bands = cached
         else:
-            return False
+            scan_sequence, bands = self.scan_sequence, self.bands
         
-    #---HARDWARE---#
-    def power_status_check(self):
+        self.narrowed = cached is not None
+        self.attach_started = time.monotonic()
+        self.unregistered_since = None
+        
+        return radio_config(scan_sequence, self.iot_op_mode, bands)
+    
+    def configure(self, use_cache=True):
         """
-        Checks the current state of the modem (on/off).
+        Starts an attach, on the cached network if there is one
         """
-        return not self.power_status.value
-
-    def toggle_power(self):
+        return self.modem.apply_config(self.attach_config(use_cache))
+    
+    def begin_cycle(self):
+        self.cycle_started = time.monotonic()
+    
+    def on_registered(self):
         """
-        Toggles the modem's power button
-        Returns: nothing
+        Records a registration. Returns True if it finished an attach, so the network should be remembered
         """
-        self.power_button.value = True
-        time.sleep(1)
-        self.power_button.value = False
+        self.unregistered_since = None
+        attached = self.attach_started is not None
+        
+        if(attached):
+            self.time_to_registration = time.monotonic() - self.attach_started
+            self.attach_started = None
+        
+        if(self.cycle_started is not None):
+            self.pending_reading = Reading(time.monotonic() - self.cycle_started, "s", "Time To Registration")
+            self.cycle_started = None
+        
+        return attached
+    
+    def fallback_config(self):
+        """
+        Records a check that found the modem unregistered. Returns the full scan radio config if the cached network
+        has had timeout seconds to register and hasn't, otherwise None
+        """
+        if(self.unregistered_since is None):
+            self.unregistered_since = time.monotonic()
+        
+        if(not self.narrowed or time.monotonic() - self.unregistered_since <= self.timeout):
+            return None
+        
+        logger.warning(f"Not registered on the cached network after {self.timeout} s, scanning all bands")
+        
+        #Keep timing from the start of the attach, not the fallback
+        attach_started = self.attach_started
+        config = self.attach_config(use_cache=False)
+        
+        if(attach_started is not None):
+            self.attach_started = attach_started
+        
+        return config
+    
+    def step(self):
+        """
+        Checks registration once, falling back to a full scan if the cached network isn't working out.
+        Returns True if the modem is registered
+        """
+        if(self.modem.is_registered_to_network()):
+            if(self.on_registered()):
+                self.remember(self.modem.get_network_information())
+            
+            return True
+        
+        config = self.fallback_config()
+        
+        if(config is not None):
+            self.modem.apply_config(config)
+        
+        return False
+    
+    async def step_async(self, modem):
+        """
+        step() through an AsyncModem
+        """
+        if(await modem.is_registered_to_network()):
+            if(self.on_registered()):
+                self.remember(await modem.get_network_information())
+            
+            return True
+        
+        config = self.fallback_config()
+        
+        if(config is not None):
+            await modem.apply_config(config)
+        
+        return False
+    
+    def remember(self, network_information):
+        if(network_information is None or not network_information.get('oper')):
+            return
+        
+        network = {
+            'oper': network_information['oper'],
+            'act': network_information['act'],
+            'band': network_information['band']
+            }
+        
+        logger.info(f"Registered in {self.time_to_registration:.1f} s on {network['oper']} {network['act']} {network['band']} ({'cached' if self.narrowed else 'full scan'})")
+        
+        network['time_to_registration'] = self.time_to_registration
+        
+        self.cache = network
+        self.save_cache()
+    
+    def take_reading(self):
+        """
+        Returns this cycle's time to registration as a Reading, once, or None
+        """
+        reading, self.pending_reading = self.pending_reading, None
+        
+        return reading
+    
+class GNSS:
+    """
+    The BG95's own GNSS receiver, started with XTRA assistance and the time from the RTC so it doesn't have to
+    download almanac and ephemeris from the sky. The last fix and time to first fix are kept on the SD card.
+    GNSS only has the RF front end while it has priority, so priority goes back to LTE as soon as there's a fix.
+    """
+    def __init__(self, modem, cache_path=GNSS_CACHE_PATH):
+        self.modem = modem
+        self.cache_path = cache_path
+        self.cache = self.load_cache()
+        
+        self.started = None         #time.monotonic() the receiver was started this cycle
+        self.position = None        #parsed +QGPSLOC: of this cycle's fix
+        self.ttff = None
+    
+    def load_cache(self):
+        try:
+            with open(self.cache_path, "r") as cache_file:
+                return load(cache_file)
+        except Exception:
+            return {}
+    
+    def save_cache(self):
+        try:
+            with open(self.cache_path, "w") as cache_file:
+                dump(self.cache, cache_file)
+        except OSError as e:
+            logger.warning(f"Failed to save GNSS cache: {e}")
+    
+    @property
+    def has_fix(self):
+        return self.position is not None
+    
+    def start(self):
+        """
+        Starts a fix. Injects the time first when XTRA data is loaded, then gives GNSS priority and turns the receiver on
+        """
+        self.position = None
+        self.ttff = None
+        
+        now = time.localtime()
+        validity = self.modem.get_xtra_validity()
+        
+        if(validity is not None and validity['valid_minutes'] and now.tm_year >= MIN_CLOCK_YEAR):
+            self.modem.inject_xtra_time(now)
+        
+        fix_age = time.time() - self.cache['fix_time'] if 'fix_time' in self.cache else None
+        start_type = "hot" if fix_age is not None and 0 <= fix_age < GNSS_HOT_START_AGE else "cold"
+        logger.info(f"Starting GNSS ({start_type} start, XTRA valid for {validity['valid_minutes'] if validity else 0} min)")
+        
+        self.modem.set_gnss_priority(GNSS_PRIORITY_GNSS)
+        
+        if(self.modem.get_gps_power_state() or self.modem.set_gps_power_state(True)):
+            self.started = time.monotonic()
+            return True
+        
+        logger.warning("Failed to start GNSS")
+        self.modem.set_gnss_priority(GNSS_PRIORITY_WWAN)
+        return False
+    
+    def poll(self):
+        """
+        Asks the receiver for a fix once. Returns True once there is one, recording the time to first fix
+        """
+        if(self.position is not None):
+            return True
+        
+        if(self.started is None):
+            return False
+        
+        position = self.modem.get_position_information()
+        
+        if(position is None or position['latitude'] is None or position['longitude'] is None):
+            return False
+        
+        self.position = position
+        self.ttff = time.monotonic() - self.started
+        logger.info(f"GNSS fix in {self.ttff:.1f} s: {position['latitude']}, {position['longitude']} ({position['satellites']} satellites, HDOP {position['hdop']})")
+        
+        self.cache = {
+            'latitude': position['latitude'],
+            'longitude': position['longitude'],
+            'altitude': position['altitude'],
+            'fix_time': time.time(),
+            'ttff': self.ttff
+            }
+        self.save_cache()
+        
+        self.modem.set_gnss_priority(GNSS_PRIORITY_WWAN)
+        
+        return True
+    
+    def stop(self):
+        """
+        Turns the receiver off and hands the RF back to LTE. The modem keeps the ephemeris for the next start
+        """
+        if(self.started is not None and self.position is None):
+            logger.info(f"No GNSS fix after {time.monotonic() - self.started:.1f} s")
+        
+        self.started = None
+        self.modem.set_gps_power_state(False)
+        self.modem.set_gnss_priority(GNSS_PRIORITY_WWAN)
+    
+    def refresh_xtra(self):
+        """
+        Downloads and injects new XTRA data when what's loaded runs out within XTRA_REFRESH_MARGIN minutes.
+        Needs a data connection. Returns True if the loaded data is current
+        """
+        validity = self.modem.get_xtra_validity()
+        
+        if(validity is not None and validity['valid_minutes'] is not None and validity['valid_minutes'] > XTRA_REFRESH_MARGIN):
+            return True
+        
+        if(not self.modem.get_xtra_state()):
+            logger.info("Enabling XTRA, takes effect after the modem restarts")
+            self.modem.set_xtra_state(True)
+            return False
+        
+        logger.info("Downloading XTRA data")
+        
+        if(self.modem.http_get_to_file(XTRA_URL, XTRA_FILE) is None):
+            return False
+        
+        injected = self.modem.inject_xtra_data(XTRA_FILE)
+        self.modem.delete_file_from_modem(XTRA_FILE)
+        
+        if(injected):
+            self.modem.inject_xtra_time(time.localtime())
+        
+        logger.info(f"XTRA data {'injected' if injected else 'rejected'}")
+        
+        return injected
+    
+    def read(self):
+        """
+        Readings from this cycle's fix, or the last known location if there isn't one yet. Doesn't talk to the modem
+        """
+        readings = {}
+        
+        if(self.position is not None):
+            readings['location'] = Reading((self.position['latitude'], self.position['longitude']), "degrees", "GNSS Location")
+            readings['altitude'] = Reading(self.position['altitude'], "meters", "GNSS Altitude")
+            readings['hdop'] = Reading(self.position['hdop'], "-", "GNSS Horizontal Dilution of Precision")
+            readings['sv'] = Reading(self.position['satellites'], "-", "GNSS Satellites Used")
+            readings['ttff'] = Reading(self.ttff, "s", "GNSS Time To First Fix")
+        elif('latitude' in self.cache):
+            readings['location'] = Reading((self.cache['latitude'], self.cache['longitude']), "degrees", "GNSS Last Known Location")
+        
+        return readings
+        
+class BG95M3:
+    """Class for handling AT communication with modem"""
+    def __init__(self, uart_bus, blocking=True):
+        self.init_channel(uart_bus)
+        self.power_button = digitalio.DigitalInOut(board.GP17)
+        self.power_button.direction = digitalio.Direction.OUTPUT
+        self.power_status = digitalio.DigitalInOut(board.GP20)
+        self.power_status.direction = digitalio.Direction.INPUT
+        
+        self.bring_up_state = BRINGUP_POWER
+        self.bring_up_started = time.monotonic()
+        
+        #With blocking=False the caller steps bring-up with step_bring_up() between its own work
+        if(blocking):
+            self.wait_until_up()
+    
+    @property
+    def is_up(self):
+        return self.bring_up_state == BRINGUP_DONE
+    
+    def step_bring_up(self):
+        """
+        Advances modem bring-up by one short step and returns True once the modem is up. Power on, waiting for the
+        modem to answer AT (hard restarting it if it doesn't within MODEM_BOOT_TIMEOUT), closing what a previous run
+        left open and the initial config each happen in their own step, so the main loop can do other work while
+        the modem boots
+        """
+        state = self.bring_up_state
+        now = time.monotonic()
+        
+        if(state == BRINGUP_DONE or now < self.bring_up_next_step):
+            return state == BRINGUP_DONE
+        
+        if(state == BRINGUP_POWER):
+            self.power_on()
+            self.bring_up_state = BRINGUP_BOOT
+            self.bring_up_boot_deadline = time.monotonic() + MODEM_BOOT_TIMEOUT
+        
+        elif(state == BRINGUP_BOOT):
+            if(self.check_communication(timeout=MODEM_PROBE_TIMEOUT)):
+                self.bring_up_state = BRINGUP_CLEANUP
+            elif(now > self.bring_up_boot_deadline):
+                logger.info("Communication failed. Restarting modem.")
+                self.power_off(graceful=False)
+                self.bring_up_state = BRINGUP_POWER
+                self.bring_up_next_step = time.monotonic() + 1
+            else:
+                logger.info("Waiting for device to initialize")
+                self.bring_up_next_step = now + MODEM_PROBE_INTERVAL
+        
+        elif(state == BRINGUP_CLEANUP):
+            self.close_inherited_sockets()
+            self.close_inherited_ssl_clients()
+            self.bring_up_state = BRINGUP_CONFIGURE
+        
+        elif(state == BRINGUP_CONFIGURE):
+            logger.info("Setting Echo Mode to OFF")
+            self.send_comm_get_response("ATE0")
+            
+            logger.info("Enabling link state URCs")
+            self.enable_link_state_urcs()
+            
+            gc.collect()
+            
+            logger.info(f"Device ICCID: {self.get_iccid()}")
+            logger.info("Device is ready")
+            gc.collect()
+            
+            self.bring_up_state = BRINGUP_DONE
+            self.bring_up_duration = time.monotonic() - self.bring_up_started
+            logger.info(f"Modem up after {self.bring_up_duration:.1f} s")
+        
+        return self.bring_up_state == BRINGUP_DONE
+    
+    def wait_until_up(self, timeout=None):
+        """
+        Steps bring-up until the modem is up, or until timeout seconds pass. Returns True if it's up
+        """
+        start_time = time.monotonic()
+        
+        while not self.step_bring_up():
+            if(timeout is not None and time.monotonic() - start_time > timeout):
+                return False
+            
+            time.sleep(0.05)
+        
+        return True
+    
+    def close_inherited_sockets(self):
+        logger.info("Finding inherited sockets")
+        inherited_sockets = self.get_open_mqtt_sockets()
+        
+        for i in inherited_sockets:
+            logger.info(f"Inherited socket: {i}")
+            try:
+                response = self.send_comm_get_response(f"AT+QMTCLOSE={i['socket_id']}", discard_urcs=("+QMTCLOSE:",))
+                
+                #Wait for a +QMTOPEN: message to check result of attempting to open connection
+                close_result_response = self.wait_for_urc("+QMTCLOSE:", args=f"{i['socket_id']},", timeout=30)
+
+                if(close_result_response['status_code'] == Status.OK):
+                    parsed_response = parse_line(close_result_response['response_line'], "+QMTCLOSE:")
+                    
+                    if(parsed_response['result'] == 0):
+                        logger.info(f"Successfully closed socket: {parsed_response['socket_id']}: {parsed_response['result']}")
+                    else:
+                        logger.warning(f"Failed to close socket: {parsed_response['socket_id']}: {parsed_response['result']}")
+                else:
+                    logger.warning(f"Failed to close socket{i['socket_id']}")
+                    logger.warning(f"{close_result_response}")
+                    
+            except Exception as e:
+                logger.info(f"Failed to close inherited sockets: {e}")
+        
+        gc.collect()
+    
+    def close_inherited_ssl_clients(self):
+        """
+        Closes SSL clients left open by a previous run, if there are any
+        """
+        for client_id in self.get_open_ssl_client_ids():
+            logger.info(f"Closing inherited SSL client: {client_id}")
+            self.send_comm_get_response(f'AT+QSSLCLOSE={client_id}', timeout=10)
+        
+        gc.collect()
+        
+    def init_channel(self, uart_bus):
+        """
+        Sets up the AT reader, URC routing and link state cache on uart_bus, without touching the modem itself
+        """
+        self.uart_bus = uart_bus
+        self.mqtt_session = None
+        self.mqtt_handshakes = 0    #successful AT+QMTOPENs, each one a TCP connect and TLS handshake
+        self.link_state = LinkStateCache()
+        self.urcs = URCRouter()
+        self.urcs.register("+QMTSTAT:", self.on_mqtt_state_change)
+        self.urcs.register("+QMTSTAT:", self.link_state.invalidate)
+        self.urcs.register("+CREG:", self.link_state.invalidate)
+        self.urcs.register("+CEREG:", self.link_state.invalidate)
+        self.urcs.register("+CGEV:", self.link_state.invalidate)
+        self.urcs.register("RDY", self.on_modem_restart)
+        self.reader = ATReader(uart_bus, router=self.urcs, idle=watchdog.feed)
+        self.applied_config = {}    #DesiredConfig name -> fingerprint applied since the modem last powered up
+        self.config_power_cycled = False    #True from a power up until the first volatile config is applied, while those settings are the defaults
+        self.config_commands_sent = 0
+        self.config_commands_saved = 0
+        self.bring_up_state = BRINGUP_DONE      #a channel on its own is taken to be talking to a modem that's already up
+        self.bring_up_next_step = 0
+        self.bring_up_duration = None
+        
+    #---SUPER HIGH LEVEL CHECKERS---#
+    def is_responsive(self):
+        self.poll_urcs()
+        return self.link_state.check('responsive', self.check_communication)
+    
+    def is_registered_to_network(self):
+        self.poll_urcs()
+        return self.link_state.check('registered', self.check_registered_to_network)
+    
+    def check_registered_to_network(self):
+        network_registration_status = self.get_network_registration_status()
+        
+        if(network_registration_status is None):
+            return False
+        
+        stat = network_registration_status.get('stat')
+        
+        if stat in [1, 5]:
+            return True
+        else:
+            return False
+        
+    def is_pds_connected(self):
+        self.poll_urcs()
+        return self.link_state.check('pds', self.check_pds_connected)
+    
+    def check_pds_connected(self):
+        packet_service_status = self.get_packet_service_status()
+        
+        if(packet_service_status is None):
+            return False
+        
+        connected = packet_service_status.get('state')
+        
+        if connected:
+            return True
+        else:
+            return False
+    
+    def is_pdp_connected(self):
+        self.poll_urcs()
+        return self.link_state.check('pdp', self.check_pdp_connected)
+    
+    def check_pdp_connected(self):
+        pdp_status = self.get_pdp_status()
+        
+        if(not pdp_status):
+            return False
+        
+        connected = pdp_status[0].get('state')
+        if connected:
+            return True
+        else:
+            return False
+        
+    def is_comms_ready(self):
+        if(not self.is_up):
+            return False
+        
+        if self.is_responsive() and self.is_registered_to_network() and self.is_pds_connected() and self.is_pdp_connected():
+            return True
+        else:
+            return False
+        
+    #---HARDWARE---#
+    def power_status_check(self):
+        """
+        Checks the current state of the modem (on/off).
+        """
+        return not self.power_status.value
+
+    def toggle_power(self):
+        """
+        Toggles the modem's power button, for a power up or power down
+        Returns: nothing
+        """
+        self.pulse_power_key()
+        
+        #Volatile settings (QSSLCFG, QMTCFG, QHTTPCFG) don't survive a power cycle, the AT+QCFG ones in NVM do
+        self.forget_config(power_cycled=True)
+        
+    def pulse_power_key(self):
+        """
+        Pulses PWRKEY. Also wakes the modem out of PSM, where it keeps its volatile settings, so this leaves the config state alone
+        """
+        self.power_button.value = True
+        time.sleep(1)
+        self.power_button.value = False
         time.sleep(0.5)
         
     def power_on(self):
@@ -608,10 +1539,8 @@ class BG95M3:
                 #Check that the connect command was RECEIVED AND PARSED successfully
                 if(response['status_code'] == Status.OK):
                     logger.info("Waiting to establish connection to broker...")
-                    pattern = re.compile(r"\+?POWERED\s+DOWN")
-                    
                     #Wait for a +QMTCONN: message to check result of attempting to connect to broker
-                    power_down_response = self.wait_for_response(pattern, timeout=120)
+                    power_down_response = self.wait_for_response(POWERED_DOWN_PATTERN, timeout=120)
                     
                     if(power_down_response['status_code'] == Status.OK):
                         logger.info("Got good power down response from modem")
@@ -627,10 +1556,160 @@ class BG95M3:
         time.sleep(1)
         self.power_on()
 
+    #---POWER SAVING---#
+    def set_psm(self, enable=True, periodic_tau=3600, active_time=60):
+        """
+        Requests LTE Power Saving Mode with AT+CPSMS. periodic_tau (T3412) and active_time (T3324) are in seconds and are
+        rounded up to what the timer encoding can represent. The network may grant different values, see verify_psm
+        """
+        if(not enable):
+            response = self.send_comm_get_response("AT+CPSMS=0")
+        else:
+            response = self.send_comm_get_response(f'AT+CPSMS=1,,,"{encode_timer(periodic_tau, T3412_UNITS)}","{encode_timer(active_time, T3324_UNITS)}"')
+        
+        if(response['status_code'] == Status.OK):
+            return True
+        else:
+            logger.warning(f"Failed to set PSM: {response}")
+            return False
+    
+    def get_psm(self):
+        """
+        Returns the requested PSM settings, with the timers decoded to seconds
+        """
+        response = self.send_comm_get_response("AT+CPSMS?")
+        if(response['status_code'] == Status.OK):
+            psm = parse_first(response['data'], "+CPSMS:")
+            
+            if(psm is not None):
+                psm['periodic_tau_s'] = decode_timer(psm.get('periodic_tau'), T3412_UNITS)
+                psm['active_time_s'] = decode_timer(psm.get('active_time'), T3324_UNITS)
+            
+            return psm
+    
+    def get_granted_psm(self):
+        """
+        Returns the PSM timers the network actually granted, from AT+CEREG? with reporting level 4
+        """
+        self.send_comm_get_response("AT+CEREG=4")
+        response = self.send_comm_get_response("AT+CEREG?")
+        
+        if(response['status_code'] == Status.OK):
+            registration = parse_first(response['data'], "+CEREG:")
+            
+            if(registration is not None):
+                return {
+                    "stat": registration.get('stat'),
+                    "periodic_tau_s": decode_timer(registration.get('periodic_tau'), T3412_UNITS),
+                    "active_time_s": decode_timer(registration.get('active_time'), T3324_UNITS)
+                    }
+    
+    def verify_psm(self, periodic_tau, active_time):
+        """
+        Compares the requested PSM timers with what the network granted. Returns a dict with both, and 'granted' True if
+        the network enabled PSM at all
+        """
+        granted = self.get_granted_psm() or {}
+        
+        result = {
+            "requested_periodic_tau_s": decode_timer(encode_timer(periodic_tau, T3412_UNITS), T3412_UNITS),
+            "requested_active_time_s": decode_timer(encode_timer(active_time, T3324_UNITS), T3324_UNITS),
+            "periodic_tau_s": granted.get('periodic_tau_s'),
+            "active_time_s": granted.get('active_time_s')
+            }
+        result['granted'] = result['active_time_s'] is not None and result['periodic_tau_s'] is not None
+        
+        logger.info(f"PSM: {result}")
+        
+        return result
+    
+    def set_edrx(self, enable=True, cycle=20.48, act_type=4):
+        """
+        Requests an eDRX cycle (seconds, rounded down to a valid LTE-M value) with AT+CEDRXS. act_type 4 is LTE-M, 5 is NB-IoT
+        """
+        if(not enable):
+            response = self.send_comm_get_response(f"AT+CEDRXS=0,{act_type}")
+        else:
+            response = self.send_comm_get_response(f'AT+CEDRXS=1,{act_type},"{encode_edrx(cycle)}"')
+        
+        if(response['status_code'] == Status.OK):
+            return True
+        else:
+            logger.warning(f"Failed to set eDRX: {response}")
+            return False
+    
+    def get_edrx(self):
+        """
+        Returns the requested eDRX settings per access technology
+        """
+        response = self.send_comm_get_response("AT+CEDRXS?")
+        if(response['status_code'] == Status.OK):
+            settings = parse_lines(response['data'], "+CEDRXS:")
+            
+            for setting in settings:
+                setting['cycle_s'] = decode_edrx(setting.get('edrx_value'))
+            
+            return settings
+    
+    def verify_edrx(self):
+        """
+        Returns the requested and network-provided eDRX cycle in seconds from AT+CEDRXRDP
+        """
+        response = self.send_comm_get_response("AT+CEDRXRDP")
+        if(response['status_code'] == Status.OK):
+            dynamic = parse_first(response['data'], "+CEDRXRDP:")
+            
+            if(dynamic is not None):
+                result = {
+                    "act_type": dynamic.get('act_type'),
+                    "requested_cycle_s": decode_edrx(dynamic.get('requested_edrx_value')),
+                    "network_cycle_s": decode_edrx(dynamic.get('network_edrx_value'))
+                    }
+                logger.info(f"eDRX: {result}")
+                
+                return result
+    
+    def wake(self, retries=5):
+        """
+        Fast path out of PSM or a sleep cycle. Wakes the modem with PWRKEY if it's asleep, then asks AT+CGACT? once.
+        An active PDP context means registration and attach survived, so the link state is primed and no
+        CREG/CGATT/CGACT polling or re-attach is needed. Returns True if the context survived
+        """
+        if(not self.power_status_check()):
+            logger.info("Modem is asleep, waking it")
+            self.pulse_power_key()
+        
+        for _ in range(retries):
+            if(self.check_communication()):
+                break
+            time.sleep(0.2)
+        else:
+            logger.warning("Modem didn't respond after waking")
+            self.link_state.invalidate()
+            return False
+        
+        if(self.check_pdp_connected()):
+            logger.info("Network context survived, skipping re-registration")
+            self.link_state.prime(('responsive', 'registered', 'pds', 'pdp'))
+            return True
+        
+        logger.info("Network context was lost, modem will re-attach")
+        self.link_state.invalidate()
+        return False
+
     #---BASIC COMMS---#
-    def send_comm(self, command, endline='\r'):
+    def send_comm(self, command, endline='\r', discard_urcs=()):
+        """
+        Sends a command. Anything already waiting on the UART is read first so URCs get routed rather than thrown away;
+        discard_urcs drops stale queued URCs that would otherwise be mistaken for this command's result
+        """
         try:
-            self.uart_bus.reset_input_buffer()
+            self.reader.drain()
+            
+            for prefix in discard_urcs:
+                self.urcs.clear(prefix)
+            
+            self.reader.expect(command)
             self.uart_bus.write(f"{command}{endline}".encode('utf-8'))
         except:
             pass
@@ -639,121 +1718,88 @@ class BG95M3:
         """
         Waits for a status response code: OK, ERROR, +CME ERROR: , +CMS ERROR: and returns all response lines before it
         """
-        response = ""
-        response_lines = []
-
-        timer = time.time()
+        response = self.reader.read_response(timeout=timeout)
         
-        ok_pattern = re.compile(r"^OK$")
-        error_pattern = re.compile(r"ERROR$")
-        cme_error_pattern = re.compile(r"^\+CME ERROR: (.*)$")
-        cms_error_pattern = re.compile(r"^\+CMS ERROR: (.*)$")
+        if(response['status_code'] == Status.ERROR):
+            logger.info(f"Matched: {response['response_line']}")
+        elif(response['status_code'] == Status.TIMEOUT):
+            self.link_state.invalidate()
         
-        #Waits for OK, ERROR or +CME ERROR: message, or returns timeout error
-        while True:
-            #logger.info(f"Feeding watchdog")
-            watchdog.feed()
-            time.sleep(0.1)  # wait for new chars
-
-            if time.time() - timer < timeout:
-                while self.uart_bus.in_waiting:
-                    try:
-                        response = self.uart_bus.read(self.uart_bus.in_waiting).decode("utf-8")
-                    except:
-                        pass
-            else:
-                return {"status": "Timeout", "status_code": Status.TIMEOUT, "data": [], "response_line": ""}
-            
-            #if new data from the buffer isn't None, split the data by line and add to response_lines
-            if response != "":
-                response_lines.extend([x for x in response.split("\r\n") if x != ""])
-                response = ""
-
-            for index, line in enumerate(response_lines):
-                if ok_pattern.match(line):
-                    # logger.info("Matched: OK")
-                    return {"status": line, "status_code": Status.OK, "data": response_lines[:index], "response_line": line}
-                elif error_pattern.match(line):
-                    logger.info("Matched: ERROR")
-                    return {"status": line, "status_code":Status.ERROR, "data": response_lines[:index], "response_line": line}
-                elif cme_error_pattern.match(line):
-                    logger.info("Matched: CME ERROR")
-                    return {"status": line, "status_code":Status.ERROR, "data": response_lines[:index], "response_line": line}
-                elif cms_error_pattern.match(line):
-                    logger.info("Matched: CMS ERROR")
-                    return {"status": line, "status_code":Status.ERROR, "data": response_lines[:index], "response_line": line}
+        return response
 
     def wait_for_response(self, response_pattern, secondary_pattern=None, timeout=5):
         """
         Waits up to timeout duration, for a line from the uart_bus, matching regex response pattern
         """
-        response = ""
-        response_lines = []
+        response = self.reader.wait_for(response_pattern, secondary_pattern=secondary_pattern, timeout=timeout)
+        
+        if(response['status_code'] == Status.OK):
+            logger.info(f"Matched primary response pattern")
+        elif(response['status_code'] == Status.UNKNOWN):
+            logger.info(f"Matched secondary response pattern")
+        
+        return response
 
-        timer = time.time()
+    def wait_for_urc(self, prefix, args=None, secondary_prefix=None, timeout=5):
+        """
+        Waits up to timeout duration for a URC with this prefix (and arguments starting with args), including one already queued
+        """
+        response = self.reader.wait_for_urc(prefix, args=args, secondary_prefix=secondary_prefix, timeout=timeout)
         
-        #Waits for OK, ERROR or +CME ERROR: message, or returns timeout error
-        while True:
-            #logger.info(f"Feeding watchdog")
-            watchdog.feed()
-            time.sleep(0.1)  # wait for new chars
-
-            if time.time() - timer < timeout:
-                while self.uart_bus.in_waiting:
-                    try:
-                        i = self.uart_bus.in_waiting
-                        response = self.uart_bus.read(self.uart_bus.in_waiting).decode("utf-8")
-                        logger.info(f"Read {i} bytes")
-                    except:
-                        pass
-            else:
-                return {"status": "Timeout", "status_code": Status.TIMEOUT, "data": [], "raw_response": ""}
-            
-            #if new data from the buffer isn't None, split the data by line and add to response_lines
-            if response != "":
-                response_lines.extend([x for x in response.split("\r\n") if x != ""])
-                response = ""
-
-            logger.info(f"In waiting for a respone, we have {len(response_lines)}")
-            for r in response_lines:
-                logger.info(f"{r}")
-            
-            for index, line in enumerate(response_lines):
-                if response_pattern.match(line):
-                    logger.info(f"Matched primary response pattern")
-                    return {"status": "OK", "status_code": Status.OK, "data": response_lines[:index], "response_line": line}
-                elif secondary_pattern is not None:
-                    if secondary_pattern.match(line):
-                        logger.info(f"Matched secondary response pattern")
-                        return {"status": "Unknown", "status_code": Status.UNKNOWN, "data": response_lines[:index], "response_line": line}
+        if(response['status_code'] == Status.UNKNOWN):
+            logger.info(f"Matched secondary URC: {response['response_line']}")
+        
+        return response
 
-    def parse_response_data(self, data, response_pattern):
+    def poll_urcs(self):
         """
-        Parses data for lines that match the response pattern, if a line matches the response pattern, it's data is split by ',' and appended to return data
+        Routes any URCs waiting on the UART without sending a command, so their callbacks run
         """
+        self.reader.drain()
 
-        matched_data = []
-        for line in data:
-            matched_line = response_pattern.match(line)
-            if(matched_line):
-                stripped_line = matched_line.group(1)
-                split_line = [x.strip('"') for x in stripped_line.split(",")]
-                matched_data.append(split_line)
-        
-        return matched_data
+    def on_mqtt_state_change(self, line):
+        logger.warning(f"MQTT socket state changed: {line}")
+    
+    def on_modem_restart(self, line):
+        """
+        RDY outside of our own power up means the modem reset itself (brown-out, firmware fault)
+        """
+        logger.warning("Modem restarted, its volatile config is back on the defaults")
+        self.forget_config(power_cycled=True)
+        self.link_state.invalidate(line)
 
-    def send_comm_get_response(self, command, endline='\r', timeout=5):
-        self.send_comm(command, endline)
-        time.sleep(.1)
+    def send_comm_get_response(self, command, endline='\r', timeout=5, discard_urcs=()):
+        self.send_comm(command, endline, discard_urcs)
         
         return self.get_response(timeout=timeout)
     
-    def check_communication(self):
+    def send_data(self, data):
+        """
+        Writes raw bytes (bytes, bytearray or memoryview) straight to the UART after a data prompt, with no encoding or terminator
+        """
+        data = memoryview(data)
+        written = 0
+        
+        while written < len(data):
+            count = self.uart_bus.write(data[written:])
+            if not count:
+                break
+            written += count
+        
+        return written
+    
+    def wait_for_prompt(self, timeout=5):
+        """
+        Waits for the "> " prompt a length-prefixed command answers with before it takes its data
+        """
+        return self.reader.wait_for_prompt(timeout=timeout)
+    
+    def check_communication(self, timeout=5):
         """
         Function for checking modem communication
         """
         
-        response = self.send_comm_get_response("AT")
+        response = self.send_comm_get_response("AT", timeout=timeout)
         if(response['status_code'] == Status.OK):
             return True
         else:
@@ -764,10 +1810,125 @@ class BG95M3:
         pass
     
     #---BASIC DEVICE CONFIG---#
+    def forget_config(self, power_cycled=False):
+        """
+        Stops trusting what apply_config last applied, so the next apply checks the modem again. power_cycled when
+        the modem has just powered up, so its volatile settings are known to be the defaults
+        """
+        self.applied_config = {}
+        
+        if(power_cycled):
+            self.config_power_cycled = True
+    
+    def config_query_lines(self, config):
+        """
+        The queries reading back every parameter of a DesiredConfig, concatenated into as few command lines as
+        AT_MAX_COMMAND_LINE allows (one, for every config we use)
+        """
+        lines = []
+        queries = [f"{config.command[2:]}={selector}" for selector, value in config.params]
+        
+        while queries:
+            line = "AT" + queries.pop(0)
+            
+            while queries and len(line) + 1 + len(queries[0]) <= AT_MAX_COMMAND_LINE:
+                line = f"{line};{queries.pop(0)}"
+            
+            lines.append(line)
+        
+        return lines
+    
+    def config_steps(self, config):
+        """
+        apply_config as a generator: yields each command line to send and is sent its response, returning True if
+        the modem ends up matching. Lets BG95M3 and AsyncModem share it, one blocking and one awaiting each command
+        """
+        if(self.applied_config.get(config.name) == config.fingerprint):
+            self.config_commands_saved += len(config.params)
+            return True
+        
+        current = {}
+        
+        #Straight after a power cycle volatile settings are on their defaults, so there's nothing worth reading back.
+        #AT+QCFG band and scan settings are kept in NVM and always are
+        if(self.config_power_cycled and config.volatile):
+            self.config_power_cycled = False
+        else:
+            for line in self.config_query_lines(config):
+                response = yield line
+                self.config_commands_sent += 1
+                
+                if(response['status_code'] != Status.OK):
+                    continue
+                
+                for response_line in response['data']:
+                    if(response_line.startswith(f"{config.command[2:]}:")):
+                        current[DesiredConfig.key(response_line)] = response_line
+        
+        applied = True
+        
+        for selector, value in config.params:
+            response_line = current.get(DesiredConfig.key(selector))
+            
+            if(response_line is not None and DesiredConfig.matches(response_line, value)):
+                self.config_commands_saved += 1
+                continue
+            
+            response = yield f"{config.command}={selector},{value}"
+            self.config_commands_sent += 1
+            
+            if(response['status_code'] == Status.OK):
+                logger.info(f"Set {config.command}={selector},{value}")
+            else:
+                logger.warning(f"Failed to set {config.command}={selector},{value}: {response}")
+                applied = False
+        
+        if(applied):
+            self.applied_config[config.name] = config.fingerprint
+        else:
+            self.applied_config.pop(config.name, None)
+        
+        return applied
+    
+    def apply_config(self, config):
+        """
+        Brings the modem in line with a DesiredConfig. If the same config was already applied since the modem powered
+        up nothing is sent. Otherwise the parameters are read back with one query and only the ones that differ are
+        set, or all set outright if it's a volatile config and we've just power cycled the modem. Returns True if the
+        modem ends up matching
+        """
+        steps = self.config_steps(config)
+        
+        try:
+            command = next(steps)
+            
+            while True:
+                command = steps.send(self.send_comm_get_response(command))
+        except StopIteration as done:
+            return done.value
+    
+    def get_open_ssl_client_ids(self):
+        """
+        Returns the IDs of SSL clients the modem has open, from a single AT+QSSLSTATE
+        """
+        response = self.send_comm_get_response("AT+QSSLSTATE")
+        if(response['status_code'] == Status.OK):
+            return [client['client_id'] for client in parse_lines(response['data'], "+QSSLSTATE:")]
+        
+        return []
+    
+    def enable_link_state_urcs(self):
+        """
+        Turns on the +CREG registration and +CGEV packet domain URCs that invalidate the link state cache
+        """
+        registration = self.send_comm_get_response("AT+CREG=1")
+        packet_domain = self.send_comm_get_response("AT+CGEREP=2,1")
+        
+        return registration['status_code'] == Status.OK and packet_domain['status_code'] == Status.OK
+    
     def set_urc_indication_config(self, urc_type, enable, save=1):
         response = self.send_comm_get_response(f"AT+QINDCFG={urc_type},{enable},{save}")
-        parsed_response = self.parse_single_response(response, "+QINDCFG: ")
-        return parsed_response
+        return parse_first(response['data'], "+QINDCFG:")
     
     #---BASIC CELLULAR INFO---#
     def get_imei(self):
@@ -784,83 +1945,87 @@ class BG95M3:
         response = self.send_comm_get_response("AT+QCCID")
 
         if(response['status_code'] == Status.OK):
-            pattern = re.compile(r"^\+QCCID: (.*)$")
-            for line in response['data']:
-                matched = pattern.match(line)
-                if matched:
-                    return int(matched.group(1))
+            parsed_response = parse_first(response['data'], "+QCCID:")
+            if parsed_response:
+                return parsed_response['iccid']
     
     def get_network_registration_status(self):
         response = self.send_comm_get_response("AT+CREG?")
         if(response['status_code'] == Status.OK):
-            pattern = re.compile(r"^\+CREG: (.*)$")
-            parsed_responses = self.parse_response_data(response['data'], pattern)
-            return {"n": int(parsed_responses[0][0]), "stat": int(parsed_responses[0][1])}
+            return parse_first(response['data'], "+CREG:")
         
     
     def get_current_operator_status(self):
         response = self.send_comm_get_response("AT+COPS?")
         if(response['status_code'] == Status.OK):
-            pattern = re.compile(r"^\+COPS: (.*)$")
-            parsed_responses = self.parse_response_data(response['data'], pattern)
-            parsed_response = parsed_responses[0]
-
-            if(len(parsed_responses[0]) == 4):
-                return {"mode": parsed_responses[0][0], "format": parsed_responses[0][1], "operator": parsed_responses[0][2], "act": parsed_response[3]}
-
-            else:
-                return {"mode": parsed_responses[0][0]}
+            return parse_first(response['data'], "+COPS:")
 
     def get_current_operator_names(self):
         response = self.send_comm_get_response("AT+COPN")
 
         if(response['status_code'] == Status.OK):
-            pattern = re.compile(r"^\+COPN: (.*)$")
-            parsed_responses = self.parse_response_data(response['data'], pattern)
-
-            operators = []
-
-            for parsed_response in parsed_responses:
-                operators.append({"numeric": parsed_response[0], "alphanumeric": parsed_response[1]})
-
-            return operators
+            return parse_lines(response['data'], "+COPN:")
     
     def get_signal_quality(self):
         response = self.send_comm_get_response("AT+CSQ")
         if(response['status_code'] == Status.OK):
-            pattern = re.compile(r"^\+CSQ: (.*)$")
-            parsed_responses = self.parse_response_data(response['data'], pattern)
-            parsed_response = parsed_responses[0]
-
-            return {"rssi": parsed_response[0], "ber": parsed_response[1]}
+            return parse_first(response['data'], "+CSQ:")
+    
+    def get_serving_signal_quality(self):
+        """
+        Returns the serving cell's signal from AT+QCSQ: sysmode, and for LTE rssi, rsrp (dBm), sinr and rsrq (dB).
+        Fields the RAT doesn't report are left out
+        """
+        response = self.send_comm_get_response("AT+QCSQ")
+        if(response['status_code'] == Status.OK):
+            return parse_first(response['data'], "+QCSQ:")
     
     def get_network_information(self):
         response = self.send_comm_get_response("AT+QNWINFO")
         if(response['status_code'] == Status.OK):
-            pattern = re.compile(r"^\+QNWINFO: (.*)$")
-            parsed_responses = self.parse_response_data(response['data'], pattern)
-            parsed_response = parsed_responses[0]
-
-            return {"act": parsed_response[0], "oper": parsed_response[1], "band": parsed_response[2], "channel": parsed_response[3]}
+            return parse_first(response['data'], "+QNWINFO:")
     
     def get_latest_time(self):
         response = self.send_comm_get_response("AT+QLTS")
         if(response['status_code'] == Status.OK):
-            pattern = re.compile(r"^\+QLTS: (.*)$")
-            parsed_responses = self.parse_response_data(response['data'], pattern)
-            parsed_response = parsed_responses[0]
-
-            return {"datetime": parsed_responses[0]}
+            return parse_first(response['data'], "+QLTS:")
+    
+    def get_network_time(self):
+        """
+        Returns the current UTC time, as seconds since the epoch, kept from the last time the network sent it, or None if it hasn't
+        """
+        response = self.send_comm_get_response("AT+QLTS=1")
+        if(response['status_code'] == Status.OK):
+            parsed_response = parse_first(response['data'], "+QLTS:")
+            
+            if(parsed_response is not None):
+                return modem_time_to_epoch(parsed_response['datetime'], is_local=False)
+    
+    def get_clock_time(self):
+        """
+        Returns the modem's clock as UTC seconds since the epoch, or None if it hasn't been set from the network
+        """
+        response = self.send_comm_get_response("AT+CCLK?")
+        if(response['status_code'] == Status.OK):
+            parsed_response = parse_first(response['data'], "+CCLK:")
+            
+            if(parsed_response is not None):
+                return modem_time_to_epoch(parsed_response['datetime'])
+    
+    #---RADIO CONFIG---#
+    def configure_radio(self, scan_sequence=DEFAULT_SCAN_SEQUENCE, iot_op_mode=IOT_OP_MODE_BOTH, bands=DEFAULT_BANDS):
+        """
+        Sets which IoT RATs are used (AT+QCFG="iotopmode"), the order RATs are scanned in (AT+QCFG="nwscanseq",
+        e.g. "0203" for eMTC then NB-IoT) and the GSM, eMTC and NB-IoT band bitmasks (AT+QCFG="band", bit n is
+        band n + 1). Takes effect straight away
+        """
+        return self.apply_config(radio_config(scan_sequence, iot_op_mode, bands))
     
     #---PACKET DATA---#
     def get_packet_service_status(self):
         response = self.send_comm_get_response("AT+CGATT?")
         if(response['status_code'] == Status.OK):
-            pattern = re.compile(r"^\+CGATT: (.*)$")
-            parsed_responses = self.parse_response_data(response['data'], pattern)
-            parsed_response = parsed_responses[0]
-
-            return {"state": int(parsed_response[0])}
+            return parse_first(response['data'], "+CGATT:")
     
     def set_packet_service_status(self, value):
         response = self.send_comm_get_response(f"AT+CGATT={value}")
@@ -873,11 +2038,7 @@ class BG95M3:
     def get_pdp_context(self):
         response = self.send_comm_get_response("AT+CGDCONT?")
         if(response['status_code'] == Status.OK):
-            pattern = re.compile(r"^\+CGDCONT: (.*)$")
-            parsed_responses = self.parse_response_data(response['data'], pattern)
-            parsed_response = parsed_responses[0]
-
-            return {"cid": parsed_response[0], "pdp_type": parsed_response[1], "apn": parsed_response[2], "pdp_address": parsed_response[3], "data_comp": parsed_response[4], "head_comp": parsed_response[5], "ipv4_address_allocation": parsed_response[6]}
+            return parse_first(response['data'], "+CGDCONT:")
     
     def set_pdp_context(self, cid=1, pdp_type="IPV4V6", apn="super"):
         response = self.send_comm_get_response(f'AT+CGDCONT={cid}, "{pdp_type}", "{apn}"')
@@ -891,15 +2052,7 @@ class BG95M3:
         response = self.send_comm_get_response(f"AT+CGACT?")
 
         if(response['status_code'] == Status.OK):
-            pattern = re.compile(r"^\+CGACT: (.*)$")
-            parsed_responses = self.parse_response_data(response['data'], pattern)
-
-            contexts = []
-
-            for parsed_response in parsed_responses:
-                contexts.append({"cid": int(parsed_response[0]), "state": int(parsed_response[1])})
-
-            return contexts
+            return parse_lines(response['data'], "+CGACT:")
     
     def set_pdp_status(self, cid, value):
         response = self.send_comm_get_response(f"AT+CGACT={value},{cid}")
@@ -911,21 +2064,15 @@ class BG95M3:
     def get_pdp_address(self, cid=1):
         response = self.send_comm_get_response(f"AT+CGPADDR={cid}")
         if(response['status_code'] == Status.OK):
-            pattern = re.compile(r"^\+CGPADDR: (.*)$")
-            parsed_responses = self.parse_response_data(response['data'], pattern)
-            parsed_response = parsed_responses[0]
-
-            return {"cid": parsed_response[0], "pdp_address": parsed_response[1]}
+            return parse_first(response['data'], "+CGPADDR:")
     
     #---GNSS---#
     def get_gps_power_state(self):
         response = self.send_comm_get_response('AT+QGPS?')
         if(response['status_code'] == Status.OK):
-            pattern = re.compile(r"^\+QGPS: (.*)$")
-            parsed_responses = self.parse_response_data(response['data'], pattern)
-            parsed_response = parsed_responses[0]
+            parsed_response = parse_first(response['data'], "+QGPS:")
 
-            return bool(parsed_response[0])
+            return bool(parsed_response['state'])
     
     def set_gps_power_state(self, value):
         if(value == True):
@@ -944,25 +2091,54 @@ class BG95M3:
                 return False
         
     def get_position_information(self):
-        response = self.send_comm_get_response('AT+QGPSLOC?')
+        """
+        Returns the current fix with latitude and longitude in decimal degrees, or None without one (+CME ERROR: 516)
+        """
+        response = self.send_comm_get_response('AT+QGPSLOC=2')
+        if(response['status_code'] == Status.OK):
+            return parse_first(response['data'], "+QGPSLOC:")
+    
+    def set_gnss_priority(self, priority):
+        response = self.send_comm_get_response(f'AT+QGPSCFG="priority",{priority}')
+        
+        return response['status_code'] == Status.OK
+    
+    def get_xtra_state(self):
+        response = self.send_comm_get_response('AT+QGPSXTRA?')
+        if(response['status_code'] == Status.OK):
+            parsed_response = parse_first(response['data'], "+QGPSXTRA:")
+            
+            return bool(parsed_response['enable'])
+    
+    def set_xtra_state(self, value):
+        """
+        Turns XTRA on or off. The modem only picks the change up the next time it boots
+        """
+        response = self.send_comm_get_response(f'AT+QGPSXTRA={1 if value else 0}')
+        
+        return response['status_code'] == Status.OK
+    
+    def get_xtra_validity(self):
+        """
+        Returns the minutes the injected XTRA data is still valid for, and when it was injected
+        """
+        response = self.send_comm_get_response('AT+QGPSXTRADATA?')
         if(response['status_code'] == Status.OK):
-            pattern = re.compile(r"^\+CREG: (.*)$")
-            parsed_responses = self.parse_response_data(response['data'], pattern)
-            parsed_response = parsed_responses[0]
-
-            return {
-                "time": parsed_response[0],
-                "latitude": parsed_response[1],
-                "longitude": parsed_response[2],
-                "hdop": parsed_response[3],
-                "altitude": parsed_response[4],
-                "fix": parsed_response[5],
-                "course_over_ground": parsed_response[6],
-                "speed_km": parsed_response[7],
-                "speed_kn": parsed_response[8],
-                "date": parsed_response[9],
-                "satellites": parsed_response[10]
-                }
+            return parse_first(response['data'], "+QGPSXTRADATA:")
+    
+    def inject_xtra_time(self, utc):
+        """
+        Gives the receiver the current UTC time (a struct_time) so it can use the XTRA data straight away
+        """
+        year, month, day, hour, minute, second = utc[0:6]
+        response = self.send_comm_get_response(f'AT+QGPSXTRATIME=0,"{year:04d}/{month:02d}/{day:02d},{hour:02d}:{minute:02d}:{second:02d}",1,1,3500')
+        
+        return response['status_code'] == Status.OK
+    
+    def inject_xtra_data(self, file_name):
+        response = self.send_comm_get_response(f'AT+QGPSXTRADATA="UFS:{file_name}"', timeout=10)
+        
+        return response['status_code'] == Status.OK
     
     #---FILE---#
     def get_file_list(self, path="*"):
@@ -971,11 +2147,7 @@ class BG95M3:
         """
         response = self.send_comm_get_response(f'AT+QFLST="{path}"')
         if(response['status_code'] == Status.OK):
-            pattern = re.compile(r"^\+QFLST: (.*)$")
-            parsed_responses = self.parse_response_data(response['data'], pattern)
-
-            files = [{'file_name': x[0].strip('"'), 'file_size': int(x[1])} for x in parsed_responses]
-            return files
+            return parse_lines(response['data'], "+QFLST:")
 
     def delete_file_from_modem(self, file_name):
         """
@@ -1001,7 +2173,7 @@ class BG95M3:
         #logger.info(f"Feeding watchdog")
         watchdog.feed()
         
-        ready = self.wait_for_response(re.compile(r"^CONNECT$"))
+        ready = self.wait_for_response("CONNECT")
         time.sleep(.1)
         #Send file contents
         self.send_comm(file)
@@ -1010,26 +2182,167 @@ class BG95M3:
         response = self.get_response()
 
         if(response['status_code'] == Status.OK):
-            pattern = re.compile(r"^\+QFUPL: (.*)$")
-            parsed_responses = self.parse_response_data(response['data'], pattern)
-            parsed_response = parsed_responses[0]
-
-            confirmation = {'upload_size': int(parsed_response[0]), 'checksum': parsed_response[1]}
+            confirmation = parse_first(response['data'], "+QFUPL:")
             return True
         else:
             #Set failed
             return False
+    
+    def stream_file(self, path, buffer, offset=0, length=None):
+        """
+        Writes length bytes of a local file, starting at offset, to the UART after a CONNECT. The file is read into
+        buffer a chunk at a time so it's never held in RAM. Returns the number of bytes written
+        """
+        view = memoryview(buffer)
+        sent = 0
+        
+        with open(path, "rb") as file:
+            file.seek(offset)
+            
+            while length is None or sent < length:
+                count = file.readinto(buffer)
+                if not count:
+                    break
+                
+                if(length is not None):
+                    count = min(count, length - sent)
+                
+                sent += self.send_data(view[:count])
+                watchdog.feed()
+        
+        return sent
+    
+    def upload_file_stream(self, filename, path, size, buffer, timeout=5000):
+        """
+        Uploads a local file to modem UFS storage without holding it in RAM: it's read from flash into buffer and
+        written to the UART a chunk at a time. Returns the parsed +QFUPL: confirmation (upload_size, checksum) or None
+        """
+        self.send_comm(f'AT+QFUPL="{filename}",{size},{timeout}')
+        
+        ready = self.wait_for_response("CONNECT", secondary_pattern=ERROR_PATTERN)
+        if(ready['status_code'] != Status.OK):
+            logger.warning(f"Modem didn't accept the upload of {filename}: {ready}")
+            return None
+        
+        self.stream_file(path, buffer, length=size)
+        
+        response = self.get_response(timeout=10)
+        
+        if(response['status_code'] == Status.OK):
+            return parse_first(response['data'], "+QFUPL:")
+        
+        logger.warning(f"Upload of {filename} wasn't confirmed: {response}")
 
+    #---HTTP---#
+    def configure_http(self, ssl_context_id=2, content_type=HTTP_CONTENT_TYPE_TEXT):
+        """
+        Sets up the HTTP(S) client on PDP context 1, using the same SSL context (and device certs) as MQTT
+        """
+        SSL_Context(self, ssl_context_id=ssl_context_id).set_context()
+        
+        return self.apply_config(DesiredConfig("http", "AT+QHTTPCFG", (
+            ('"contextid"', "1"),
+            ('"requestheader"', "0"),
+            ('"responseheader"', "0"),
+            ('"sslctxid"', f"{ssl_context_id}"),
+            ('"contenttype"', f"{content_type}")
+            )))
+    
+    def set_http_url(self, url, timeout=60):
+        """
+        Sets the URL the next HTTP request goes to
+        """
+        self.send_comm(f"AT+QHTTPURL={len(url)},{timeout}")
+        
+        ready = self.wait_for_response("CONNECT", secondary_pattern=ERROR_PATTERN)
+        if(ready['status_code'] != Status.OK):
+            logger.warning(f"Modem didn't accept the URL: {ready}")
+            return False
+        
+        self.send_data(url.encode('utf-8'))
+        
+        return self.get_response(timeout=timeout)['status_code'] == Status.OK
+    
+    def http_post_file(self, url, path, offset=0, length=None, buffer=None, timeout=60):
+        """
+        POSTs length bytes of a local file (from offset) as one request body, streamed from flash. Returns the parsed
+        +QHTTPPOST: result (err, http_code, content_length) plus the bytes sent and seconds taken, or None
+        """
+        if(length is None):
+            length = os.stat(path)[6] - offset
+        
+        buffer = buffer if buffer is not None else bytearray(FILE_UPLOAD_CHUNK)
+        
+        if(not self.set_http_url(url)):
+            return None
+        
+        start_time = time.monotonic()
+        
+        #Give the UART at least 5 kB/s to deliver the body before the modem gives up on it
+        input_time = max(timeout, length // 5000)
+        self.send_comm(f"AT+QHTTPPOST={length},{input_time},{timeout}", discard_urcs=("+QHTTPPOST:",))
+        
+        ready = self.wait_for_response("CONNECT", secondary_pattern=ERROR_PATTERN, timeout=timeout)
+        if(ready['status_code'] != Status.OK):
+            logger.warning(f"Modem didn't accept the POST of {path}: {ready}")
+            return None
+        
+        sent = self.stream_file(path, buffer, offset, length)
+        
+        response = self.get_response(timeout=input_time)
+        if(response['status_code'] != Status.OK):
+            logger.warning(f"POST of {path} failed: {response}")
+            return None
+        
+        post_result_response = self.wait_for_urc("+QHTTPPOST:", timeout=timeout)
+        if(post_result_response['status_code'] != Status.OK):
+            logger.warning(f"No result for POST of {path}: {post_result_response}")
+            return None
+        
+        result = parse_line(post_result_response['response_line'], "+QHTTPPOST:")
+        result['bytes'] = sent
+        result['seconds'] = time.monotonic() - start_time
+        
+        return result
+    
+    def http_get_to_file(self, url, file_name, timeout=80):
+        """
+        Downloads url into a file on the modem's UFS without passing it through the UART. Returns its size, or None
+        """
+        if(not self.set_http_url(url)):
+            return None
+        
+        response = self.send_comm_get_response(f"AT+QHTTPGET={timeout}", timeout=timeout, discard_urcs=("+QHTTPGET:",))
+        if(response['status_code'] != Status.OK):
+            logger.warning(f"GET of {url} failed: {response}")
+            return None
+        
+        get_result_response = self.wait_for_urc("+QHTTPGET:", timeout=timeout)
+        get_result = parse_line(get_result_response['response_line'], "+QHTTPGET:") if get_result_response['status_code'] == Status.OK else None
+        
+        if(get_result is None or get_result['err'] != 0 or get_result['http_code'] != 200):
+            logger.warning(f"GET of {url} failed: {get_result_response}")
+            return None
+        
+        response = self.send_comm_get_response(f'AT+QHTTPREADFILE="UFS:{file_name}",{timeout}', timeout=timeout, discard_urcs=("+QHTTPREADFILE:",))
+        if(response['status_code'] != Status.OK):
+            logger.warning(f"Failed to save {url} to {file_name}: {response}")
+            return None
+        
+        read_result_response = self.wait_for_urc("+QHTTPREADFILE:", timeout=timeout)
+        if(read_result_response['status_code'] != Status.OK or parse_line(read_result_response['response_line'], "+QHTTPREADFILE:")['err'] != 0):
+            logger.warning(f"Failed to save {url} to {file_name}: {read_result_response}")
+            return None
+        
+        return get_result['content_length']
+    
     #---MQTT---#
     def get_open_mqtt_sockets(self):
         
         response = self.send_comm_get_response(f'AT+QMTOPEN?')
         
         if(response['status_code'] == Status.OK):
-            pattern = re.compile(r"^\+QMTOPEN: (.*)$")
-            parsed_responses = self.parse_response_data(response['data'], pattern)
-
-            return [{'socket_id': parsed_response[0], 'hostname': parsed_response[1], 'port': int(parsed_response[2])} for parsed_response in parsed_responses]
+            return parse_lines(response['data'], "+QMTOPEN?")
         
         else:
             logger.info("Error")
@@ -1039,10 +2352,7 @@ class BG95M3:
         response = self.send_comm_get_response(f'AT+QMTOPEN?')
         
         if(response['status_code'] == Status.OK):
-            pattern = re.compile(r"^\+QMTOPEN: (.*)$")
-            parsed_responses = self.parse_response_data(response['data'], pattern)
-
-            return [parsed_response[0] for parsed_response in parsed_responses]
+            return [parsed_response['socket_id'] for parsed_response in parse_lines(response['data'], "+QMTOPEN?")]
         else:
             logger.info("Error")
             
@@ -1067,4 +2377,46 @@ class BG95M3:
         
         socket = MQTT_Socket(self, client_id, hostname, port, socket_id)
         
-        return socket
\ No newline at end of file
+        return socket
+    
+    def get_mqtt_session(self, client_id, hostname, port=8883):
+        """
+        Returns a connected MQTT socket that is kept open between measurement cycles.
+        The socket from the last cycle is reused when it's for the same broker and still connected
+        (one AT+QMTCONN? query); a new socket is only created when there's no usable one
+        """
+        session = self.mqtt_session
+        
+        if(session is not None and session.client_id == client_id and session.hostname == hostname and session.port == port):
+            if(session.ensure_connected()):
+                return session
+            
+            logger.warning("Couldn't recover MQTT session, starting a new one")
+            session.close()
+        
+        self.mqtt_session = None
+        session = self.create_mqtt_connection(client_id, hostname, port)
+        
+        if(session is None):
+            return None
+        
+        if(not session.is_open()):
+            session.open()
+        
+        if(not session.is_connected()):
+            session.connect()
+        
+        if(session.is_connected()):
+            self.mqtt_session = session
+            return session
+        
+        return None
+    
+    def end_mqtt_session(self):
+        """
+        Disconnects and closes the kept-alive MQTT socket, if there is one
+        """
+        if(self.mqtt_session is not None):
+            self.mqtt_session.disconnect()
+            self.mqtt_session.close()
+            self.mqtt_session = None
\ No newline at end of file
@@ -0,0 +1,393 @@
+"""
+asyncio flavour of the BG95M3 driver, for CircuitPython's asyncio (the bundle's asyncio package in lib/).
+
+AsyncModem drives the same BG95M3 instance, AT reader and URC queues as the blocking API. Every wait for a
+response, prompt or URC awaits between UART polls instead of sleeping, so sampling, GPS and watchdog tasks
+keep running while the modem spends a minute on +QMTOPEN or two on +QMTCONN.
+
+Commands are serialized with a lock, but blocking BG95M3 calls don't take it: keep all modem traffic in
+one task, or a blocking call can read an awaited response out from under it.
+"""
+import asyncio
+import time
+
+from at_responses import parse_first, parse_line, parse_lines
+from at_stream import Status, timeout_response
+from bg95m3 import MQTT_MAX_INLINE_PAYLOAD, MQTT_MAX_PAYLOAD, MQTT_Socket, modem_time_to_epoch
+from services.global_logger import logger
+
+class AsyncModem:
+    def __init__(self, modem):
+        self.modem = modem
+        self.reader = modem.reader
+        self.lock = asyncio.Lock()
+
+    async def wait_until(self, take, timeout=5):
+        """
+        Awaitable ATReader.wait_until: polls until take() returns something, or returns None once timeout passes
+        """
+        deadline = time.monotonic() + timeout
+
+        while True:
+            result = take()
+            if result is not None:
+                return result
+
+            if not self.reader.poll():
+                if time.monotonic() >= deadline:
+                    return None
+
+                await asyncio.sleep(self.reader.poll_interval)
+
+    async def bring_up(self, timeout=None):
+        """
+        Steps the modem's bring-up until it's up, or until timeout seconds pass. Returns True if it's up
+        """
+        start_time = time.monotonic()
+
+        while not self.modem.step_bring_up():
+            if(timeout is not None and time.monotonic() - start_time > timeout):
+                return False
+
+            await asyncio.sleep(0.05)
+
+        return True
+
+    #---BASIC COMMS---#
+    async def response(self, timeout=5):
+        """
+        Awaits the final result code of the command in flight, same shape as BG95M3.get_response
+        """
+        data = []
+        response = await self.wait_until(lambda: self.reader.take_response(data), timeout)
+
+        if(response is None):
+            self.reader.solicited = None
+            self.modem.link_state.invalidate()
+            return timeout_response()
+
+        if(response['status_code'] == Status.ERROR):
+            logger.info(f"Matched: {response['response_line']}")
+
+        return response
+
+    async def send(self, command, endline='\r', timeout=5, discard_urcs=()):
+        """
+        Sends a command and awaits its response, same shape as BG95M3.send_comm_get_response
+        """
+        async with self.lock:
+            self.modem.send_comm(command, endline, discard_urcs)
+
+            return await self.response(timeout)
+
+    async def urc(self, prefix, args=None, secondary_prefix=None, timeout=5):
+        """
+        Awaits a URC with this prefix (and arguments starting with args), including one already queued
+        """
+        response = await self.wait_until(lambda: self.reader.take_urc(prefix, args, secondary_prefix), timeout)
+
+        if(response is None):
+            return timeout_response()
+
+        if(response['status_code'] == Status.UNKNOWN):
+            logger.info(f"Matched secondary URC: {response['response_line']}")
+
+        return response
+
+    async def prompt(self, timeout=5):
+        return await self.wait_until(self.reader.take_prompt, timeout) or timeout_response()
+
+    async def query(self, command, prefix, timeout=5):
+        """
+        Sends a query and returns its first information response parsed, or None
+        """
+        response = await self.send(command, timeout=timeout)
+
+        if(response['status_code'] == Status.OK):
+            return parse_first(response['data'], prefix)
+
+    #---CONFIG---#
+    async def apply_config(self, config):
+        """
+        BG95M3.apply_config with each command awaited
+        """
+        steps = self.modem.config_steps(config)
+
+        try:
+            command = next(steps)
+
+            while True:
+                command = steps.send(await self.send(command))
+        except StopIteration as done:
+            return done.value
+
+    #---CELLULAR INFO---#
+    async def is_registered_to_network(self):
+        """
+        BG95M3.is_registered_to_network, trusting the link state cache the same way
+        """
+        self.modem.poll_urcs()
+
+        if(self.modem.link_state.trusted('registered')):
+            return True
+
+        registration = await self.query("AT+CREG?", "+CREG:")
+
+        return self.modem.link_state.record('registered', registration is not None and registration.get('stat') in [1, 5])
+
+    async def get_network_information(self):
+        return await self.query("AT+QNWINFO", "+QNWINFO:")
+
+    async def get_signal_quality(self):
+        return await self.query("AT+CSQ", "+CSQ:")
+
+    async def get_serving_signal_quality(self):
+        return await self.query("AT+QCSQ", "+QCSQ:")
+
+    async def get_network_time(self):
+        parsed_response = await self.query("AT+QLTS=1", "+QLTS:")
+
+        if(parsed_response is not None):
+            return modem_time_to_epoch(parsed_response['datetime'], is_local=False)
+
+    async def get_clock_time(self):
+        parsed_response = await self.query("AT+CCLK?", "+CCLK:")
+
+        if(parsed_response is not None):
+            return modem_time_to_epoch(parsed_response['datetime'])
+
+    #---MQTT---#
+    async def open_mqtt(self, socket):
+        response = await self.send(f'AT+QMTOPEN={socket.socket_id},"{socket.hostname}",{socket.port}', timeout=60, discard_urcs=("+QMTOPEN:",))
+
+        if(response['status_code'] != Status.OK):
+            logger.warning(f"Potentially failed to open socket: {response}")
+            self.modem.forget_config()
+            return False
+
+        open_result_response = await self.urc("+QMTOPEN:", args=f"{socket.socket_id},", timeout=60)
+        logger.info(f"Open Result Response: {open_result_response}")
+
+        if(open_result_response['status_code'] != Status.OK):
+            self.modem.forget_config()
+            return False
+
+        if(parse_line(open_result_response['response_line'], "+QMTOPEN:")['result'] != 0):
+            self.modem.forget_config()
+            return False
+
+        self.modem.mqtt_handshakes += 1
+
+        return True
+
+    async def connect_mqtt(self, socket, retries=3):
+        while retries > 0:
+            response = await self.send(f'AT+QMTCONN={socket.socket_id},"{socket.client_id}"', timeout=30, discard_urcs=("+QMTCONN:", "+QMTSTAT:"))
+
+            if(response['status_code'] == Status.OK):
+                connect_result_response = await self.urc("+QMTCONN:", args=f"{socket.socket_id},", secondary_prefix="+QMTSTAT:", timeout=120)
+                logger.info(f"Connect Result Response: {connect_result_response}")
+
+                if(connect_result_response['status_code'] == Status.OK):
+                    return parse_line(connect_result_response['response_line'], "+QMTCONN:")
+
+                logger.warning(f"Unknown connection result: {connect_result_response}")
+                return None
+
+            logger.info(f"Error connecting: {response}, retrying in 3 seconds...")
+            await asyncio.sleep(3)
+            retries = retries - 1
+
+    async def disconnect_mqtt(self, socket):
+        response = await self.send(f'AT+QMTDISC={socket.socket_id}', discard_urcs=("+QMTDISC:", "+QMTSTAT:"))
+
+        if(response['status_code'] == Status.OK):
+            disconnect_result_response = await self.urc("+QMTDISC:", args=f"{socket.socket_id},", timeout=10)
+            return disconnect_result_response['status_code'] == Status.OK
+
+        return False
+
+    async def close_mqtt(self, socket):
+        response = await self.send(f'AT+QMTCLOSE={socket.socket_id}', discard_urcs=("+QMTCLOSE:",))
+
+        if(response['status_code'] == Status.OK):
+            close_result_response = await self.urc("+QMTCLOSE:", args=f"{socket.socket_id},", timeout=30)
+            return close_result_response['status_code'] == Status.OK
+
+        return False
+
+    async def get_open_mqtt_socket_ids(self):
+        response = await self.send('AT+QMTOPEN?')
+
+        if(response['status_code'] == Status.OK):
+            return [parsed_response['socket_id'] for parsed_response in parse_lines(response['data'], "+QMTOPEN?")]
+
+    async def is_open(self, socket):
+        socket_ids = await self.get_open_mqtt_socket_ids()
+
+        return socket_ids is not None and socket.socket_id in socket_ids
+
+    async def get_mqtt_connection_state(self, socket):
+        response = await self.send('AT+QMTCONN?')
+
+        if(response['status_code'] == Status.OK):
+            for parsed_response in parse_lines(response['data'], "+QMTCONN?"):
+                if(parsed_response['socket_id'] == socket.socket_id):
+                    return parsed_response['state']
+
+            return False
+
+    async def create_mqtt_connection(self, client_id, hostname, port=8883):
+        """
+        BG95M3.create_mqtt_connection with the socket ID lookup and the SSL/MQTT config awaited
+        """
+        used_ids = await self.get_open_mqtt_socket_ids()
+
+        if(used_ids is None):
+            logger.warning("Failed to list open MQTT sockets")
+            return None
+
+        socket_id = None
+
+        for i in range(0, 6):
+            if i not in used_ids:
+                socket_id = i
+                break
+
+        if socket_id == None:
+            logger.warning(f"Failed to create new MQTT socket, no available sockets")
+            return None
+
+        socket = MQTT_Socket(self.modem, client_id, hostname, port, socket_id, configure=False)
+
+        for config in socket.desired_configs():
+            await self.apply_config(config)
+
+        return socket
+
+    async def get_mqtt_session(self, client_id, hostname, port=8883):
+        """
+        BG95M3.get_mqtt_session with every command awaited. Returns None if the socket doesn't open or connect
+        """
+        session = self.modem.mqtt_session
+
+        if(session is not None and session.client_id == client_id and session.hostname == hostname and session.port == port):
+            if(await self.get_mqtt_connection_state(session) == 3):
+                logger.info("Reusing MQTT session")
+                return session
+
+            logger.warning("MQTT session dropped, reconnecting")
+        else:
+            self.modem.mqtt_session = None
+            session = await self.create_mqtt_connection(client_id, hostname, port)
+
+            if(session is None):
+                return None
+
+        if(not await self.is_open(session) and not await self.open_mqtt(session)):
+            logger.warning("Failed to open the MQTT socket")
+            self.modem.mqtt_session = None
+            return None
+
+        if(await self.connect_mqtt(session) is not None and await self.get_mqtt_connection_state(session) == 3):
+            self.modem.mqtt_session = session
+            return session
+
+        self.modem.mqtt_session = None
+        return None
+
+    async def end_mqtt_session(self):
+        session = self.modem.mqtt_session
+
+        if(session is not None):
+            self.modem.mqtt_session = None
+
+            if(not await self.disconnect_mqtt(session) or await self.is_open(session)):
+                await self.close_mqtt(session)
+
+    async def send_publish(self, socket, msg_id, topic, msg, qos, retain):
+        """
+        MQTT_Socket.send_publish, awaiting the > prompt and the response
+        """
+        if(isinstance(msg, str) and '"' not in msg and len(msg) <= MQTT_MAX_INLINE_PAYLOAD):
+            return await self.send(f'AT+QMTPUBEX={socket.socket_id},{msg_id},{qos},{retain},"{topic}","{msg}"')
+
+        if(isinstance(msg, str)):
+            msg = msg.encode('utf-8')
+
+        if(len(msg) > MQTT_MAX_PAYLOAD):
+            logger.warning(f"Payload of {len(msg)} bytes is over the {MQTT_MAX_PAYLOAD} byte limit")
+            return {"status": "ERROR", "status_code": Status.ERROR, "data": [], "response_line": ""}
+
+        async with self.lock:
+            self.modem.send_comm(f'AT+QMTPUBEX={socket.socket_id},{msg_id},{qos},{retain},"{topic}",{len(msg)}')
+            prompt = await self.prompt()
+
+            if(prompt['status_code'] != Status.OK):
+                logger.warning(f"Modem didn't prompt for publish data: {prompt}")
+                return prompt
+
+            self.modem.send_data(msg)
+
+            return await self.response()
+
+    async def publish_many(self, socket, messages, qos=1, retain=0, window=4, timeout=10):
+        """
+        MQTT_Socket.publish_many with every wait awaited. Returns the same per-message results
+        """
+        results = []
+        socket.in_flight = {}
+
+        for topic, msg in messages:
+            while len(socket.in_flight) >= window:
+                await self.collect_publish_ack(socket)
+
+            msg_id = socket.allocate_msg_id() if qos > 0 else 0
+            result = {'topic': topic, 'msgID': msg_id, 'result': None, 'packet_retries': 0}
+            results.append(result)
+
+            response = await self.send_publish(socket, msg_id, topic, msg, qos, retain)
+
+            if(response['status_code'] == Status.OK):
+                if(qos > 0):
+                    socket.in_flight[msg_id] = (result, time.monotonic() + timeout)
+                else:
+                    result['result'] = 0
+            else:
+                logger.warning(f"Failed to send publish command for msgID {msg_id}: {response}")
+
+        while socket.in_flight:
+            await self.collect_publish_ack(socket)
+
+        delivered = len([result for result in results if result['result'] == 0])
+        logger.info(f"Delivered {delivered}/{len(results)} messages")
+
+        return results
+
+    async def collect_publish_ack(self, socket):
+        oldest_id = min(socket.in_flight, key=lambda msg_id: socket.in_flight[msg_id][1])
+        deadline = socket.in_flight[oldest_id][1]
+
+        ack = await self.urc("+QMTPUB:", args=f"{socket.socket_id},", timeout=max(0, deadline - time.monotonic()))
+
+        if(ack['status_code'] != Status.OK):
+            logger.warning(f"Timed out waiting for ack of msgID {oldest_id}")
+            del socket.in_flight[oldest_id]
+            return
+
+        parsed_ack = parse_line(ack['response_line'], "+QMTPUB:")
+        pending = socket.in_flight.get(parsed_ack['msgID'])
+
+        if(pending is None):
+            logger.info(f"Ignoring ack for unknown msgID: {ack['response_line']}")
+            return
+
+        result = pending[0]
+        result['result'] = parsed_ack['result']
+
+        if(parsed_ack.get('packet_retries') is not None):
+            result['packet_retries'] = parsed_ack['packet_retries']
+
+        #1 means the modem is still retransmitting, the final ack follows
+        if(parsed_ack['result'] != 1):
+            del socket.in_flight[parsed_ack['msgID']]
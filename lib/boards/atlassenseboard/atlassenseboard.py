@@ -2,12 +2,112 @@ import atlas_ezo_do
 import atlas_ezo_ec
 import atlas_ezo_rtd
 import gc
+import time
 
 from reading import Reading
 from services.global_logger import logger
 from services.device_manager import I2CDevice, manager
 
-class EZOEC(I2CDevice):
+# ---- EZO I2C response codes ---- #
+EZO_SUCCESS = 1
+EZO_SYNTAX_ERROR = 2
+EZO_PENDING = 254
+EZO_NO_DATA = 255
+
+EZO_READ_DELAY = 0.6       # seconds an R conversion takes, per the EZO datasheets
+EZO_RESPONSE_SIZE = 40     # status byte, then up to "EC,TDS,S,SG" in ASCII and a null
+
+class EZOCircuit(I2CDevice):
+    """
+    An Atlas EZO circuit that can be read in two phases, so several can convert at once:
+    start_reading() sends R and returns straight away, and collect_reading() returns the readings
+    once the circuit has finished (None while it's still converting). Subclasses name the reading
+    R's first output is kept as.
+    """
+    read_delay = EZO_READ_DELAY
+    reading_key = None
+    reading_unit = None
+    reading_description = None
+    
+    def __init__(self, i2c_bus, address, description):
+        super().__init__(i2c_bus, address, description)
+        self.conversion_started = None
+        self.response = bytearray(EZO_RESPONSE_SIZE)
+    
+    def start_reading(self):
+        """
+        Starts a conversion. Returns False if the circuit couldn't be asked
+        """
+        if(not self.enabled):
+            return False
+        
+        try:
+            with self.base_device.i2c_device as i2c:
+                i2c.write(b"R")
+            
+            self.conversion_started = time.monotonic()
+            return True
+        
+        except Exception as e:
+            logger.warning(f"Failed to start a reading on {self.description}: {e}")
+            self.conversion_started = None
+            self.update_device_status()
+            return False
+    
+    def collect_reading(self):
+        """
+        Returns the readings from the conversion started last, None while it's still running,
+        or {} if it failed
+        """
+        if(self.conversion_started is None):
+            return {}
+        
+        if(time.monotonic() - self.conversion_started < self.read_delay):
+            return None
+        
+        try:
+            with self.base_device.i2c_device as i2c:
+                i2c.readinto(self.response)
+        
+        except Exception as e:
+            logger.warning(f"Failed to collect a reading from {self.description}: {e}")
+            self.conversion_started = None
+            self.update_device_status()
+            return {}
+        
+        code = self.response[0]
+        
+        if(code == EZO_PENDING):
+            return None
+        
+        self.conversion_started = None
+        
+        if(code != EZO_SUCCESS):
+            logger.warning(f"{self.description} answered R with code {code}")
+            return {}
+        
+        text = bytes(self.response[1:]).split(b"\x00")[0].decode("ascii")
+        
+        try:
+            values = [float(value) for value in text.split(",")]
+        except ValueError:
+            logger.warning(f"Unexpected reading from {self.description}: {text}")
+            return {}
+        
+        #The first output is the one read() reports, as it is by default
+        return {self.reading_key: Reading(values[0], self.reading_unit, self.reading_description)}
+    
+    def cancel_reading(self):
+        """
+        Gives up on the conversion started last, so the next collect_reading() doesn't pick it up
+        """
+        self.conversion_started = None
+
+class EZOEC(EZOCircuit):
+    reading_key = 'EC'
+    reading_unit = "uS/cm"
+    reading_description = "Salinity"
+    
     def __init__(self, i2c_bus, address=100):
         super().__init__(i2c_bus, address, description="conductivity")
 
@@ -74,7 +174,11 @@ class EZOEC(I2CDevice):
             logger.warning(f"Device is disabled")
             return {}
         
-class EZODO(I2CDevice):
+class EZODO(EZOCircuit):
+    reading_key = 'MGL'
+    reading_unit = "mg/l"
+    reading_description = "Dissolved Oxygen"
+    
     def __init__(self, i2c_bus, address=97):
         super().__init__(i2c_bus, address, description="Dissolved Oxygen")
 
@@ -121,7 +225,11 @@ class EZODO(I2CDevice):
             logger.warning(f"Device is disabled")
             return {}
 
-class EZORTD(I2CDevice):
+class EZORTD(EZOCircuit):
+    reading_key = 'T'
+    reading_unit = "C"
+    reading_description = "Sea Temperature"
+    
     def __init__(self, i2c_bus, address=102):
         super().__init__(i2c_bus, address, description="Sea Temperature")
 
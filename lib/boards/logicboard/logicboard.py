@@ -1,10 +1,12 @@
 import adafruit_ds3231
 from bg95m3 import BG95M3
+from at_transcript import TranscriptRecorder
 from adafruit_sdcard import SDCard
 import board
 from busio import SPI, I2C, UART
 from digitalio import DigitalInOut, Direction
 from microcontroller import cpu
+from os import getenv
 import rtc
 from storage import VfsFat, mount
 import gc
@@ -138,9 +140,17 @@ class LogicBoard():
         
         # Initialize Cellular Modem
         logger.info("Initializing Cellular Modem")
+        
+        # Record the modem UART for replay on a host, see host/replay_uart.py
+        if(getenv("AT_TRANSCRIPT_PATH") and self.uart_bus is not None):
+            logger.info(f"Recording AT transcript to {getenv('AT_TRANSCRIPT_PATH')}")
+            self.uart_bus = TranscriptRecorder(self.uart_bus, getenv("AT_TRANSCRIPT_PATH"))
+        
         try:
-            self.CellularModem = BG95M3(self.uart_bus)
-            logger.info("Successfully initialized Cellular Modem")
+            #Power it on now and let it boot while the other boards initialize, code.py steps the rest of bring-up
+            self.CellularModem = BG95M3(self.uart_bus, blocking=False)
+            self.CellularModem.step_bring_up()
+            logger.info("Successfully started Cellular Modem")
         except Exception as e:
             logger.info(f"Failed to initialize Cellular Modem: {e}")
             
@@ -0,0 +1,213 @@
+import struct
+from json import dumps, loads
+from reading import Reading, iso8601_to_epoch, struct_time_to_iso8601
+from services.global_logger import logger
+import time
+
+# ---- Record layout ---- #
+# Every record is a header, <channel id: u8><seconds since the previous record: u8>, then the channel's
+# fixed-width values, little-endian. Two channel ids are reserved:
+#   TIME_CHANNEL  sets the clock: <u32 seconds since the epoch>, its own delta is always 0
+#   JSON_CHANNEL  a reading with no channel: <u16 length><that many bytes of {"value","unit","description"} JSON>
+HEADER = "<BB"
+HEADER_SIZE = 2
+TIME_CHANNEL = 0
+JSON_CHANNEL = 255
+MAX_DELTA = 255
+
+# Stored in place of a missing (None) value. Floats use NaN
+MISSING = {"b": -128, "B": 255, "h": -32768, "H": 65535, "i": -2147483648, "I": 4294967295}
+
+class Channel:
+    """
+    One sensor channel: a reading's description and unit, pinned to a small integer id and a fixed value layout.
+    Integer layouts store round(value * scale)
+    """
+
+    def __init__(self, id, description, unit, layout, scale=1):
+        self.id = id
+        self.description = description
+        self.unit = unit
+        self.layout = layout
+        self.scale = scale
+        self.format = "<" + layout
+        self.size = struct.calcsize(self.format)
+        self.is_float = layout[0] in "fd"
+
+    def pack(self, value):
+        values = value if len(self.layout) > 1 else (value,)
+
+        if(len(values) != len(self.layout)):
+            raise ValueError(f"{self.description} takes {len(self.layout)} values, got {len(values)}")
+
+        if(self.is_float):
+            return struct.pack(self.format, *(float("nan") if v is None else v for v in values))
+
+        missing = MISSING[self.layout[0]]
+        return struct.pack(self.format, *(missing if v is None else round(v * self.scale) for v in values))
+
+    def unpack(self, data):
+        values = struct.unpack(self.format, data)
+
+        if(self.is_float):
+            values = tuple(None if v != v else v for v in values)
+        else:
+            missing = MISSING[self.layout[0]]
+            values = tuple(None if v == missing else (v / self.scale if self.scale != 1 else v) for v in values)
+
+        return values if len(values) > 1 else values[0]
+
+# Ids are permanent: add new channels at the end and never reuse or renumber one,
+# or data already on SD cards and in the cloud will decode as the wrong sensor
+CHANNELS = (
+    Channel(1, "Ambient Pressure", "hPa", "f"),
+    Channel(2, "Ambient Temperature", "C", "f"),
+    Channel(3, "Acceleration Vector", "m/s^2", "fff"),
+    Channel(4, "Angular Velocity", "rad/s", "fff"),
+    Channel(5, "Magnetic Field Vector", "uT", "fff"),
+    Channel(6, "IMU Temperature", "C", "f"),
+    Channel(7, "Location", "degrees", "ii", 10000000),
+    Channel(8, "Altitude", "meters", "f"),
+    Channel(9, "Horizontal Dilution of Precision", "-", "f"),
+    Channel(10, "Satellites in View", "-", "B"),
+    Channel(11, "Fix Quality", "-", "B"),
+    Channel(12, "CPU Temperature", "C", "f"),
+    Channel(13, "Salinity", "uS/cm", "f"),
+    Channel(14, "Salinity", "tds", "f"),
+    Channel(15, "Salinity", "S", "f"),
+    Channel(16, "Salinity", "SG", "f"),
+    Channel(17, "Dissolved Oxygen", "mg/l", "f"),
+    Channel(18, "Dissolved Oxygen", "%", "f"),
+    Channel(19, "Sea Temperature", "C", "f"),
+    Channel(20, "GNSS Location", "degrees", "ii", 10000000),
+    Channel(21, "GNSS Last Known Location", "degrees", "ii", 10000000),
+    Channel(22, "GNSS Altitude", "meters", "f"),
+    Channel(23, "GNSS Horizontal Dilution of Precision", "-", "f"),
+    Channel(24, "GNSS Satellites Used", "-", "B"),
+    Channel(25, "GNSS Time To First Fix", "s", "f"),
+    Channel(26, "Clock Offset", "s", "f"),
+    Channel(27, "Time To Registration", "s", "f"),
+    Channel(28, "Signal RSRP", "dBm", "h"),
+    Channel(29, "Signal RSRQ", "dB", "h"),
+    Channel(30, "Signal CSQ", "-", "B"),
+    Channel(31, "Transmit Time Per KB", "s/KB", "f"),
+    Channel(32, "Transmit Energy Per KB", "J/KB", "f"),
+    Channel(33, "Queue Depth", "B", "I"),
+    Channel(34, "Queue Drain Rate", "B/s", "f"),
+    Channel(35, "Sample Jitter", "ms", "ff"),
+    Channel(36, "Sample Overruns", "-", "I"),
+)
+
+CHANNELS_BY_ID = {channel.id: channel for channel in CHANNELS}
+CHANNELS_BY_KEY = {(channel.description, channel.unit): channel for channel in CHANNELS}
+
+def channel_for(reading):
+    return CHANNELS_BY_KEY.get((reading.description, reading.unit))
+
+class RecordWriter:
+    """
+    Encodes Readings as channel records, to a file or as bytes.
+
+    The first record out of a writer is a TIME_CHANNEL record, and another is written whenever the next
+    reading is more than MAX_DELTA seconds after the last one (or before it), so any stream that starts
+    at a writer's first record decodes on its own. A float reading is 6 bytes, against ~90 as a JSON line.
+    """
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.last_time = None
+
+    def time_record(self, seconds):
+        self.last_time = seconds
+
+        return struct.pack("<BBI", TIME_CHANNEL, 0, seconds)
+
+    def encode(self, reading):
+        """
+        Returns the bytes for one reading, led by a time record if its delta doesn't fit
+        """
+        seconds = iso8601_to_epoch(reading.datetime)
+        prefix = b""
+
+        if(self.last_time is None or not 0 <= seconds - self.last_time <= MAX_DELTA):
+            prefix = self.time_record(seconds)
+
+        delta = seconds - self.last_time
+        self.last_time = seconds
+
+        channel = channel_for(reading)
+
+        if(channel is not None):
+            try:
+                return prefix + struct.pack(HEADER, channel.id, delta) + channel.pack(reading.value)
+            except (TypeError, ValueError, OverflowError, struct.error) as e:
+                logger.warning(f"{reading.description} ({reading.value}) doesn't fit channel {channel.id}, storing it as JSON: {e}")
+
+        data = dumps({'value': reading.value, 'unit': reading.unit, 'description': reading.description}).encode("utf-8")
+
+        return prefix + struct.pack("<BBH", JSON_CHANNEL, delta, len(data)) + data
+
+    def write(self, reading):
+        """
+        Writes one reading to the stream. Returns the bytes written
+        """
+        record = self.encode(reading)
+        self.stream.write(record)
+
+        return len(record)
+
+def read_exactly(stream, size):
+    data = stream.read(size)
+
+    return data if data is not None and len(data) == size else None
+
+def read_records(stream):
+    """
+    Yields a Reading for every record in a binary stream (a sample file, or an io.BytesIO of a payload),
+    stopping at the end or at a record cut short
+    """
+    last_time = None
+
+    while True:
+        header = read_exactly(stream, HEADER_SIZE)
+        if header is None:
+            return
+
+        channel_id, delta = struct.unpack(HEADER, header)
+
+        if(channel_id == TIME_CHANNEL):
+            data = read_exactly(stream, 4)
+            if data is None:
+                break
+
+            last_time = struct.unpack("<I", data)[0]
+            continue
+
+        if(last_time is None):
+            raise ValueError("Record stream doesn't start with a time record")
+
+        last_time += delta
+
+        if(channel_id == JSON_CHANNEL):
+            data = read_exactly(stream, 2)
+            data = read_exactly(stream, struct.unpack("<H", data)[0]) if data is not None else None
+            if data is None:
+                break
+
+            fields = loads(data)
+            reading = Reading(fields['value'], fields['unit'], fields['description'])
+        else:
+            channel = CHANNELS_BY_ID.get(channel_id)
+            if channel is None:
+                raise ValueError(f"Unknown channel {channel_id}, the registry is older than the data")
+
+            data = read_exactly(stream, channel.size)
+            if data is None:
+                break
+
+            reading = Reading(channel.unpack(data), channel.unit, channel.description)
+
+        reading.datetime = struct_time_to_iso8601(time.localtime(last_time))
+        yield reading
+
+    logger.warning("Record stream ends partway through a record")
@@ -10,6 +10,7 @@ logger.addHandler(logging.StreamHandler(sys.stdout))
 logger.setLevel(logging.DEBUG)
 
 modem = boards.logicboard.CellularModem
+modem.wait_until_up()
 
 while True:
     print(modem.get_signal_quality())
@@ -9,6 +9,7 @@ logger.addHandler(logging.StreamHandler(sys.stdout))
 logger.setLevel(logging.DEBUG)
 
 modem = boards.logicboard.CellularModem
+modem.wait_until_up()
 
 ssl_context = bg95m3.SSL_Context(modem)
 
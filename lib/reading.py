@@ -6,6 +6,13 @@ def struct_time_to_iso8601(struct_time):
     # Format to ISO8601 using f-string
     return f"{year:04d}-{month:02d}-{day:02d}T{hour:02d}:{minute:02d}:{second:02d}"
 
+def iso8601_to_epoch(text):
+    # Inverse of struct_time_to_iso8601 on a time.localtime() struct_time
+    year, month, day = int(text[0:4]), int(text[5:7]), int(text[8:10])
+    hour, minute, second = int(text[11:13]), int(text[14:16]), int(text[17:19])
+
+    return int(time.mktime((year, month, day, hour, minute, second, 0, -1, -1)))
+
 class Reading:
     def __init__(self, value, unit, description):
         self.value = value
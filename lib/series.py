@@ -0,0 +1,342 @@
+from io import BytesIO
+import struct
+from channels import CHANNELS_BY_ID, RecordWriter, channel_for, read_records
+from reading import Reading, iso8601_to_epoch, struct_time_to_iso8601
+from services.global_logger import logger
+import time
+
+# ---- Block layout ---- #
+# A block packs a window of readings one channel at a time:
+#   <marker u8><version u8><length u16, bytes after these four><series count u8>
+#   per series: <channel id u8><count u16><first time u32><bit stream length u16><bit stream>
+#   then a channel record stream (lib/channels.py) of the readings no series could take
+# Each bit stream holds the first sample's values in full, then for every later sample the
+# delta-of-delta of its time and, per value, the XOR of a float's bits or the delta of an integer
+# with the one before it (as in Facebook's Gorilla), so a value that barely changes costs a few bits.
+SERIES_MARKER = 0x53
+SERIES_VERSION = 1
+BLOCK_HEADER = "<BBHB"
+BLOCK_HEADER_SIZE = 5
+BLOCK_PREFIX_SIZE = 4
+SERIES_HEADER = "<BHIH"
+SERIES_HEADER_SIZE = 9
+MAX_BODY = 65535
+MAX_BLOCK = MAX_BODY + BLOCK_PREFIX_SIZE
+MAX_SERIES = 65535
+
+# (prefix, prefix bits, value bits) buckets for zig-zagged time delta-of-deltas and integer deltas.
+# Zero is a single 0 bit
+TIME_BUCKETS = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12), (0b1111, 4, 32))
+INT_BUCKETS = ((0b10, 2, 4), (0b110, 3, 8), (0b1110, 4, 16), (0b1111, 4, 64))
+
+class BitWriter:
+    def __init__(self):
+        self.data = bytearray()
+        self.value = 0
+        self.bits = 0
+
+    def write(self, value, bits):
+        self.value = (self.value << bits) | value
+        self.bits += bits
+
+        while self.bits >= 8:
+            self.bits -= 8
+            self.data.append((self.value >> self.bits) & 0xFF)
+
+        self.value &= (1 << self.bits) - 1
+
+    def getvalue(self):
+        if self.bits:
+            return bytes(self.data) + bytes([(self.value << (8 - self.bits)) & 0xFF])
+
+        return bytes(self.data)
+
+class BitReader:
+    def __init__(self, data):
+        self.data = data
+        self.position = 0       # in bits
+
+    def read(self, bits):
+        value = 0
+
+        while bits > 0:
+            byte = self.data[self.position >> 3]
+            available = 8 - (self.position & 7)
+            take = min(available, bits)
+            value = (value << take) | ((byte >> (available - take)) & ((1 << take) - 1))
+            self.position += take
+            bits -= take
+
+        return value
+
+def zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+def unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+def write_bucketed(writer, value, buckets):
+    if(value == 0):
+        writer.write(0, 1)
+        return
+
+    value = zigzag(value)
+
+    for prefix, prefix_bits, bits in buckets:
+        if(value < 1 << bits):
+            writer.write(prefix, prefix_bits)
+            writer.write(value, bits)
+            return
+
+    raise ValueError(f"{value} doesn't fit the widest bucket")
+
+def read_bucketed(reader, buckets):
+    if(not reader.read(1)):
+        return 0
+
+    last = len(buckets) - 1
+
+    for index, (prefix, prefix_bits, bits) in enumerate(buckets):
+        if(index == last or not reader.read(1)):
+            return unzigzag(reader.read(bits))
+
+def leading_zeros(value):
+    return 32 - len(bin(value)) + 2 if value else 32
+
+def trailing_zeros(value):
+    return len(bin(value & -value)) - 3 if value else 32
+
+class ValueCodec:
+    """
+    The words of one channel value: the bits of a float32, or the integer the channel stores, as
+    unpacked from Channel.pack() so decoding gives back the channel record's bytes exactly
+    """
+
+    def __init__(self, code):
+        self.is_float = code in "fd"
+        self.code = "I" if self.is_float else code
+        self.bits = struct.calcsize(self.code) * 8
+        self.signed = self.code in "bhiq"
+
+    def write_first(self, writer, word):
+        writer.write(word & ((1 << self.bits) - 1), self.bits)
+
+    def read_first(self, reader):
+        word = reader.read(self.bits)
+
+        if(self.signed and word >= 1 << (self.bits - 1)):
+            word -= 1 << self.bits
+
+        return word
+
+    def write_next(self, writer, word, previous, window):
+        if(not self.is_float):
+            write_bucketed(writer, word - previous, INT_BUCKETS)
+            return window
+
+        xor = word ^ previous
+        if(xor == 0):
+            writer.write(0, 1)
+            return window
+
+        leading, trailing = min(leading_zeros(xor), 31), trailing_zeros(xor)
+        writer.write(1, 1)
+
+        #Reuse the last window of meaningful bits if these fit in it
+        if(window is not None and leading >= window[0] and trailing >= window[1]):
+            writer.write(0, 1)
+            writer.write(xor >> window[1], 32 - window[0] - window[1])
+            return window
+
+        length = 32 - leading - trailing
+        writer.write(1, 1)
+        writer.write(leading, 5)
+        writer.write(length - 1, 5)
+        writer.write(xor >> trailing, length)
+
+        return (leading, trailing)
+
+    def read_next(self, reader, previous, window):
+        if(not self.is_float):
+            return previous + read_bucketed(reader, INT_BUCKETS), window
+
+        if(not reader.read(1)):
+            return previous, window
+
+        if(reader.read(1)):
+            leading = reader.read(5)
+            length = reader.read(5) + 1
+            window = (leading, 32 - leading - length)
+
+        meaningful = 32 - window[0] - window[1]
+
+        return previous ^ (reader.read(meaningful) << window[1]), window
+
+def codecs_for(channel):
+    return [ValueCodec(code) for code in channel.layout]
+
+def words_for(channel, value):
+    data = channel.pack(value)
+
+    return struct.unpack("<" + "".join(codec.code for codec in codecs_for(channel)), data)
+
+def encode_series(channel, samples):
+    """
+    Returns the bit stream for one channel's [(seconds, words)] samples
+    """
+    writer = BitWriter()
+    codecs = codecs_for(channel)
+    windows = [None] * len(codecs)
+    previous_time, previous_delta, previous_words = samples[0][0], 0, samples[0][1]
+
+    for codec, word in zip(codecs, previous_words):
+        codec.write_first(writer, word)
+
+    for seconds, words in samples[1:]:
+        delta = seconds - previous_time
+        write_bucketed(writer, delta - previous_delta, TIME_BUCKETS)
+        previous_time, previous_delta = seconds, delta
+
+        for index, codec in enumerate(codecs):
+            windows[index] = codec.write_next(writer, words[index], previous_words[index], windows[index])
+
+        previous_words = words
+
+    return writer.getvalue()
+
+def decode_series(channel, count, first_time, data):
+    """
+    Yields a Reading for each sample in one channel's bit stream
+    """
+    reader = BitReader(data)
+    codecs = codecs_for(channel)
+    windows = [None] * len(codecs)
+    value_format = "<" + "".join(codec.code for codec in codecs)
+
+    seconds, delta = first_time, 0
+    words = [codec.read_first(reader) for codec in codecs]
+
+    for index in range(count):
+        if(index > 0):
+            delta += read_bucketed(reader, TIME_BUCKETS)
+            seconds += delta
+
+            for component, codec in enumerate(codecs):
+                words[component], windows[component] = codec.read_next(reader, words[component], windows[component])
+
+        reading = Reading(channel.unpack(struct.pack(value_format, *words)), channel.unit, channel.description)
+        reading.datetime = struct_time_to_iso8601(time.localtime(seconds))
+        yield reading
+
+def encode_block(readings):
+    """
+    Returns one block holding every reading, each channel's readings kept in the order given.
+    Raises OverflowError if they don't fit in one
+    """
+    series = {}         # channel id -> [(seconds, words)], in order of first appearance
+    leftovers = RecordWriter()
+    rest = bytearray()
+
+    for reading in readings:
+        channel = channel_for(reading)
+        samples = series.get(channel.id) if channel is not None else None
+
+        try:
+            if(channel is None or (samples is not None and len(samples) >= MAX_SERIES)):
+                raise ValueError("no series for this reading")
+
+            words = words_for(channel, reading.value)
+            seconds = iso8601_to_epoch(reading.datetime)
+        except (TypeError, ValueError, OverflowError, struct.error):
+            rest.extend(leftovers.encode(reading))
+            continue
+
+        if(samples is None):
+            samples = series[channel.id] = []
+        samples.append((seconds, words))
+
+    body = bytearray(struct.pack("<B", len(series)))
+
+    for channel_id, samples in series.items():
+        stream = encode_series(CHANNELS_BY_ID[channel_id], samples)
+        if(len(stream) > MAX_BODY):
+            raise OverflowError(f"{len(samples)} samples of channel {channel_id} are too many for one block")
+
+        body.extend(struct.pack(SERIES_HEADER, channel_id, len(samples), samples[0][0], len(stream)))
+        body.extend(stream)
+
+    body.extend(rest)
+
+    if(len(body) > MAX_BODY):
+        raise OverflowError(f"{len(body)} bytes is over the {MAX_BODY} byte block limit")
+
+    return struct.pack("<BBH", SERIES_MARKER, SERIES_VERSION, len(body)) + bytes(body)
+
+def decode_block(data):
+    """
+    Returns the readings in one block, channel by channel and then any the series couldn't take
+    """
+    marker, version, length, count = struct.unpack(BLOCK_HEADER, data[:BLOCK_HEADER_SIZE])
+    if(marker != SERIES_MARKER or version != SERIES_VERSION):
+        raise ValueError(f"Not a version {SERIES_VERSION} series block")
+
+    readings = []
+    position = BLOCK_HEADER_SIZE
+    end = BLOCK_PREFIX_SIZE + length
+
+    for _ in range(count):
+        channel_id, samples, first_time, size = struct.unpack(SERIES_HEADER, data[position:position + SERIES_HEADER_SIZE])
+        position += SERIES_HEADER_SIZE
+
+        channel = CHANNELS_BY_ID.get(channel_id)
+        if channel is None:
+            raise ValueError(f"Unknown channel {channel_id}, the registry is older than the data")
+
+        readings.extend(decode_series(channel, samples, first_time, data[position:position + size]))
+        position += size
+
+    if(position < end):
+        readings.extend(read_records(BytesIO(data[position:end])))
+
+    return readings
+
+def encode_blocks(readings, max_size=MAX_BLOCK):
+    """
+    Yields blocks of at most max_size bytes covering every reading, splitting the window in half
+    until each block fits
+    """
+    readings = list(readings)
+
+    try:
+        block = encode_block(readings)
+    except OverflowError:
+        block = None
+
+    if(block is not None and (len(block) <= max_size or len(readings) <= 1)):
+        if(len(block) > max_size):
+            logger.warning(f"Reading still {len(block)} bytes as a series block, over the {max_size} byte limit")
+        yield block
+        return
+
+    half = len(readings) // 2
+    yield from encode_blocks(readings[:half], max_size)
+    yield from encode_blocks(readings[half:], max_size)
+
+def read_blocks(stream):
+    """
+    Yields a Reading for every reading in a stream of blocks (a sample queue segment), stopping at the end
+    or at a block cut short
+    """
+    while True:
+        header = stream.read(BLOCK_PREFIX_SIZE)
+        if not header or len(header) < BLOCK_PREFIX_SIZE:
+            return
+
+        length = struct.unpack("<H", header[2:4])[0]
+        body = stream.read(length)
+
+        if body is None or len(body) < length:
+            logger.warning("Series stream ends partway through a block")
+            return
+
+        yield from decode_block(header + body)
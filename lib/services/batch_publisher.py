@@ -0,0 +1,226 @@
+from json import loads
+from channels import RecordWriter
+from series import encode_blocks
+from services.global_logger import logger
+
+try:
+    from io import BytesIO
+    from deflate import DeflateIO, ZLIB
+except ImportError:
+    DeflateIO = None
+
+try:
+    from zlib import compress as zlib_compress
+except ImportError:
+    zlib_compress = None
+
+# ---- Grouping ---- #
+GROUP_CYCLE = 0          # every reading in the cycle shares one topic
+GROUP_DESCRIPTION = 1    # one topic per reading description, as per-line publishing did
+
+# ---- Compression ---- #
+COMPRESSED_SUFFIX = "/zlib"     # compressed batches go to <topic>/zlib
+COMPRESS_WBITS = 11             # 2 KB deflate window, enough to reach back over several readings
+MAX_RATIO = 8                   # never pack more than this many times max_payload before compressing
+
+# ---- Channel records ---- #
+RECORDS_SUFFIX = "/records"     # channel record batches (lib/channels.py) go to <topic>/records
+SERIES_SUFFIX = "/series"       # per-channel series blocks (lib/series.py) go to <topic>/series
+
+def compress(data):
+    """
+    Returns data as a zlib stream, or None if this firmware has no way to compress
+    """
+    if DeflateIO is not None:
+        stream = BytesIO()
+        compressor = DeflateIO(stream, ZLIB, COMPRESS_WBITS)
+        compressor.write(data)
+        compressor.close()
+        return stream.getvalue()
+
+    if zlib_compress is not None:
+        return zlib_compress(data)
+
+    return None
+
+def packet_size(topic, payload_size):
+    """
+    Size of the MQTT PUBLISH packet (QoS 1) carrying a payload, before TLS
+    """
+    remaining = 2 + len(topic) + 2 + payload_size
+    length_bytes = 1
+
+    while remaining >= 128 ** length_bytes:
+        length_bytes += 1
+
+    return 1 + length_bytes + remaining
+
+class BatchPublisher:
+    """
+    Packs JSON sample lines into as few MQTT messages as the modem's payload limit allows.
+
+    Each message is a JSON array of readings. Lines are joined as-is rather than re-serialized,
+    a batch is closed as soon as the next reading wouldn't fit in max_payload bytes, and the
+    topic is picked from the grouping: XBX/<device>/samples for a whole cycle, or
+    XBX/<device>/<description> per description.
+
+    With compress=True each array is sent zlib-compressed, as one binary message on <topic>/zlib
+    (host/decode_batch.py reads them back). Batches are packed up to the raw size the last
+    compression ratio says will fit, and split in two if the compressed result still doesn't.
+
+    record_batches() does the same for Readings packed as channel records (lib/channels.py), on
+    <topic>/records. Each message starts with its own time record, so it decodes on its own.
+    series_batches() packs them as per-channel series blocks (lib/series.py) on <topic>/series.
+    """
+
+    def __init__(self, base_topic, max_payload, group=GROUP_CYCLE, cycle_topic="samples", compress=False):
+        self.base_topic = base_topic
+        self.max_payload = max_payload
+        self.group = group
+        self.cycle_topic = cycle_topic
+        self.compress = compress
+
+        if(compress and DeflateIO is None and zlib_compress is None):
+            logger.warning("This firmware can't compress, sending batches uncompressed")
+            self.compress = False
+
+        #Raw bytes packed per batch, adjusted to the compression ratio seen so far
+        self.batch_limit = max_payload * 3 if self.compress else max_payload
+
+        self.readings_packed = 0
+        self.messages_built = 0
+        self.raw_bytes = 0          # JSON bytes packed
+        self.bytes_built = 0        # payload bytes built, after compression
+        self.bytes_on_air = 0       # MQTT PUBLISH packet bytes, before TLS
+
+    @property
+    def compression_ratio(self):
+        return self.raw_bytes / self.bytes_built if self.bytes_built else 1
+
+    def topic_for(self, line):
+        if(self.group == GROUP_DESCRIPTION):
+            return f"{self.base_topic}/{loads(line)['description']}"
+
+        return f"{self.base_topic}/{self.cycle_topic}"
+
+    def finish(self, topic, payload, size):
+        self.messages_built += 1
+        self.bytes_built += size
+        self.bytes_on_air += packet_size(topic, size)
+
+        return (topic, payload)
+
+    def build(self, topic, lines, size):
+        """
+        Yields the message(s) for one batch: one, unless compressing left it over max_payload
+        """
+        if(not self.compress):
+            self.raw_bytes += size
+            yield self.finish(topic, f"[{','.join(lines)}]", size)
+            return
+
+        payload = compress(f"[{','.join(lines)}]".encode("utf-8"))
+
+        if(len(payload) > self.max_payload and len(lines) > 1):
+            self.batch_limit = max(self.max_payload, self.batch_limit * 3 // 4)
+
+            half = len(lines) // 2
+            for part in (lines[:half], lines[half:]):
+                yield from self.build(topic, part, 2 + sum(len(line.encode("utf-8")) for line in part) + len(part) - 1)
+            return
+
+        if(len(payload) > self.max_payload):
+            logger.warning(f"Reading still {len(payload)} bytes compressed, over the {self.max_payload} byte payload limit")
+
+        self.raw_bytes += size
+
+        #Aim the next batch at 90% of max_payload once compressed
+        ratio = size / len(payload)
+        self.batch_limit = min(self.max_payload * MAX_RATIO, max(self.max_payload, int(self.max_payload * 0.9 * ratio)))
+
+        yield self.finish(topic + COMPRESSED_SUFFIX, payload, len(payload))
+
+    def batches(self, lines):
+        """
+        Yields (topic, payload) pairs covering every non-empty line, in order within each topic
+        """
+        pending = {}            #topic -> ([lines], payload size so far)
+
+        for line in lines:
+            line = line.strip()
+            if not line:
+                continue
+
+            topic = self.topic_for(line)
+            batch, size = pending.get(topic, ([], 2))
+            line_size = len(line.encode("utf-8")) + (1 if batch else 0)
+
+            if(batch and size + line_size > self.batch_limit):
+                yield from self.build(topic, batch, size)
+                batch, size = [], 2
+                line_size = len(line.encode("utf-8"))
+
+            if(size + line_size > self.batch_limit):
+                logger.warning(f"Reading larger than the {self.batch_limit} byte batch limit, sending it on its own")
+
+            batch.append(line)
+            pending[topic] = (batch, size + line_size)
+            self.readings_packed += 1
+
+        for topic, (batch, size) in pending.items():
+            yield from self.build(topic, batch, size)
+
+    def record_batches(self, readings):
+        """
+        Yields (topic, payload) pairs packing every Reading as channel records, in order
+        """
+        topic = f"{self.base_topic}/{self.cycle_topic}{RECORDS_SUFFIX}"
+        writer = RecordWriter()
+        payload = bytearray()
+
+        for reading in readings:
+            record = writer.encode(reading)
+
+            if(payload and len(payload) + len(record) > self.max_payload):
+                self.raw_bytes += len(payload)
+                yield self.finish(topic, bytes(payload), len(payload))
+
+                writer = RecordWriter()
+                payload = bytearray()
+                record = writer.encode(reading)
+
+            payload.extend(record)
+            self.readings_packed += 1
+
+        if(payload):
+            self.raw_bytes += len(payload)
+            yield self.finish(topic, bytes(payload), len(payload))
+
+    def series_batches(self, readings):
+        """
+        Yields (topic, payload) pairs packing every Reading into series blocks of at most max_payload bytes.
+        The whole window is encoded at once, so readings has to fit in memory
+        """
+        topic = f"{self.base_topic}/{self.cycle_topic}{SERIES_SUFFIX}"
+        readings = list(readings)
+        self.readings_packed += len(readings)
+
+        if(not readings):
+            return
+
+        for block in encode_blocks(readings, self.max_payload):
+            self.raw_bytes += len(block)
+            yield self.finish(topic, block, len(block))
+
+    def metrics(self):
+        """
+        Returns this publisher's packing and compression counts, for the metrics topic
+        """
+        return {
+            'readings': self.readings_packed,
+            'messages': self.messages_built,
+            'raw_bytes': self.raw_bytes,
+            'payload_bytes': self.bytes_built,
+            'bytes_on_air': self.bytes_on_air,
+            'compression_ratio': round(self.compression_ratio, 2)
+            }
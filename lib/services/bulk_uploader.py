@@ -0,0 +1,156 @@
+from json import dump, load
+import os
+from services.global_logger import logger
+from services.sample_queue import CURSOR_NAME, CURSOR_TMP_NAME
+
+UPLOAD_MANIFEST_PATH = "/sd/upload_manifest.json"
+MAX_BODY = 128 * 1024      # AWS IoT's limit on an HTTPS publish payload
+SCAN_CHUNK = 512           # bytes read back from the end of a part to find its last full line
+
+class BulkUploader:
+    """
+    Sends backlogged data files to the broker with one HTTPS POST per file through the modem's HTTP client,
+    instead of one MQTT publish per few hundred bytes.
+
+    Files are read straight from flash. Parts are cut at the last full line under max_body bytes, so every
+    POST is a whole number of CSV/JSON lines. How far each file has been sent is kept in a manifest on the
+    SD card, so append-only files (like the hrd CSVs) only ever send what was added since the last upload.
+    Files named in exclude are never sent, by default the sample queue's cursor files.
+    """
+
+    def __init__(self, modem, url_template, directories, max_body=MAX_BODY, exclude=(CURSOR_NAME, CURSOR_TMP_NAME), manifest_path=UPLOAD_MANIFEST_PATH):
+        self.modem = modem
+        self.url_template = url_template
+        self.directories = directories
+        self.max_body = max_body
+        self.exclude = exclude
+        self.manifest_path = manifest_path
+
+        self.buffer = bytearray(SCAN_CHUNK)
+        self.manifest = self.load_manifest()
+
+        self.bytes_sent = 0
+        self.seconds = 0
+        self.posts = 0
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, "r") as manifest_file:
+                return load(manifest_file)
+        except Exception:
+            return {}
+
+    def save_manifest(self):
+        try:
+            with open(self.manifest_path, "w") as manifest_file:
+                dump(self.manifest, manifest_file)
+        except OSError as e:
+            logger.warning(f"Failed to save upload manifest: {e}")
+
+    def pending(self):
+        """
+        Returns (path, offset, size) for every file with data that hasn't been uploaded yet
+        """
+        files = []
+
+        for directory in self.directories:
+            try:
+                names = sorted(os.listdir(directory))
+            except OSError:
+                continue
+
+            for name in names:
+                if name in self.exclude:
+                    continue
+
+                path = f"{directory}/{name}"
+                size = os.stat(path)[6]
+                offset = self.manifest.get(path, 0)
+
+                #The file was truncated or replaced since the last upload, start it over
+                if(offset > size):
+                    offset = 0
+
+                if(size > offset):
+                    files.append((path, offset, size))
+
+        return files
+
+    def queued_bytes(self):
+        return sum(size - offset for path, offset, size in self.pending())
+
+    def url_for(self, path):
+        name = path.rsplit("/", 1)[-1].split(".")[0]
+
+        return self.url_template.format(name=name)
+
+    def part_length(self, path, offset, size):
+        """
+        Returns how many bytes from offset make up the next part: everything left if it fits in max_body,
+        otherwise up to and including the last newline that does
+        """
+        if(size - offset <= self.max_body):
+            return size - offset
+
+        end = offset + self.max_body
+
+        with open(path, "rb") as file:
+            while end > offset:
+                start = max(offset, end - len(self.buffer))
+                file.seek(start)
+                count = file.readinto(self.buffer)
+                count = min(count, end - start)
+
+                newline = bytes(self.buffer[:count]).rfind(b"\n")
+                if(newline >= 0):
+                    return start + newline + 1 - offset
+
+                end = start
+
+        logger.warning(f"No line break in {self.max_body} bytes of {path}, splitting mid-line")
+        return self.max_body
+
+    def upload_file(self, path, offset=0, size=None):
+        """
+        POSTs a file from offset in parts of at most max_body bytes. Returns the offset it got up to
+        """
+        size = size if size is not None else os.stat(path)[6]
+        url = self.url_for(path)
+
+        while offset < size:
+            length = self.part_length(path, offset, size)
+            result = self.modem.http_post_file(url, path, offset, length, self.buffer)
+
+            if(result is None or result['err'] != 0 or not 200 <= result['http_code'] < 300):
+                logger.warning(f"Upload of {path} stopped at byte {offset}: {result}")
+                break
+
+            offset += result['bytes']
+            self.bytes_sent += result['bytes']
+            self.seconds += result['seconds']
+            self.posts += 1
+
+        return offset
+
+    def upload(self):
+        """
+        Uploads everything pending, saving progress after each file. Returns True if nothing is left
+        """
+        complete = True
+
+        for path, offset, size in self.pending():
+            sent_to = self.upload_file(path, offset, size)
+
+            if(sent_to != offset):
+                self.manifest[path] = sent_to
+                self.save_manifest()
+
+            if(sent_to < size):
+                complete = False
+                break
+
+        return complete
+
+    @property
+    def bytes_per_second(self):
+        return self.bytes_sent / self.seconds if self.seconds else 0
@@ -0,0 +1,265 @@
+from json import dump, load
+import os
+import time
+from reading import Reading
+from services.global_logger import logger
+
+QUEUE_DIR = "/sd/sample_data"
+SEGMENT_SIZE = 16 * 1024            # bytes a segment grows to before the next cycle starts a new one
+MAX_QUEUE_BYTES = 64 * 1024 * 1024  # oldest segments are dropped, unsent, past this
+SEGMENT_SUFFIX = ".seg"
+CURSOR_NAME = "cursor.json"
+CURSOR_TMP_NAME = "cursor.tmp"
+
+class SampleQueue:
+    """
+    Append-only outbound queue of sample data on the SD card, so a cycle that can't transmit keeps its
+    samples for the next one instead of having them overwritten.
+
+    Each cycle's samples are appended to the newest segment file (00000001.seg, 00000002.seg, ...), and a
+    new segment is started once it passes segment_size. A cursor file records how far the data has been
+    acknowledged, and only moves when a send confirms it: MQTT pubacks or HTTP 2xx responses. Segments
+    wholly behind the cursor are deleted. The cursor is written to a temporary file first, then renamed
+    over the old one, so a reset part way through leaves one or the other.
+
+    drain() (drain_async() under asyncio) sends everything past the cursor oldest-first, one segment at a time, and keeps the queue depth
+    and drain rate for take_readings(). A segment that's only partly acknowledged is sent again from the
+    cursor, so the cloud can see a reading twice, but never misses one.
+    """
+
+    def __init__(self, directory=QUEUE_DIR, segment_size=SEGMENT_SIZE, max_bytes=MAX_QUEUE_BYTES):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+
+        try:
+            os.listdir(directory)
+        except OSError:
+            logger.info(f"Creating sample queue directory: {directory}")
+            os.mkdir(directory)
+
+        self.segments = self.list_segments()
+        self.cursor = self.load_cursor()
+
+        self.bytes_drained = 0
+        self.seconds_draining = 0
+
+    def path_for(self, segment):
+        return f"{self.directory}/{segment:08d}{SEGMENT_SUFFIX}"
+
+    def size_of(self, segment):
+        try:
+            return os.stat(self.path_for(segment))[6]
+        except OSError:
+            return 0
+
+    def list_segments(self):
+        segments = []
+
+        for name in os.listdir(self.directory):
+            if name.endswith(SEGMENT_SUFFIX):
+                try:
+                    segments.append(int(name[:-len(SEGMENT_SUFFIX)]))
+                except ValueError:
+                    pass
+
+        return sorted(segments)
+
+    #---CURSOR---#
+    def load_cursor(self):
+        """
+        Returns the acknowledged (segment, offset), from the cursor file or, if a reset left only the new
+        one, the temporary file. Starts at the oldest segment if there's neither
+        """
+        for name in (CURSOR_NAME, CURSOR_TMP_NAME):
+            try:
+                with open(f"{self.directory}/{name}", "r") as cursor_file:
+                    cursor = load(cursor_file)
+                return (cursor['segment'], cursor['offset'])
+            except (OSError, ValueError, KeyError):
+                pass
+
+        return (self.segments[0] if self.segments else 1, 0)
+
+    def save_cursor(self):
+        path = f"{self.directory}/{CURSOR_NAME}"
+        tmp_path = f"{self.directory}/{CURSOR_TMP_NAME}"
+
+        try:
+            with open(tmp_path, "w") as cursor_file:
+                dump({'segment': self.cursor[0], 'offset': self.cursor[1]}, cursor_file)
+
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+            os.rename(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to save the sample queue cursor: {e}")
+
+    def commit(self, segment, offset):
+        """
+        Moves the cursor up to offset in segment, once everything before it has been acknowledged, and
+        deletes the segments it's left behind
+        """
+        newest = self.segments[-1] if self.segments else segment
+
+        #A fully sent segment that won't be appended to again is done with
+        if(segment < newest and offset >= self.size_of(segment)):
+            segment, offset = segment + 1, 0
+
+        self.cursor = (segment, offset)
+        self.save_cursor()
+        self.reclaim()
+
+    def reclaim(self):
+        while self.segments and self.segments[0] < self.cursor[0]:
+            segment = self.segments.pop(0)
+
+            try:
+                os.remove(self.path_for(segment))
+            except OSError as e:
+                logger.warning(f"Failed to remove sent segment {segment}: {e}")
+
+    #---WRITING---#
+    def open_segment(self, binary=False):
+        """
+        Returns the newest segment opened for appending, starting a new one if it's full
+        """
+        if(not self.segments or self.size_of(self.segments[-1]) >= self.segment_size):
+            self.segments.append(self.segments[-1] + 1 if self.segments else max(1, self.cursor[0]))
+
+        self.limit()
+
+        return open(self.path_for(self.segments[-1]), "ab" if binary else "a")
+
+    def limit(self):
+        """
+        Drops the oldest unsent segments once the queue is over max_bytes
+        """
+        while len(self.segments) > 1 and self.depth() > self.max_bytes:
+            segment = self.segments[0]
+            logger.warning(f"Sample queue over {self.max_bytes} bytes, dropping {self.depth_of(segment)} unsent bytes in segment {segment}")
+            self.commit(segment + 1, 0)
+
+    #---READING---#
+    def depth_of(self, segment):
+        size = self.size_of(segment)
+
+        if(segment < self.cursor[0]):
+            return 0
+        if(segment == self.cursor[0]):
+            return max(0, size - self.cursor[1])
+
+        return size
+
+    def depth(self):
+        """
+        Returns how many bytes are waiting to be acknowledged
+        """
+        return sum(self.depth_of(segment) for segment in self.segments)
+
+    def pending(self):
+        """
+        Returns (segment, path, offset, size) for every segment with data past the cursor, oldest first
+        """
+        files = []
+
+        for segment in self.segments:
+            size = self.size_of(segment)
+            offset = self.cursor[1] if segment == self.cursor[0] else 0
+
+            if(segment >= self.cursor[0] and size > offset):
+                files.append((segment, self.path_for(segment), offset, size))
+
+        return files
+
+    def begin_drain(self):
+        """
+        Returns pending(), logging the backlog if there's more than one segment of it
+        """
+        pending = self.pending()
+
+        if(len(pending) > 1):
+            queued = sum(size - offset for segment, path, offset, size in pending)
+            logger.info(f"Draining {queued} queued bytes in {len(pending)} segments")
+
+        return pending
+
+    def acknowledge(self, segment, offset, size, acked, started):
+        """
+        Commits what a send acknowledged in segment, sent from offset since time.monotonic() was started.
+        Returns True if the whole segment was acknowledged
+        """
+        if(acked > offset):
+            self.bytes_drained += acked - offset
+            self.seconds_draining += time.monotonic() - started
+            self.commit(segment, acked)
+
+        if(acked < size):
+            logger.warning(f"Segment {segment} acknowledged up to byte {acked} of {size}, keeping the rest queued")
+            return False
+
+        return True
+
+    def out_of_time(self, start, time_limit):
+        if(time_limit is not None and time.monotonic() - start > time_limit):
+            logger.info(f"Drain stopped after {time_limit} s, {self.depth()} bytes left for next cycle")
+            return True
+
+        return False
+
+    def drain(self, send, time_limit=None):
+        """
+        Sends the queue oldest-first with send(path, offset, size), which returns the offset everything has
+        been acknowledged up to, committing after each segment. Stops at the first segment that isn't sent
+        in full, or once time_limit seconds have gone. Returns True if the queue is empty
+        """
+        start = time.monotonic()
+
+        for segment, path, offset, size in self.begin_drain():
+            if(self.out_of_time(start, time_limit)):
+                break
+
+            segment_start = time.monotonic()
+
+            if(not self.acknowledge(segment, offset, size, send(path, offset, size), segment_start)):
+                break
+
+        return self.depth() == 0
+
+    async def drain_async(self, send, time_limit=None):
+        """
+        drain() for the asyncio main loop, with send(path, offset, size) a coroutine
+        """
+        start = time.monotonic()
+
+        for segment, path, offset, size in self.begin_drain():
+            if(self.out_of_time(start, time_limit)):
+                break
+
+            segment_start = time.monotonic()
+
+            if(not self.acknowledge(segment, offset, size, await send(path, offset, size), segment_start)):
+                break
+
+        return self.depth() == 0
+
+    @property
+    def drain_rate(self):
+        return self.bytes_drained / self.seconds_draining if self.seconds_draining else 0
+
+    def take_readings(self):
+        """
+        Returns the queue depth and, if anything was drained since the last call, the drain rate
+        """
+        readings = [Reading(self.depth(), "B", "Queue Depth")]
+
+        if(self.bytes_drained > 0):
+            readings.append(Reading(self.drain_rate, "B/s", "Queue Drain Rate"))
+
+        self.bytes_drained = 0
+        self.seconds_draining = 0
+
+        return readings
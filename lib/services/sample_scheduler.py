@@ -0,0 +1,112 @@
+import time
+from reading import Reading
+from services.global_logger import logger
+
+NS_PER_SECOND = 1000000000
+
+class SampleScheduler:
+    """
+    Paces a sampling window on absolute deadlines, start + k * period from time.monotonic_ns(), so time
+    spent taking a sample comes out of the wait for the next one instead of adding to it, and the rate
+    doesn't drift.
+
+    A sample that starts late, but inside its own period, is taken straight away and the lateness is
+    counted as jitter. Slots whose whole period has already passed are skipped and counted as overruns,
+    rather than taken back to back to catch up. The window ends after duration seconds, or after count
+    samples if a count is given instead.
+
+        scheduler = SampleScheduler(SAMPLE_FREQ, duration=SAMPLE_WINDOW_DURATION)
+        while scheduler.wait():
+            take_sample()
+    """
+
+    def __init__(self, frequency, duration=None, count=None):
+        self.period = round(NS_PER_SECOND / frequency)
+        self.duration = round(duration * NS_PER_SECOND) if duration is not None else None
+        self.count = count
+
+        self.start_time = None
+        self.deadline = None
+        self.slot = 0
+        self.samples = 0
+        self.overruns = 0
+        self.jitter_total = 0
+        self.jitter_max = 0
+
+    def start(self):
+        self.start_time = time.monotonic_ns()
+        self.slot = 0
+        self.samples = 0
+        self.overruns = 0
+        self.jitter_total = 0
+        self.jitter_max = 0
+
+    def next_delay(self):
+        """
+        Returns the seconds until the next sample is due (0 if it's late), or None once the window is over
+        """
+        if(self.start_time is None):
+            self.start()
+
+        now = time.monotonic_ns()
+        deadline = self.start_time + self.slot * self.period
+
+        if(now - deadline >= self.period):
+            missed = (now - deadline) // self.period
+            self.overruns += missed
+            self.slot += missed
+            deadline += missed * self.period
+            logger.info(f"Sampling overran, skipped {missed} slot(s)")
+
+        if(self.count is not None and self.samples >= self.count):
+            return None
+
+        if(self.duration is not None and deadline - self.start_time >= self.duration):
+            return None
+
+        self.deadline = deadline
+
+        return max(0, deadline - now) / NS_PER_SECOND
+
+    def begin_sample(self):
+        """
+        Marks the due sample as started, recording how late it is
+        """
+        jitter = max(0, time.monotonic_ns() - self.deadline)
+
+        self.jitter_total += jitter
+        self.jitter_max = max(self.jitter_max, jitter)
+        self.slot += 1
+        self.samples += 1
+
+    def wait(self):
+        """
+        Sleeps until the next sample is due and marks it started. Returns False once the window is over
+        """
+        delay = self.next_delay()
+
+        if(delay is None):
+            return False
+
+        if(delay > 0):
+            time.sleep(delay)
+
+        self.begin_sample()
+
+        return True
+
+    @property
+    def jitter_mean(self):
+        return self.jitter_total / self.samples if self.samples else 0
+
+    def take_readings(self):
+        """
+        Returns this window's sample jitter (mean and max, in ms) and overrun count
+        """
+        elapsed = (time.monotonic_ns() - self.start_time) / NS_PER_SECOND if self.start_time is not None else 0
+        mean_ms, max_ms = self.jitter_mean / 1000000, self.jitter_max / 1000000
+
+        logger.info(f"Sampled {self.samples} times in {elapsed:.2f} s ({NS_PER_SECOND / self.period:.1f} Hz requested), "
+                    f"jitter {mean_ms:.1f} ms mean / {max_ms:.1f} ms max, {self.overruns} overruns")
+
+        return [Reading((mean_ms, max_ms), "ms", "Sample Jitter"), Reading(self.overruns, "-", "Sample Overruns")]
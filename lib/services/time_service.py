@@ -0,0 +1,152 @@
+import time
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+from reading import Reading
+from services.global_logger import logger
+
+# ---- Sources ---- #
+SOURCE_MODEM = "modem"      # network time (NITZ) through AT+QLTS, or the modem clock through AT+CCLK?
+SOURCE_GPS = "gps"          # the attitude board GPS's RMC time, once it has a fix
+SOURCE_DS3231 = "ds3231"    # what the onboard RTC is copied from at boot
+
+MIN_CLOCK_YEAR = 2024       # anything earlier is a clock that was never set, like the modem's power-on default
+MIN_CORRECTION = 1          # seconds of drift the clocks are left alone with
+
+class TimeService:
+    """
+    Keeps the DS3231 and the onboard RTC on UTC from the fastest source available at the time.
+
+    step() asks the modem (once it's registered) and then the GPS (once it has a fix) for the time, one
+    query each, and never waits on either, so it can be called from the warmup and measure loops;
+    step_async() does the same through the asyncio main loop's AsyncModem. The first answer sets both
+    clocks, and then nothing is asked again for resync_interval seconds. Until then the clocks keep the
+    DS3231 time they were given at boot. Each sync's offset (0 when the clocks agreed) is logged and handed
+    out once as a "Clock Offset" reading.
+    """
+
+    def __init__(self, rtc_device, onboard_rtc, modem=None, gps=None, resync_interval=6 * 3600):
+        self.rtc_device = rtc_device
+        self.onboard_rtc = onboard_rtc
+        self.modem = modem
+        self.gps = gps
+        self.resync_interval = resync_interval
+
+        self.source = SOURCE_DS3231
+        self.offset = None          # seconds added to the clocks by the last sync
+        self.synced_at = None       # time.monotonic() of the last sync
+        self.pending_reading = None
+
+    @property
+    def due(self):
+        return self.synced_at is None or time.monotonic() - self.synced_at >= self.resync_interval
+
+    def modem_time(self):
+        if(self.modem is None or not self.modem.is_up or not self.modem.is_registered_to_network()):
+            return None
+
+        network_time = self.modem.get_network_time()
+        if(network_time is not None):
+            return network_time
+
+        return self.modem.get_clock_time()
+
+    async def modem_time_async(self, modem):
+        if(modem is None or not modem.modem.is_up or not await modem.is_registered_to_network()):
+            return None
+
+        network_time = await modem.get_network_time()
+        if(network_time is not None):
+            return network_time
+
+        return await modem.get_clock_time()
+
+    def gps_time(self):
+        if(self.gps is None or not self.gps.enabled):
+            return None
+
+        try:
+            if(not self.gps.base_device.fix_quality):
+                return None
+
+            utc = self.gps.base_device.datetime
+        except Exception as e:
+            logger.warning(f"Failed to read GPS time: {e}")
+            return None
+
+        if(utc is None or utc.tm_year < MIN_CLOCK_YEAR):
+            return None
+
+        return time.mktime(utc)
+
+    def step(self, use_modem=True):
+        """
+        Sets the clocks from the modem or the GPS if either has the time right now. Returns True once they've
+        been set within the last resync_interval
+        """
+        if(not self.due):
+            return True
+
+        return self.settle(self.modem_time() if use_modem else None)
+
+    async def step_async(self, modem):
+        """
+        step() with the modem queried through an AsyncModem, so the other tasks keep running
+        """
+        if(not self.due):
+            return True
+
+        return self.settle(await self.modem_time_async(modem))
+
+    def settle(self, now):
+        """
+        Sets the clocks from the modem's time now, or the GPS if the modem didn't have it
+        """
+        source = SOURCE_MODEM
+
+        if(now is None):
+            source = SOURCE_GPS
+            now = self.gps_time()
+
+        if(now is None):
+            return False
+
+        self.apply(now, source)
+
+        return True
+
+    def apply(self, now, source):
+        offset = now - time.time()
+
+        self.source = source
+        self.offset = offset
+        self.synced_at = time.monotonic()
+
+        if(abs(offset) < MIN_CORRECTION):
+            logger.info(f"Clocks agree with {source} time")
+            self.pending_reading = Reading(offset, "s", "Clock Offset")
+            return
+
+        utc = time.localtime(now)
+
+        try:
+            self.rtc_device.datetime = utc
+        except Exception as e:
+            logger.warning(f"Failed to set DS3231: {e}")
+
+        try:
+            self.onboard_rtc.datetime = utc
+        except Exception as e:
+            logger.warning(f"Failed to set onboard RTC: {e}")
+
+        logger.info(f"Set clocks from {source} time, corrected by {offset:+} s")
+        self.pending_reading = Reading(offset, "s", "Clock Offset")
+
+    def take_reading(self):
+        """
+        Returns the correction from the last sync as a Reading, once, or None
+        """
+        reading, self.pending_reading = self.pending_reading, None
+
+        return reading
@@ -0,0 +1,153 @@
+import time
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+from reading import Reading
+from services.global_logger import logger
+
+def median(values):
+    if not values:
+        return None
+
+    values = sorted(values)
+
+    return values[len(values) // 2]
+
+class TransmitScheduler:
+    """
+    Holds transmissions back while the cellular link is poor, so data goes out in fewer, larger batches on
+    a good link instead of retrying slowly on a bad one.
+
+    should_transmit() takes a few signal readings (AT+CSQ, and AT+QCSQ for RSRP/RSRQ on LTE) and says to
+    transmit when their medians clear the thresholds, or when data has been held for max_latency seconds
+    whatever the link. should_transmit_async() does the same through the asyncio main loop's AsyncModem,
+    awaiting between readings. record() reports the seconds and estimated energy spent per KB transmitted,
+    from the time the transmit took and the modem's average power draw while transmitting.
+    """
+
+    def __init__(self, modem, min_rsrp=-115, min_rsrq=-15, min_csq=8, max_latency=3600, transmit_power=0.6, samples=3, sample_interval=0.3):
+        self.modem = modem
+        self.min_rsrp = min_rsrp                # dBm
+        self.min_rsrq = min_rsrq                # dB
+        self.min_csq = min_csq                  # AT+CSQ rssi (0-31), used when there's no LTE RSRP/RSRQ
+        self.max_latency = max_latency          # seconds
+        self.transmit_power = transmit_power    # watts
+        self.samples = samples
+        self.sample_interval = sample_interval
+
+        self.deferred_since = None      # time.monotonic() of the first cycle held back
+        self.deferrals = 0
+        self.pending_readings = []
+
+    def sample_signal(self):
+        """
+        Returns the median CSQ rssi, RSRP and RSRQ over a few readings, None for any the modem didn't report
+        """
+        csq, rsrp, rsrq = [], [], []
+
+        for index in range(self.samples):
+            self.add_sample(csq, rsrp, rsrq, self.modem.get_signal_quality(), self.modem.get_serving_signal_quality())
+
+            if(index < self.samples - 1):
+                time.sleep(self.sample_interval)
+
+        return {'csq': median(csq), 'rsrp': median(rsrp), 'rsrq': median(rsrq)}
+
+    async def sample_signal_async(self, modem):
+        """
+        sample_signal() through an AsyncModem
+        """
+        csq, rsrp, rsrq = [], [], []
+
+        for index in range(self.samples):
+            self.add_sample(csq, rsrp, rsrq, await modem.get_signal_quality(), await modem.get_serving_signal_quality())
+
+            if(index < self.samples - 1):
+                await asyncio.sleep(self.sample_interval)
+
+        return {'csq': median(csq), 'rsrp': median(rsrp), 'rsrq': median(rsrq)}
+
+    def add_sample(self, csq, rsrp, rsrq, signal_quality, serving_signal_quality):
+        if(signal_quality is not None and signal_quality['rssi'] is not None and signal_quality['rssi'] != 99):
+            csq.append(signal_quality['rssi'])
+
+        if(serving_signal_quality is not None and serving_signal_quality.get('rsrp') is not None and serving_signal_quality.get('rsrq') is not None):
+            rsrp.append(serving_signal_quality['rsrp'])
+            rsrq.append(serving_signal_quality['rsrq'])
+
+    def link_is_good(self, signal):
+        if(signal['rsrp'] is not None):
+            return signal['rsrp'] >= self.min_rsrp and signal['rsrq'] >= self.min_rsrq
+
+        if(signal['csq'] is not None):
+            return signal['csq'] >= self.min_csq
+
+        return False
+
+    def should_transmit(self):
+        """
+        Returns True if this cycle should transmit
+        """
+        return self.decide(self.sample_signal())
+
+    async def should_transmit_async(self, modem):
+        return self.decide(await self.sample_signal_async(modem))
+
+    def decide(self, signal):
+        if(signal['rsrp'] is not None):
+            self.pending_readings.append(Reading(signal['rsrp'], "dBm", "Signal RSRP"))
+            self.pending_readings.append(Reading(signal['rsrq'], "dB", "Signal RSRQ"))
+
+        if(signal['csq'] is not None):
+            self.pending_readings.append(Reading(signal['csq'], "-", "Signal CSQ"))
+
+        now = time.monotonic()
+
+        if(self.link_is_good(signal)):
+            if(self.deferred_since is not None):
+                logger.info(f"Link is good ({signal}), sending data held for {now - self.deferred_since:.0f} s")
+
+            self.deferred_since = None
+            self.deferrals = 0
+            return True
+
+        if(self.deferred_since is None):
+            self.deferred_since = now
+
+        held = now - self.deferred_since
+
+        if(held >= self.max_latency):
+            logger.warning(f"Link still poor ({signal}) after holding data for {held:.0f} s, transmitting anyway")
+            self.deferred_since = None
+            self.deferrals = 0
+            return True
+
+        self.deferrals += 1
+        logger.info(f"Link poor ({signal}), holding data ({held:.0f}/{self.max_latency} s, {self.deferrals} cycles)")
+
+        return False
+
+    def record(self, bytes_sent, seconds):
+        """
+        Logs how long, and how much energy, a transmit of bytes_sent bytes took per KB
+        """
+        if(bytes_sent <= 0):
+            return
+
+        kilobytes = bytes_sent / 1024
+        seconds_per_kb = seconds / kilobytes
+        energy_per_kb = seconds * self.transmit_power / kilobytes
+
+        logger.info(f"Transmitted {bytes_sent} bytes in {seconds:.1f} s: {seconds_per_kb:.2f} s/KB, {energy_per_kb:.2f} J/KB")
+
+        self.pending_readings.append(Reading(seconds_per_kb, "s/KB", "Transmit Time Per KB"))
+        self.pending_readings.append(Reading(energy_per_kb, "J/KB", "Transmit Energy Per KB"))
+
+    def take_readings(self):
+        """
+        Returns the signal and transmit cost readings gathered since the last call
+        """
+        readings, self.pending_readings = self.pending_readings, []
+
+        return readings